@@ -0,0 +1,322 @@
+"""
+Performance benchmarks for UtilityFunctions, ECGDerivedRR, IMUDerivedRR and LiveDerivation.
+
+Measures, on synthetic signals (SyntheticSignals) at several lengths and on a few real
+sessions:
+  - wall time of each public DSP function (best of N, plus median) and its peak
+    Python-allocated memory (tracemalloc, measured in a separate untimed call),
+  - LiveDerivation per-hop latency and per-sample throughput when streaming,
+  - import time of each module in a fresh interpreter.
+Results are saved as JSON; pass --baseline to compare against an earlier run. Any metric
+that got worse by more than --threshold (relative) is reported and the exit code is 1.
+
+    python DSPBenchmark.py --out baseline.json
+    python DSPBenchmark.py --out new.json --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import UtilityFunctions as UF
+import ECGDerivedRR as ECG
+import IMUDerivedRR as IMU
+import FastKernels as FK
+import SyntheticSignals as SS
+
+HERE = Path(__file__).resolve().parent
+SESSION_FOLDER = HERE / "Recording Scripts" / "Recording Sessions"
+DEFAULT_SESSIONS = ("B1GoodSittingrecording_20251012_125214.csv",
+                    "J1GoodStandingrecording_20251012_122240.csv",
+                    "B3GoodSupinerecording_20251012_132339.csv")
+
+LENGTHS_S = (30, 120, 600)
+IMPORT_MODULES = ("UtilityFunctions", "ECGDerivedRR", "IMUDerivedRR", "LiveDerivationClass", "FastKernels")
+
+IMU_FS = 50.0
+ECG_FS = 500.0
+RESP_RATE_BRPM = 15.0
+
+
+def TimeCall(func, repeats):
+    """(best, median) wall time of func() in ms."""
+    times = timeit.repeat(func, number=1, repeat=repeats)
+    return 1e3 * min(times), 1e3 * float(np.median(times))
+
+def PeakMemory(func):
+    """Peak memory (KiB) allocated while func() runs, as seen by tracemalloc."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def FunctionCases(durationS, seed=0):
+    """Zero-argument calls of each public DSP function on durationS seconds of synthetic data."""
+    ecg, ecgTime = SS.SyntheticECG(durationS, fs=ECG_FS, respRateBrpm=RESP_RATE_BRPM, seed=seed)
+    imuTime, ax, ay, az, pitch = SS.SyntheticIMU(durationS, fs=IMU_FS, respRateBrpm=RESP_RATE_BRPM, seed=seed)
+    _, accelPitch = IMU.AccelTilt(ax, ay, az)
+    manual = SS.SyntheticManual(imuTime, RESP_RATE_BRPM)
+
+    imuStack = UF.StackChannels(az, pitch, accelPitch)
+    imuFiltered = UF.BandpassFilter(imuStack, IMU_FS)
+    qrs = ECG.QrsBandpass(ecg, ECG_FS)
+    am, amTime, _ = ECG.CalcAM(ecg, ecgTime, ECG_FS)
+    edrBw, edrBwTime, _ = ECG.EdrBaselineWander(ecg, ecgTime, ECG_FS)
+
+    return {
+        "UF.BandpassFilter[ECG]": lambda: UF.BandpassFilter(ecg, ECG_FS, low=0.5, high=40.0),
+        "UF.BandpassFilter[IMU x3]": lambda: UF.BandpassFilter(imuStack, IMU_FS),
+        "UF.Decimate": lambda: UF.Decimate(ecg, ECG_FS, 10.0),
+        "UF.MOBrpm": lambda: UF.MOBrpm(manual, imuTime),
+        "ECG.QrsBandpass": lambda: ECG.QrsBandpass(ecg, ECG_FS),
+        "ECG.DetectRPeaks": lambda: ECG.DetectRPeaks(qrs, ECG_FS),
+        "ECG.CalcAM": lambda: ECG.CalcAM(ecg, ecgTime, ECG_FS),
+        "ECG.CalcBW": lambda: ECG.CalcBW(ecg, ecgTime, ECG_FS),
+        "ECG.EdrBaselineWander": lambda: ECG.EdrBaselineWander(ecg, ecgTime, ECG_FS),
+        "ECG.CountOrigWindows": lambda: ECG.CountOrigWindows(am, amTime),
+        "ECG.EstimateRRWindows": lambda: ECG.EstimateRRWindows(edrBwTime, edrBw, winSeconds=32, hopSeconds=8),
+        "IMU.CombineRREstimates": lambda: IMU.CombineRREstimates(imuFiltered[0], IMU_FS),
+        "IMU.CombineRREstimatesBatch": lambda: IMU.CombineRREstimatesBatch(imuFiltered, IMU_FS),
+        "IMU.RRFromWelch": lambda: IMU.RRFromWelch(imuFiltered, IMU_FS),
+    }
+
+def BenchFunctions(lengths=LENGTHS_S, repeats=5):
+    results = []
+    for durationS in lengths:
+        for name, func in FunctionCases(durationS).items():
+            func()  # warm caches (filter design, kernel compile) outside the timing
+            best, median = TimeCall(func, repeats)
+            results.append({"name": name, "durationS": durationS, "bestMs": best,
+                            "medianMs": median, "peakKiB": PeakMemory(func)})
+    return results
+
+
+def BenchLive(durationS=120, dtype=np.float64, window=30, hop=1):
+    """Stream synthetic IMU + ECG through LiveDerivation, timing every call."""
+    from LiveDerivationClass import LiveDerivation
+
+    imuTime, ax, ay, az, pitch = SS.SyntheticIMU(durationS, fs=IMU_FS, respRateBrpm=RESP_RATE_BRPM)
+    _, accelPitch = IMU.AccelTilt(ax, ay, az)
+    manual = SS.SyntheticManual(imuTime, RESP_RATE_BRPM)
+    ecg, _ = SS.SyntheticECG(durationS, fs=ECG_FS, respRateBrpm=RESP_RATE_BRPM)
+    ecgPerIMU = int(round(ECG_FS / IMU_FS))
+
+    live = LiveDerivation(IMU_FS, ECG_FS, slidingWindow=window, hopInterval=hop, dtype=dtype)
+    sampleNs, imuHopNs, edrHopNs = [], [], []
+    clock = time.perf_counter_ns
+
+    tStart = clock()
+    with contextlib.redirect_stdout(io.StringIO()):  # Update reports warm-up progress per sample
+        for i in range(imuTime.size):
+            for ecgSample in ecg[i * ecgPerIMU:(i + 1) * ecgPerIMU]:
+                live.UpdateECG(ecgSample)
+
+            t0 = clock()
+            result = live.Update(az[i], pitch[i], accelPitch[i], manual[i])
+            t1 = clock()
+            (imuHopNs if result is not None else sampleNs).append(t1 - t0)
+
+            if live.nSinceLastECG >= live.hopNECG and len(live.buffECG) >= live.sampleWindowECG:
+                t0 = clock()
+                live.ComputeEDR()
+                edrHopNs.append(clock() - t0)
+    wallS = (clock() - tStart) / 1e9
+
+    def Percentiles(ns):
+        ms = np.asarray(ns, dtype=float) / 1e6
+        if ms.size == 0:
+            return {"p50Ms": np.nan, "p95Ms": np.nan, "maxMs": np.nan}
+        return {"p50Ms": float(np.percentile(ms, 50)), "p95Ms": float(np.percentile(ms, 95)), "maxMs": float(ms.max())}
+
+    nSamples = imuTime.size + ecg.size
+    return {
+        "durationS": durationS,
+        "dtype": np.dtype(dtype).name,
+        "imuHop": Percentiles(imuHopNs),
+        "edrHop": Percentiles(edrHopNs),
+        "perSampleUs": float(np.mean(sampleNs) / 1e3) if sampleNs else np.nan,
+        "samplesPerS": nSamples / wallS,
+        "realtimeFactor": durationS / wallS,
+    }
+
+
+def BenchSessions(names=DEFAULT_SESSIONS, folder=SESSION_FOLDER, repeats=3):
+    """Offline pipeline stages on real recordings (no result cache)."""
+    import DataLoading as DL
+
+    results = []
+    for name in names:
+        path = Path(folder) / name
+        if not path.exists():
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            loadMs, _ = TimeCall(lambda: DL.LoadData(path, saveBadRows=False), repeats)
+            df = DL.LoadData(path, saveBadRows=False)
+        dfIMU = df[df["az"].notna()].sort_values("Time (s)").reset_index(drop=True)
+        dfECG = df[df["heart"].notna()].sort_values("Time (s)").reset_index(drop=True)
+        ecg, ecgTime = ECG.GetRawECG(dfECG)
+        imuStack = UF.StackChannels(dfIMU["az"], dfIMU["pitch"], dfIMU["roll"])
+
+        def AMPath():
+            am, amTime, _ = ECG.CalcAM(ecg, ecgTime, ECG_FS)
+            return ECG.CountOrigWindows(am, amTime)
+
+        def IMUPath():
+            return IMU.CombineRREstimatesBatch(UF.BandpassFilter(imuStack, IMU_FS), IMU_FS)
+
+        AMPath(), IMUPath()
+        results.append({
+            "session": name,
+            "durationS": float(ecgTime[-1] - ecgTime[0]),
+            "loadMs": loadMs,
+            "amPathMs": TimeCall(AMPath, repeats)[0],
+            "bwPathMs": TimeCall(lambda: ECG.EdrBaselineWander(ecg, ecgTime, ECG_FS), repeats)[0],
+            "imuPathMs": TimeCall(IMUPath, repeats)[0],
+        })
+    return results
+
+
+def BenchImports(modules=IMPORT_MODULES, repeats=3):
+    """Import time (ms) of each module in a fresh interpreter, best of repeats."""
+    code = "import time, importlib, sys; t = time.perf_counter(); importlib.import_module(sys.argv[1]); print(time.perf_counter() - t)"
+    results = {}
+    for module in modules:
+        times = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", code, module], cwd=HERE,
+                                 capture_output=True, text=True, check=True)
+            times.append(float(out.stdout.strip()))
+        results[module] = 1e3 * min(times)
+    return results
+
+
+def Metrics(report):
+    """Flatten a report to {metric: (value, higherIsBetter)} for comparison."""
+    metrics = {}
+    for r in report.get("functions", []):
+        key = f"{r['name']}@{r['durationS']}s"
+        metrics[f"time:{key}"] = (r["bestMs"], False)
+        metrics[f"mem:{key}"] = (r["peakKiB"], False)
+    live = report.get("live")
+    if live:
+        key = f"live@{live['durationS']}s/{live['dtype']}"
+        metrics[f"{key}:imuHop.p50Ms"] = (live["imuHop"]["p50Ms"], False)
+        metrics[f"{key}:imuHop.p95Ms"] = (live["imuHop"]["p95Ms"], False)
+        metrics[f"{key}:edrHop.p50Ms"] = (live["edrHop"]["p50Ms"], False)
+        metrics[f"{key}:edrHop.p95Ms"] = (live["edrHop"]["p95Ms"], False)
+        metrics[f"{key}:perSampleUs"] = (live["perSampleUs"], False)
+        metrics[f"{key}:samplesPerS"] = (live["samplesPerS"], True)
+    for r in report.get("sessions", []):
+        for stage in ("loadMs", "amPathMs", "bwPathMs", "imuPathMs"):
+            metrics[f"session:{r['session']}:{stage}"] = (r[stage], False)
+    for module, ms in report.get("imports", {}).items():
+        metrics[f"import:{module}"] = (ms, False)
+    return metrics
+
+def CompareToBaseline(report, baseline, threshold=0.2):
+    """Metrics present in both runs that got worse by more than threshold (relative)."""
+    current, base = Metrics(report), Metrics(baseline)
+    regressions = []
+    for name, (value, higherIsBetter) in current.items():
+        if name not in base:
+            continue
+        old = base[name][0]
+        if not (np.isfinite(value) and np.isfinite(old)) or old <= 0:
+            continue
+        change = (old - value) / old if higherIsBetter else (value - old) / old
+        if change > threshold:
+            regressions.append({"metric": name, "baseline": old, "current": value, "worseBy": change})
+    return sorted(regressions, key=lambda r: -r["worseBy"])
+
+
+def PrintReport(report):
+    print(f"\n--- Functions (kernel backend: {report['meta']['kernelBackend']}) ---")
+    print(f"{'function':<30}{'len (s)':>8}{'best (ms)':>11}{'median (ms)':>13}{'peak (KiB)':>12}")
+    for r in report["functions"]:
+        print(f"{r['name']:<30}{r['durationS']:>8}{r['bestMs']:>11.2f}{r['medianMs']:>13.2f}{r['peakKiB']:>12.0f}")
+
+    live = report.get("live")
+    if live:
+        print(f"\n--- LiveDerivation ({live['durationS']} s stream, {live['dtype']}) ---")
+        print(f"IMU hop: p50={live['imuHop']['p50Ms']:.2f} ms, p95={live['imuHop']['p95Ms']:.2f} ms, max={live['imuHop']['maxMs']:.2f} ms")
+        print(f"EDR hop: p50={live['edrHop']['p50Ms']:.2f} ms, p95={live['edrHop']['p95Ms']:.2f} ms, max={live['edrHop']['maxMs']:.2f} ms")
+        print(f"Non-hop sample: {live['perSampleUs']:.1f} us | throughput {live['samplesPerS']:.0f} samples/s "
+              f"({live['realtimeFactor']:.0f}x real time)")
+
+    if report.get("sessions"):
+        print("\n--- Real sessions ---")
+        for r in report["sessions"]:
+            print(f"{r['session']} ({r['durationS']:.0f} s): load {r['loadMs']:.1f} ms, AM {r['amPathMs']:.1f} ms, "
+                  f"BW {r['bwPathMs']:.1f} ms, IMU {r['imuPathMs']:.1f} ms")
+
+    if report.get("imports"):
+        print("\n--- Import time ---")
+        for module, ms in report["imports"].items():
+            print(f"{module:<22}{ms:>8.1f} ms")
+
+
+def RunBenchmarks(lengths=LENGTHS_S, repeats=5, liveS=120, dtype=np.float64, sessions=True, imports=True):
+    FK.LoadBackend()
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "kernelBackend": FK.BACKEND,
+        },
+        "functions": BenchFunctions(lengths, repeats),
+    }
+    if liveS:
+        report["live"] = BenchLive(liveS, dtype=dtype)
+    if sessions:
+        report["sessions"] = BenchSessions()
+    if imports:
+        report["imports"] = BenchImports()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the RR DSP modules.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=list(LENGTHS_S), help="synthetic signal lengths (s)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--live", type=int, default=120, help="seconds of live stream to simulate (0 to skip)")
+    parser.add_argument("--float32", action="store_true", help="run LiveDerivation in single precision")
+    parser.add_argument("--no-sessions", action="store_true", help="skip the real-session benchmarks")
+    parser.add_argument("--no-imports", action="store_true", help="skip the import-time benchmarks")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slow-down counted as a regression")
+    args = parser.parse_args()
+
+    report = RunBenchmarks(lengths=args.lengths, repeats=args.repeats, liveS=args.live,
+                           dtype=np.float32 if args.float32 else np.float64,
+                           sessions=not args.no_sessions, imports=not args.no_imports)
+    PrintReport(report)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = CompareToBaseline(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n--- {len(regressions)} regression(s) over {args.threshold:.0%} vs {args.baseline} ---")
+            for r in regressions:
+                print(f"{r['metric']:<60}{r['baseline']:>10.2f} -> {r['current']:>10.2f}  (+{r['worseBy']:.0%})")
+            sys.exit(1)
+        print(f"\nNo regressions over {args.threshold:.0%} vs {args.baseline}")
@@ -0,0 +1,239 @@
+import io
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import UtilityFunctions as UF
+import RecordingFormat as RF
+
+
+def LoadRRB(filePath, start=None, end=None):
+    """LoadData for the compressed .rrb format; only blocks overlapping [start, end) are decoded."""
+    cols = RF.ReadColumns(filePath, start=start, end=end)
+    df = pd.DataFrame({
+        "Timestamp": cols.tsUs / 1e6,
+        "Manual": cols.manual.astype(int),
+        **{name: cols.imu[i] for i, name in enumerate(RF.IMU_FIELDS)},
+        "heart": cols.heart,
+    })
+    df["Time (s)"] = df["Timestamp"] - cols.originUs / 1e6
+
+    n_imu = int((cols.kind == RF.KIND_IMU).sum())
+    print(f"[INFO] Parsed rows: {len(df)} (IMU={n_imu}, ECG={len(df) - n_imu})")
+    return df
+
+# Sidecar seek index of a recording CSV: one entry per ~intervalS of device time
+CSV_INDEX_DTYPE = np.dtype([
+    ("offset", np.int64),   # byte offset of the chunk's first line
+    ("end", np.int64),      # byte offset just past its last line
+    ("minUs", np.int64),    # earliest / latest unwrapped device micros in the chunk
+    ("maxUs", np.int64),
+])
+CSV_INDEX_SUFFIX = ".idx.npz"
+SCAN_BYTES = 1 << 22  # BuildCSVIndex reads the file in blocks of this size
+TS_WIDTH = 20         # bytes looked at per line for the leading ts_us field
+
+
+def IndexPath(filePath):
+    return Path(str(filePath) + CSV_INDEX_SUFFIX)
+
+def LeadingMicros(buf, starts):
+    """
+    ts_us of the lines starting at buf[starts] (uint8 array padded with TS_WIDTH newlines):
+    the digits after an optional opening quote, ended by a comma or the line end. NaN
+    where a line doesn't start that way.
+    """
+    cols = np.arange(TS_WIDTH)
+    starts = starts + (buf[starts] == ord('"'))
+    win = buf[starts[:, None] + cols]
+    isDigit = (win >= ord("0")) & (win <= ord("9"))
+    nDigits = np.argmin(np.c_[isDigit, np.zeros(len(starts), dtype=bool)], axis=1)
+    term = buf[starts + nDigits]
+    valid = (nDigits > 0) & (nDigits < TS_WIDTH - 1) & ((term == ord(",")) | (term == ord("\n")))
+
+    place = nDigits[:, None] - 1 - cols
+    digits = np.where(isDigit & (place >= 0), win.astype(np.int64) - ord("0"), 0)
+    value = (digits * 10 ** np.clip(place, 0, None)).sum(axis=1)
+    return np.where(valid, value, np.nan)
+
+def ScanLines(filePath, blockBytes=SCAN_BYTES):
+    """(lineStarts, ts) of every line of a file, read blockBytes at a time; see LeadingMicros."""
+    lineStarts, ts = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    pad = np.full(TS_WIDTH, ord("\n"), dtype=np.uint8)
+    with open(filePath, "rb") as f:
+        carry, base = np.zeros(0, dtype=np.uint8), 0  # unparsed tail, starting at a line start
+        while True:
+            block = f.read(blockBytes)
+            buf = np.concatenate([carry, np.frombuffer(block, dtype=np.uint8)])
+            starts = np.append(0, np.flatnonzero(buf == ord("\n")) + 1)
+            # A line is parsed once TS_WIDTH bytes of it are in hand and the next line has
+            # started (or the file ended); the rest carries over to the next block
+            if block:
+                done = starts < min(len(buf) - TS_WIDTH + 1, starts[-1])
+            else:
+                done = starts < len(buf)
+            if done.any():
+                lineStarts.append(base + starts[done])
+                ts.append(LeadingMicros(np.concatenate([buf, pad]), starts[done]))
+            if not block:
+                break
+            keep = starts[~done][0]
+            carry, base = buf[keep:], base + keep
+    return np.concatenate(lineStarts), np.concatenate(ts)
+
+def BuildCSVIndex(filePath, intervalS=1.0):
+    """
+    Scan a recording CSV once and write its sidecar index (<file>.idx.npz): byte ranges of
+    consecutive ~intervalS chunks with the device-time span of each. Rows arrive slightly
+    out of order (IMU vs ECG lines), so chunks carry their min and max time rather than
+    assuming sorted rows. Returns (chunks, originUs).
+    """
+    filePath = Path(filePath)
+    stat = filePath.stat()
+    lineStarts, ts = ScanLines(filePath)
+
+    # Data lines follow the header
+    starts = lineStarts[1:]
+    tsUs, _ = UF.UnwrapMicros(ts[1:])
+
+    valid = np.isfinite(tsUs)
+    chunks = np.zeros(0, dtype=CSV_INDEX_DTYPE)
+    originUs = int(tsUs[valid][0]) if valid.any() else 0
+    if valid.any():
+        # Chunk by the running maximum of time so every chunk is a contiguous run of lines
+        runningMax = np.fmax.accumulate(np.where(valid, tsUs, -np.inf))
+        chunkId = np.floor(np.maximum(runningMax - originUs, 0) / (intervalS * 1e6)).astype(np.int64)
+        first = np.flatnonzero(np.diff(chunkId, prepend=-1))
+        chunks = np.zeros(first.size, dtype=CSV_INDEX_DTYPE)
+        chunks["offset"] = starts[first]
+        chunks["end"] = np.append(starts[first[1:]], stat.st_size)
+        chunks["minUs"] = np.minimum.reduceat(np.where(valid, tsUs, np.inf), first)
+        chunks["maxUs"] = np.maximum.reduceat(np.where(valid, tsUs, -np.inf), first)
+
+    meta = np.array([stat.st_size, stat.st_mtime_ns, originUs, round(intervalS * 1e6)], dtype=np.int64)
+    try:
+        np.savez(IndexPath(filePath), chunks=chunks, meta=meta)
+    except OSError as e:
+        print(f"[WARN] Could not write index {IndexPath(filePath).name}: {e}")
+    return chunks, originUs
+
+def LoadCSVIndex(filePath, intervalS=1.0):
+    """Sidecar index of a recording CSV, rebuilt when missing, older than the CSV or built for another intervalS."""
+    stat = Path(filePath).stat()
+    try:
+        with np.load(IndexPath(filePath)) as f:
+            size, mtimeNs, originUs, intervalUs = (int(v) for v in f["meta"])
+            if size == stat.st_size and mtimeNs == stat.st_mtime_ns and intervalUs == round(intervalS * 1e6):
+                return f["chunks"], originUs
+    except (OSError, KeyError, ValueError):
+        pass
+    return BuildCSVIndex(filePath, intervalS)
+
+
+def ParseCSV(source, skiprows=1, nearUs=None):
+    """
+    Rows of a recording CSV (path or buffer) as the flat frame, without Time (s).
+    nearUs puts the unwrapped micros on the same wrap count as that time (for slices
+    parsed out of the middle of a file). Returns (df, kind, nWraps).
+    """
+    # Read two columns: the quoted inner CSV and Manual
+    df_in = pd.read_csv(
+        source,
+        header=None,
+        names=["ESP32_Data", "Manual"],
+        skiprows=skiprows,        # skip the ':ESP32_Data,Manual' header
+        quotechar='"',
+        engine="python"
+    )
+
+    # Split the quoted inner CSV into 11 tokens (ts_us, KIND, 9 payload slots)
+    parts = df_in["ESP32_Data"].astype(str).str.split(",", n=10, expand=True)
+    parts = parts.reindex(columns=range(11))
+    parts.columns = ["ts_us","kind","ax","ay","az","gx","gy","gz","roll","pitch","last"]
+
+    # Numeric conversions (coerce empties to NaN)
+    for c in ["ts_us","ax","ay","az","gx","gy","gz","roll","pitch","last"]:
+        parts[c] = pd.to_numeric(parts[c], errors="coerce")
+
+    # Map 'last' into head (IMU) or heart (ECG)
+    kind = parts["kind"].astype(str).str.upper()
+    head  = np.where(kind=="IMU", parts["last"], np.nan)
+    heart = np.where(kind=="ECG", parts["last"], np.nan)
+
+    # Device micros, unwrapped across micros() rollovers (every ~71.6 min)
+    tsUs, nWraps = UF.UnwrapMicros(parts["ts_us"].to_numpy())
+    finite = np.isfinite(tsUs)
+    if nearUs is not None and finite.any():
+        tsUs += np.round((nearUs - tsUs[finite][0]) / UF.MICROS_WRAP) * UF.MICROS_WRAP
+
+    # Build the flat table your downstream code expects
+    df = pd.DataFrame({
+        "Timestamp": tsUs / 1e6,   # seconds (device micros)
+        "Manual": pd.to_numeric(df_in["Manual"], errors="coerce").fillna(0).astype(int),
+        "ax": parts["ax"], "ay": parts["ay"], "az": parts["az"],
+        "gx": parts["gx"], "gy": parts["gy"], "gz": parts["gz"],
+        "roll": parts["roll"], "pitch": parts["pitch"], "head": head,
+        "heart": heart,
+    })
+    return df, kind, nWraps
+
+def SelectTimeRange(df, start=None, end=None):
+    """Rows with start <= Time (s) < end."""
+    t = df["Time (s)"]
+    keep = (t >= (-np.inf if start is None else start)) & (t < (np.inf if end is None else end))
+    return df[keep].reset_index(drop=True)
+
+def LoadCSVRange(filePath, start=None, end=None):
+    """LoadData for a time range of a CSV: only the byte range covering it is parsed."""
+    chunks, originUs = LoadCSVIndex(filePath)
+    # 1 us of slack so float round-off at the edges can't drop a chunk; the exact mask follows
+    lo = -np.inf if start is None else originUs + start * 1e6 - 1
+    hi = np.inf if end is None else originUs + end * 1e6 + 1
+    hit = np.flatnonzero((chunks["maxUs"] >= lo) & (chunks["minUs"] < hi))
+
+    if hit.size:
+        first, last = chunks[hit[0]], chunks[hit[-1]]
+        with open(filePath, "rb") as f:
+            f.seek(int(first["offset"]))
+            data = f.read(int(last["end"] - first["offset"]))
+        df, kind, _ = ParseCSV(io.BytesIO(data), skiprows=0, nearUs=int(first["minUs"]))
+    else:
+        df, kind, _ = ParseCSV(io.BytesIO(b'"0,NONE",0\n'), skiprows=0)
+        df, kind = df.iloc[:0], kind.iloc[:0]
+
+    df["Time (s)"] = df["Timestamp"] - originUs / 1e6
+    df = SelectTimeRange(df, start, end)
+    print(f"[INFO] Parsed rows: {len(df)} of {start}-{end} s via index "
+          f"({hit.size} of {len(chunks)} chunks)")
+    return df
+
+def LoadData(filePath, saveBadRows=True, start=None, end=None, useIndex=True):
+    """
+    Parses new lines like:
+    Builds a flat dataframe with columns:
+      Timestamp (sec), Time (s), Manual, ax..head, heart
+    start / end (s on the Time (s) axis) keep only rows with start <= Time (s) < end.
+    For CSVs a sidecar index (<file>.idx.npz, built on first use) limits parsing to the
+    byte range covering [start, end); useIndex=False parses the whole file instead.
+    .rrb recordings (RecordingFormat) are read block-wise, decoding only the blocks in range.
+    """
+    if Path(filePath).suffix.lower() == ".rrb":
+        return LoadRRB(filePath, start=start, end=end)
+    if useIndex and (start is not None or end is not None):
+        return LoadCSVRange(filePath, start, end)
+
+    df, kind, nWraps = ParseCSV(filePath)
+
+    # Relative time axis
+    df["Time (s)"] = df["Timestamp"] - df["Timestamp"].dropna().iloc[0]
+
+    # Log a quick summary (optional)
+    n_imu = (kind=="IMU").sum()
+    n_ecg = (kind=="ECG").sum()
+    print(f"[INFO] Parsed rows: {len(df)} (IMU={n_imu}, ECG={n_ecg})")
+    if nWraps:
+        print(f"[INFO] Unwrapped {nWraps} micros() rollover(s)")
+
+    if start is not None or end is not None:
+        df = SelectTimeRange(df, start, end)
+
+    return df
@@ -1,16 +1,17 @@
 import UtilityFunctions as UF
+import FastKernels as FK
 import numpy as np
-from scipy.signal import find_peaks
-from scipy.interpolate import interp1d
+# scipy.signal / scipy.interpolate are imported where used to keep module import cheap
 
 
-def GetRawECG(df):
-    ecg = df["heart"].to_numpy()
+def GetRawECG(df, dtype=None):
+    ecg = df["heart"].to_numpy() if dtype is None else df["heart"].to_numpy(dtype=dtype)
     t = df["Time (s)"].to_numpy(dtype=float)
     return ecg, t
 
 def DetectRRECG(signal, samplingFreq, sanityFilter=True):
     """Lightweight R-peak finder: bandpass then peaks with basic RR sanity."""
+    from scipy.signal import find_peaks
     ecgFiltered = UF.BandpassFilter(signal, samplingFreq, low=0.5, high=40.0, order=4)
     # Enforce physionlogical separation between peaks (250ms)
     distance = int(samplingFreq * 0.25)  # min Xms between beats
@@ -31,6 +32,7 @@ def DetectRRECG(signal, samplingFreq, sanityFilter=True):
     return peaks, rPeakIndices
 
 def DeriveEDRFromRPeaks(ecgSignal, timeSeconds, samplingFreq, respLowFreq=0.05, respHighFreq=0.8, outputTime=None):
+    from scipy.interpolate import interp1d
     # 1) detect R-peaks on the ECG and get a "filtered" ECG version to sample from.
     rPeaks, rPeakIndices = DetectRRECG(ecgSignal, samplingFreq)
 
@@ -42,7 +44,7 @@ def DeriveEDRFromRPeaks(ecgSignal, timeSeconds, samplingFreq, respLowFreq=0.05,
     # - The time of the R-peak (in seconds)
     # - The "Filtered" ECG Amplitude at that beat (This carries the respiration modulation)
     rPeakTimesSeconds = timeSeconds[rPeakIndices].astype(float)
-    rPeakAmplitudes = ecgSignal[rPeakIndices].astype(float)
+    rPeakAmplitudes = UF.FloatArray(ecgSignal[rPeakIndices])
 
     # 3) Beat amplitude outlier suppression (robust to ectopy/artifacts)
     # Clip extreme values so they don't domintate the interpolation or filtering.
@@ -59,13 +61,12 @@ def DeriveEDRFromRPeaks(ecgSignal, timeSeconds, samplingFreq, respLowFreq=0.05,
         fill_value="extrapolate",
         assume_sorted=True
     )
-    edrUniform = interpolateRampToUniform(outputTime)
+    edrUniform = interpolateRampToUniform(outputTime).astype(rPeakAmplitudes.dtype, copy=False)
 
     # 5) Determine the sampling rate of the uniform axis so we can filter correctly.
-    dtSeconds = np.median(np.diff(outputTime))
-    if not np.isfinite(dtSeconds) or dtSeconds <= 0:
+    samplingFreq = UF.SamplingRate(outputTime)
+    if not np.isfinite(samplingFreq):
         return None
-    samplingFreq = 1.0 / dtSeconds
 
     # 6) The beat amplitude trace still has slow drift and residual noise.
     # Bandpass in the respiratory band (default 0.1-0.5Hz) to get the final EDR waveform.
@@ -86,6 +87,7 @@ def QrsBandpass(ecg, fs, low=0.5, high=40.0, order=4):
     return UF.BandpassFilter(ecg, fs, low, high, order)
 
 def DetectRPeaksAM(ecgQrs, fs):
+    from scipy.signal import find_peaks
     # robust scale for prominence
     mad = np.median(np.abs(ecgQrs - np.median(ecgQrs)))
     prom = 3.0 * mad if mad > 0 else 0.5 * np.std(ecgQrs)
@@ -102,18 +104,20 @@ def DetectRPeaksAM(ecgQrs, fs):
     return peaks
 
 def DetectRPeaks(ecgFiltered, fs):
+    from scipy.signal import find_peaks
     distance = int(fs * 0.25)  # min 250ms between beats
     peakProminence = np.std(ecgFiltered) * 0.5
     peaks, _ = find_peaks(ecgFiltered, distance=distance, prominence=peakProminence)
     return peaks
 
 def ResampleToUniform(beatTimeS, beatValues, uniformFs, tStart, tEnd):
+    from scipy.interpolate import interp1d
     if tStart is None:
         tStart = float(beatTimeS[0])
     if tEnd is None:
         tEnd = float(beatTimeS[-1])
     
-    uniformTimeS = np.arange(tStart, tEnd, 1.0/uniformFs)
+    uniformTimeS = UF.UniformTimebase.FromRange(tStart, tEnd, uniformFs)
     interpolateFunc = interp1d(
         beatTimeS,
         beatValues,
@@ -122,7 +126,8 @@ def ResampleToUniform(beatTimeS, beatValues, uniformFs, tStart, tEnd):
         assume_sorted=True
     )
 
-    return uniformTimeS, interpolateFunc(uniformTimeS)
+    beatValues = UF.FloatArray(beatValues)
+    return uniformTimeS, interpolateFunc(uniformTimeS).astype(beatValues.dtype, copy=False)
 
 def AdaptiveUpcrossCount(windowValues, windowTimeS):
     vMax = np.max(windowValues)
@@ -132,47 +137,51 @@ def AdaptiveUpcrossCount(windowValues, windowTimeS):
 
     windowLenS = max(windowTimeS[-1] - windowTimeS[0], 1e-6)  # avoid div by zero
 
-    # provisional at average-based threshold
-    provisional = np.sum(
-        (windowValues[1:] >= thresholdAvg) & (windowValues[:-1] < thresholdAvg)
-    )
+    # Count crossings of both candidate thresholds in one pass,
+    # the average-based count is the provisional estimate
+    provisional, crossingsMax = FK.UpcrossCounts(windowValues, thresholdAvg, thresholdMax)
 
     provisionalBrpm = provisional * (60.0 / windowLenS)
 
     thresholdUsed = thresholdMax if provisionalBrpm > 20 else thresholdAvg
-
-    crossings = np.sum(
-        (windowValues[1:] >= thresholdUsed) & (windowValues[:-1] < thresholdUsed)
-    )
+    crossings = crossingsMax if provisionalBrpm > 20 else provisional
     brpm = crossings * (60.0 / windowLenS)
     return brpm, crossings, thresholdUsed
 
+# One record per window from EstimateRRWindows
+RR_WINDOW_DTYPE = np.dtype([
+    ("t0", float),
+    ("t1", float),
+    ("RR_brpm", float),     # <-- explicit BREATHS per minute
+    ("crossings", int),
+    ("threshold", float),
+])
+
 def EstimateRRWindows(uniformTimeS, edrUniform, winSeconds, hopSeconds, estimator=AdaptiveUpcrossCount):
-    results = []
+    """Windowed RR, returned as a structured array (RR_WINDOW_DTYPE), one record per window."""
     start_time = float(uniformTimeS[0])
+    end_time = float(uniformTimeS[-1])
+    maxWindows = max(0, int((end_time - start_time - winSeconds) / hopSeconds) + 2)
+    results = np.empty(maxWindows, dtype=RR_WINDOW_DTYPE)
+    k = 0
 
-    while start_time + winSeconds <= float(uniformTimeS[-1]) + 1e-9:
-        in_win = (uniformTimeS >= start_time) & (uniformTimeS <= start_time + winSeconds)
+    while start_time + winSeconds <= end_time + 1e-9:
+        in_win = UF.WindowSelect(uniformTimeS, start_time, start_time + winSeconds, inclusiveEnd=True)
         win_times = uniformTimeS[in_win]
         win_values = edrUniform[in_win]
 
         if len(win_times) >= 10:
             brpm, n_cross, thr = estimator(win_values, win_times)
-            results.append({
-                "t0": float(win_times[0]),
-                "t1": float(win_times[-1]),
-                "RR_brpm": float(brpm),        # <-- explicit BREATHS per minute
-                "crossings": int(n_cross),
-                "threshold": float(thr),
-            })
+            results[k] = (win_times[0], win_times[-1], brpm, n_cross, thr)
+            k += 1
 
         start_time += hopSeconds
 
-    return results
+    return results[:k]
 
 def InterpolateNans(x):
     """Linear fill NaNs in a 1d array."""
-    y = np.asarray(x, dtype=float).copy()
+    y = UF.FloatArray(x).copy()
     nans = np.isnan(y)
 
     # nothing to do
@@ -189,19 +198,18 @@ def InterpolateNans(x):
 
 def RemoveQrsByMask(ecg, rIndices, fs, halfWidthMs=80):
     """Zero-out ECG samples around each R-peak to remove QRS influence."""
-    y = ecg.astype(float).copy()
+    y = UF.FloatArray(ecg).copy()
     halfWidth = max(1, int(round(halfWidthMs * fs / 1000.0)))
-    for i in np.asarray(rIndices, dtype=int):
-        i0 = max(0, i - halfWidth)
-        i1 = min(len(y) - 1, i + halfWidth)
-        y[i0:i1+1] = np.nan
+    y[FK.QrsMask(len(y), rIndices, halfWidth)] = np.nan
     return InterpolateNans(y)
 
-def EdrBaselineWander(ecg, timeS, fs, rIndices=None, respLow=0.05, respHigh=0.7, qrsHalfWidthMs=80, bpOrder=4):
+def EdrBaselineWander(ecg, timeS, fs, rIndices=None, respLow=0.05, respHigh=0.7, qrsHalfWidthMs=80, bpOrder=4, decimatedFs=10.0):
     """Baseline wander EDR:
     1) If rIndices not given, detect R-peaks
     2) Mask qrsHalfWidthMs around each R-peak and fill by interpolation
-    3) Bandpass the result in the respiratory band
+    3) Anti-alias and decimate to decimatedFs (None keeps the ECG rate)
+    4) Bandpass the result in the respiratory band
+    Returns (edrBw, edrTime, rIndices), edrTime is the time axis of the (decimated) EDR.
     """
     if rIndices is None or len(rIndices) == 0:
         ecgQRS = QrsBandpass(ecg, fs)
@@ -209,43 +217,44 @@ def EdrBaselineWander(ecg, timeS, fs, rIndices=None, respLow=0.05, respHigh=0.7,
 
     ecgNoQRS = RemoveQrsByMask(ecg, rIndices, fs, halfWidthMs=qrsHalfWidthMs)
 
+    # The respiratory band sits far below 500 Hz: filtering at a few Hz is orders of
+    # magnitude cheaper and keeps the Butterworth cutoffs well conditioned.
+    edrFs = fs
+    if decimatedFs is not None:
+        ecgNoQRS, edrFs = UF.Decimate(ecgNoQRS, fs, decimatedFs)
+
     edrBw = UF.BandpassFilter(
         ecgNoQRS,
-        samplingFreq=fs,
+        samplingFreq=edrFs,
         low=respLow,
         high=respHigh,
         order=bpOrder
     )
-    return edrBw, rIndices
+    t0 = float(timeS[0]) if timeS is not None and len(timeS) > 0 else 0.0
+    edrTime = UF.UniformTimebase(t0, edrFs, len(edrBw))
+    return edrBw, edrTime, rIndices
 
 def FindOnsetsBeforeR(ecg, fs, onsetSearch=0.1):
-    """ For each R-peak, find the local minimum in the preceding onsetSearch seconds."""
-        # Detect R peaks for timing (measures amplitudes on raw ecg)
+    """
+    For each R-peak, find the local minimum in the preceding onsetSearch seconds.
+    Returns (onsetIndices, rIdxKept); both are empty when fewer than 2 R-peaks are found.
+    """
+    # Detect R peaks for timing (measures amplitudes on raw ecg)
     ecgQRS = QrsBandpassAM(ecg, fs)
     rIndices = DetectRPeaksAM(ecgQRS, fs)
     if rIndices is None or len(rIndices) < 2:
-        return None, None, rIndices
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
     
     # For each R, find local minimum in R - onsetSearch seconds before R peak (onset)
     win = max(1, int(round(onsetSearch * fs)))
-    onsetIndices = []
-    rIdxKept = []
-    for ri in np.asarray(rIndices, dtype=int):
-        i0 = max(0, ri - win)
-        i1 = ri
-        if i1 <= i0:
-            continue
-        onsetIdx = i0 + int(np.argmin(ecg[i0:i1+1]))
-        if onsetIdx >= ri:
-            continue
-        onsetIndices.append(onsetIdx)
-        rIdxKept.append(ri)
+    onsetIndices, rIdxKept = FK.OnsetsBeforeR(ecg, rIndices, win)
 
     return np.asarray(onsetIndices, dtype=int), np.asarray(rIdxKept, dtype=int)
 
 def CalcAM(ecg, timeS, fs, onsetSearch=0.1, outputTime=None, uniformFs=5.0, useHighpass=False):
+    from scipy.interpolate import interp1d
 
-    onsetIndices, rIdxKept = FindOnsetsBeforeR(ecg, fs, onsetSearch=0.1)
+    onsetIndices, rIdxKept = FindOnsetsBeforeR(ecg, fs, onsetSearch=onsetSearch)
 
     if len(rIdxKept) < 2:
         return None, None, rIdxKept
@@ -265,22 +274,28 @@ def CalcAM(ecg, timeS, fs, onsetSearch=0.1, outputTime=None, uniformFs=5.0, useH
 
     # Resample to uniform grid
     if outputTime is None:
-        outputTime = np.arange(float(tBeats[0]), float(tBeats[-1]), 1.0/uniformFs)
+        outputTime = UF.UniformTimebase.FromRange(float(tBeats[0]), float(tBeats[-1]), uniformFs)
     f = interp1d(tBeats, amValues, kind="linear", fill_value="extrapolate", assume_sorted=True)
-    amSignalUniform = f(outputTime)
+    amSignalUniform = f(outputTime).astype(amValues.dtype, copy=False)
+
+    # filtfilt needs more samples than its edge padding; short windows with few beats fall below that
+    order, btype = (2, "highpass") if useHighpass else (4, "band")
+    if len(amSignalUniform) <= UF.FiltfiltPadlen(order, btype):
+        return None, None, rIndices
 
     # light filtering
-    fsUniform = 1.0 / np.median(np.diff(outputTime))
+    fsUniform = UF.SamplingRate(outputTime)
     if useHighpass:
-        amSignal = UF.HighpassFilter(amSignalUniform, fsUniform)
+        amSignal = UF.HighpassFilter(amSignalUniform, fsUniform, order=order)
     else:
-        amSignal = UF.BandpassFilter(amSignalUniform, fsUniform, low=UF.RESP_LOW_BAND, high=UF.RESP_HIGH_BAND, order=4)
+        amSignal = UF.BandpassFilter(amSignalUniform, fsUniform, low=UF.RESP_LOW_BAND, high=UF.RESP_HIGH_BAND, order=order)
 
     return amSignal, outputTime, rIndices
 
 def CalcBW(ecg, timeS, fs, onsetSearch=0.1, outputTime=None, uniformF=5.0):
+    from scipy.interpolate import interp1d
 
-    onsetIndices, rIdxKept = FindOnsetsBeforeR(ecg, fs, onsetSearch=0.1)
+    onsetIndices, rIdxKept = FindOnsetsBeforeR(ecg, fs, onsetSearch=onsetSearch)
 
     if len(rIdxKept) < 2:
         return None, None, rIdxKept
@@ -302,13 +317,13 @@ def CalcBW(ecg, timeS, fs, onsetSearch=0.1, outputTime=None, uniformF=5.0):
         t1 = float(bwBeatTimes[-1])
         if t1 <= t0:
             return None, None, rIdxKept
-        outputTime = np.arange(t0, t1, 1.0/uniformF)
+        outputTime = UF.UniformTimebase.FromRange(t0, t1, uniformF)
 
     f = interp1d(bwBeatTimes, bwBeatValues, kind="linear", fill_value="extrapolate", assume_sorted=True)
-    bwSignalUniform = f(outputTime)
+    bwSignalUniform = f(outputTime).astype(bwBeatValues.dtype, copy=False)
 
     #light filtering
-    fsUniform = 1.0 / np.median(np.diff(outputTime))
+    fsUniform = UF.SamplingRate(outputTime)
     bwSignal = UF.BandpassFilter(bwSignalUniform, fsUniform, low=UF.RESP_LOW_BAND, high=UF.RESP_HIGH_BAND, order=4)
 
     return bwSignal, outputTime, rIdxKept
@@ -333,43 +348,42 @@ def BuildWins(uniformTimeS, windowS=30, hopS=8, allowPartial=True):
 
 
 
-def CountOrigWindows(signal, outputTime, windowS=30, hopS=8, threshFactor=0.2, zeroCentre=True, minSamples=10):
+# One record per window from CountOrigWindows
+COUNT_ORIG_WINDOW_DTYPE = np.dtype([
+    ("t0", float),
+    ("t1", float),
+    ("RRBrpm", float),
+    ("nCycles", int),
+    ("threshold", float),
+])
 
-    fsUniform = 1.0 / np.median(np.diff(outputTime))
+def CountOrigWindows(signal, outputTime, windowS=30, hopS=8, threshFactor=0.2, zeroCentre=True, minSamples=10):
+    """Windowed Count-Orig RR, returned as a structured array (COUNT_ORIG_WINDOW_DTYPE)."""
 
     # Windows
     winStarts, winEnds = BuildWins(outputTime, windowS, hopS)
-    print(f"WindowStart{winStarts}, WindowEnd{winEnds}")
 
-    # run count orig on each window
-    time = np.asarray(outputTime, dtype=float)
-    x = np.asarray(signal, dtype=float)
-    out = dict(t0=[], t1=[], RRBrpm=[], nCycles=[], threshold=[])
+    # run count orig on each window, filling one structured record per window
+    time = UF.AsTimeAxis(outputTime)
+    x = UF.FloatArray(signal)
+    out = np.empty(len(winStarts), dtype=COUNT_ORIG_WINDOW_DTYPE)
 
-    for start, end in zip(winStarts, winEnds):
-        inWindow = (time >= start) & (time < end)
-        if np.count_nonzero(inWindow) >= minSamples:
+    for k, (start, end) in enumerate(zip(winStarts, winEnds)):
+        inWindow = UF.WindowSelect(time, start, end)
+        if len(time[inWindow]) >= minSamples:
             brpm, nCycles, threshold = CountOrig(x[inWindow], time[inWindow], threshFactor=threshFactor, zeroCentre=zeroCentre)
         else:
             brpm, nCycles, threshold = np.nan, 0, np.nan
 
-        out["t0"].append(float(start))
-        out["t1"].append(float(end))
-        out["RRBrpm"].append(float(brpm))
-        out["nCycles"].append(int(nCycles))
-        out["threshold"].append(float(threshold))
+        out[k] = (start, end, brpm, nCycles, threshold)
 
-    # convert lists to numpy arrays
-    for key in out:
-        out[key] = np.asarray(out[key])
-    
     return out
 
 
 def CountOrig(signal, timeS, threshFactor=0.2, zeroCentre=True, minBreathInterval=2.0, maxBreathInterval=10.0): # min 6 brpm, max 30 brpm
 
-    signal = np.asarray(signal, dtype=float)
-    timeS = np.asarray(timeS, dtype=float)
+    signal = UF.FloatArray(signal)
+    timeS = UF.AsTimeAxis(timeS)
     
     if signal.size < 5:
         return np.nan, 0, np.nan
@@ -393,13 +407,7 @@ def CountOrig(signal, timeS, threshFactor=0.2, zeroCentre=True, minBreathInterva
     relTroughs = troughs[signal[troughs] < 0]
 
     # valid cycles: consectuive relevant peaks with exactly one relevant trough between them
-    durations = []
-    for p0, p1 in zip(relPeaks[:-1], relPeaks[1:]):
-        numTroughs = np.sum((relTroughs > p0) & (relTroughs < p1))
-        if numTroughs == 1:
-            dur = timeS[p1] - timeS[p0]
-            if dur >= minBreathInterval and dur <= maxBreathInterval:
-                durations.append(dur)
+    durations = FK.CycleDurations(relPeaks, relTroughs, timeS[relPeaks], minBreathInterval, maxBreathInterval)
 
     if len(durations) == 0:
         return np.nan, 0, threshold
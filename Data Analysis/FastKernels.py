@@ -0,0 +1,267 @@
+"""
+Compiled kernels for the remaining per-element loops in the DSP code
+(rising-edge debounce, CountOrig cycle check, onset search, QRS masking, upcrossings).
+
+The backend is picked once, on the first kernel call: Numba when it is installed,
+otherwise the vectorized NumPy versions. Importing this module never imports Numba,
+so entry points that don't touch these kernels start fast.
+Set RR_KERNEL_BACKEND=numpy to force the NumPy path.
+Run this file directly for a per-kernel benchmark.
+"""
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+BACKEND = None   # "numba" or "numpy" once resolved
+KERNELS = None   # name -> callable for the resolved backend
+
+
+# ------------------------------- NumPy kernels -------------------------------
+
+def DebounceEdgesNumpy(riseTimes, minGap):
+    """Keep edges at least minGap after the previously kept edge (first edge always kept)."""
+    rt = np.asarray(riseTimes, dtype=float)
+    n = rt.size
+    if n == 0 or np.all(np.diff(rt) >= minGap):
+        return rt
+
+    # Index of the next edge that is far enough away from each edge (n = none left)
+    jump = np.append(np.searchsorted(rt, rt + minGap, side="left"), n)
+
+    # Kept edges are the chain 0 -> jump[0] -> jump[jump[0]] ...
+    # Follow it by pointer doubling: each pass doubles the number of chain steps we know.
+    chain = np.zeros(1, dtype=np.int64)
+    while chain.size < n:
+        chain = np.concatenate([chain, jump[chain]])
+        jump = jump[jump]
+    chain = np.unique(chain)
+    return rt[chain[chain < n]]
+
+def CycleDurationsNumpy(relPeaks, relTroughs, peakTimes, minInterval, maxInterval):
+    """Durations between consecutive peaks that have exactly one trough between them."""
+    relPeaks = np.asarray(relPeaks)
+    relTroughs = np.asarray(relTroughs)
+    peakTimes = np.asarray(peakTimes, dtype=float)
+    if relPeaks.size < 2:
+        return np.empty(0)
+    p0, p1 = relPeaks[:-1], relPeaks[1:]
+    numTroughs = np.searchsorted(relTroughs, p1, side="left") - np.searchsorted(relTroughs, p0, side="right")
+    dur = np.diff(peakTimes)
+    return dur[(numTroughs == 1) & (dur >= minInterval) & (dur <= maxInterval)]
+
+def OnsetsBeforeRNumpy(ecg, rIndices, win):
+    """Index of the minimum in ecg[r - win : r + 1] for each R-peak, dropping onsets not before R."""
+    ecg = np.asarray(ecg)
+    if not np.issubdtype(ecg.dtype, np.floating):
+        ecg = ecg.astype(np.float64)  # integer ADC counts: +inf padding needs a float type
+    rIndices = np.asarray(rIndices, dtype=np.int64)
+    if rIndices.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    # Pad the front with +inf so every search window has the same length
+    padded = np.concatenate([np.full(win, np.inf, dtype=ecg.dtype), ecg])
+    windows = sliding_window_view(padded, win + 1)
+    onsets = rIndices - win + np.argmin(windows[rIndices], axis=1)
+    keep = (rIndices > 0) & (onsets < rIndices)
+    return onsets[keep], rIndices[keep]
+
+def QrsMaskNumpy(n, rIndices, halfWidth):
+    """Boolean mask of samples within halfWidth of any R-peak."""
+    rIndices = np.asarray(rIndices, dtype=np.int64)
+    if rIndices.size == 0:
+        return np.zeros(n, dtype=bool)
+    starts = np.clip(rIndices - halfWidth, 0, n)
+    ends = np.clip(rIndices + halfWidth, -1, n - 1) + 1
+    delta = np.bincount(starts, minlength=n + 1) - np.bincount(ends, minlength=n + 1)
+    return np.cumsum(delta[:n]) > 0
+
+def UpcrossCountsNumpy(values, thresholdA, thresholdB):
+    """Number of upward crossings of two thresholds."""
+    v0, v1 = values[:-1], values[1:]
+    countA = np.count_nonzero((v1 >= thresholdA) & (v0 < thresholdA))
+    countB = np.count_nonzero((v1 >= thresholdB) & (v0 < thresholdB))
+    return countA, countB
+
+
+# ------------------------------- Numba kernels -------------------------------
+
+def BuildNumbaKernels(numba):
+    """Compile the Numba kernels and wrap them with the NumPy kernels' signatures."""
+
+    @numba.njit(cache=True)
+    def DebounceEdgesNumba(riseTimes, minGap):
+        n = riseTimes.size
+        if n == 0:
+            return riseTimes
+        keep = np.empty(n, dtype=np.int64)
+        keep[0] = 0
+        k = 1
+        for t in range(1, n):
+            if riseTimes[t] - riseTimes[keep[k - 1]] >= minGap:
+                keep[k] = t
+                k += 1
+        return riseTimes[keep[:k]]
+
+    @numba.njit(cache=True)
+    def CycleDurationsNumba(relPeaks, relTroughs, peakTimes, minInterval, maxInterval):
+        n = relPeaks.size
+        out = np.empty(max(n - 1, 0))
+        k = 0
+        j = 0
+        for i in range(n - 1):
+            p0 = relPeaks[i]
+            p1 = relPeaks[i + 1]
+            while j < relTroughs.size and relTroughs[j] <= p0:
+                j += 1
+            count = 0
+            m = j
+            while m < relTroughs.size and relTroughs[m] < p1 and count < 2:
+                count += 1
+                m += 1
+            if count == 1:
+                dur = peakTimes[i + 1] - peakTimes[i]
+                if dur >= minInterval and dur <= maxInterval:
+                    out[k] = dur
+                    k += 1
+        return out[:k]
+
+    @numba.njit(cache=True)
+    def OnsetsBeforeRNumba(ecg, rIndices, win):
+        onsets = np.empty(rIndices.size, dtype=np.int64)
+        kept = np.empty(rIndices.size, dtype=np.int64)
+        k = 0
+        for ri in rIndices:
+            i0 = max(0, ri - win)
+            if ri <= i0:
+                continue
+            best = i0
+            for i in range(i0 + 1, ri + 1):
+                if ecg[i] < ecg[best]:
+                    best = i
+            if best >= ri:
+                continue
+            onsets[k] = best
+            kept[k] = ri
+            k += 1
+        return onsets[:k], kept[:k]
+
+    @numba.njit(cache=True)
+    def QrsMaskNumba(n, rIndices, halfWidth):
+        mask = np.zeros(n, dtype=np.bool_)
+        for ri in rIndices:
+            i0 = max(0, ri - halfWidth)
+            i1 = min(n - 1, ri + halfWidth)
+            mask[i0:i1 + 1] = True
+        return mask
+
+    @numba.njit(cache=True)
+    def UpcrossCountsNumba(values, thresholdA, thresholdB):
+        countA = 0
+        countB = 0
+        for i in range(1, values.size):
+            prev = values[i - 1]
+            cur = values[i]
+            if cur >= thresholdA and prev < thresholdA:
+                countA += 1
+            if cur >= thresholdB and prev < thresholdB:
+                countB += 1
+        return countA, countB
+
+    return {
+        "DebounceEdges": lambda riseTimes, minGap: DebounceEdgesNumba(
+            np.ascontiguousarray(riseTimes, dtype=np.float64), float(minGap)),
+        "CycleDurations": lambda relPeaks, relTroughs, peakTimes, minInterval, maxInterval: CycleDurationsNumba(
+            np.ascontiguousarray(relPeaks, dtype=np.int64), np.ascontiguousarray(relTroughs, dtype=np.int64),
+            np.ascontiguousarray(peakTimes, dtype=np.float64), float(minInterval), float(maxInterval)),
+        "OnsetsBeforeR": lambda ecg, rIndices, win: OnsetsBeforeRNumba(
+            np.ascontiguousarray(ecg), np.ascontiguousarray(rIndices, dtype=np.int64), int(win)),
+        "QrsMask": lambda n, rIndices, halfWidth: QrsMaskNumba(
+            int(n), np.ascontiguousarray(rIndices, dtype=np.int64), int(halfWidth)),
+        "UpcrossCounts": lambda values, thresholdA, thresholdB: UpcrossCountsNumba(
+            np.ascontiguousarray(values), float(thresholdA), float(thresholdB)),
+    }
+
+NUMPY_KERNELS = {
+    "DebounceEdges": DebounceEdgesNumpy,
+    "CycleDurations": CycleDurationsNumpy,
+    "OnsetsBeforeR": OnsetsBeforeRNumpy,
+    "QrsMask": QrsMaskNumpy,
+    "UpcrossCounts": UpcrossCountsNumpy,
+}
+
+def LoadBackend():
+    """Resolve the kernel backend once and return its kernel table."""
+    global BACKEND, KERNELS
+    if KERNELS is not None:
+        return KERNELS
+
+    numba = None
+    if os.environ.get("RR_KERNEL_BACKEND", "").lower() != "numpy":
+        try:
+            import numba
+        except ImportError:
+            numba = None
+
+    if numba is not None:
+        BACKEND, KERNELS = "numba", BuildNumbaKernels(numba)
+    else:
+        BACKEND, KERNELS = "numpy", NUMPY_KERNELS
+    return KERNELS
+
+
+# ------------------------------ Public entry points ------------------------------
+
+def DebounceEdges(riseTimes, minGap):
+    return (KERNELS or LoadBackend())["DebounceEdges"](riseTimes, minGap)
+
+def CycleDurations(relPeaks, relTroughs, peakTimes, minInterval, maxInterval):
+    return (KERNELS or LoadBackend())["CycleDurations"](relPeaks, relTroughs, peakTimes, minInterval, maxInterval)
+
+def OnsetsBeforeR(ecg, rIndices, win):
+    return (KERNELS or LoadBackend())["OnsetsBeforeR"](ecg, rIndices, win)
+
+def QrsMask(n, rIndices, halfWidth):
+    return (KERNELS or LoadBackend())["QrsMask"](n, rIndices, halfWidth)
+
+def UpcrossCounts(values, thresholdA, thresholdB):
+    return (KERNELS or LoadBackend())["UpcrossCounts"](values, thresholdA, thresholdB)
+
+
+def Benchmark(repeats=20, seed=0):
+    """Time every kernel on representative inputs, NumPy vs Numba when available."""
+    import timeit
+    kernels = LoadBackend()
+    rng = np.random.default_rng(seed)
+    fs = 500
+    ecg = rng.standard_normal(fs * 600)  # 10 min of ECG
+    rIdx = np.arange(fs, ecg.size - fs, int(0.8 * fs))
+    riseTimes = np.sort(rng.uniform(0, 3600, 5000))  # an hour of noisy presses
+    resp = np.sin(np.linspace(0, 400 * np.pi, 5 * 3600))
+    peaks = np.sort(rng.choice(resp.size, 2000, replace=False))
+    troughs = np.sort(rng.choice(resp.size, 2000, replace=False))
+    peakTimes = peaks / 5.0
+
+    cases = {
+        "DebounceEdges": ("DebounceEdges", (riseTimes, 2.0)),
+        "CycleDurations": ("CycleDurations", (peaks, troughs, peakTimes, 2.0, 10.0)),
+        "OnsetsBeforeR": ("OnsetsBeforeR", (ecg, rIdx, int(0.1 * fs))),
+        "QrsMask": ("QrsMask", (ecg.size, rIdx, int(0.08 * fs))),
+        "UpcrossCounts": ("UpcrossCounts", (resp, 0.0, 0.3)),
+    }
+    print(f"{'kernel':<16}{'numpy (ms)':>12}{'numba (ms)':>12}{'speed-up':>10}")
+    for name, (base, args) in cases.items():
+        npFunc = NUMPY_KERNELS[base]
+        tNp = min(timeit.repeat(lambda: npFunc(*args), number=1, repeat=repeats)) * 1e3
+        if BACKEND == "numba":
+            nbFunc = kernels[base]
+            nbFunc(*args)  # compile outside the timing
+            tNb = min(timeit.repeat(lambda: nbFunc(*args), number=1, repeat=repeats)) * 1e3
+            print(f"{name:<16}{tNp:>12.3f}{tNb:>12.3f}{tNp / tNb:>9.1f}x")
+        else:
+            print(f"{name:<16}{tNp:>12.3f}{'n/a':>12}{'':>10}")
+
+
+if __name__ == "__main__":
+    LoadBackend()
+    print(f"Kernel backend: {BACKEND}")
+    Benchmark()
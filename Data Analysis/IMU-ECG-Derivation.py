@@ -8,12 +8,18 @@ from scipy.interpolate import interp1d
 import UtilityFunctions as UF
 import ECGDerivedRR as ECG
 import IMUDerivedRR as IMU
+import DataLoading as DL
+import ResultCache as RC
 
 # --- Configuration ---
 # Path to your "Recording Sessions" folder
 RECORDING_FOLDER = r"C:\Users\wende\OneDrive\UNI Cloud\2025\Thesis Project\Technical Stuff\Data Analysis\Recording Scripts\Recording Sessions"
 RESP_MODE_DEFAULT = "z" # Options: "x", "y", "z", "mag"
 
+# On-disk cache of intermediate results (parsed session, filtered traces, beats, window RR).
+# Re-running on an unchanged session only recomputes stages whose inputs or code changed.
+CACHE = RC.ResultCache(enabled=os.environ.get("RR_NO_CACHE") is None)
+
 
 def ChooseFile():
     """CLI menu to pick a CSV file from RECORDING_FOLDER."""
@@ -30,68 +36,22 @@ def ChooseFile():
     choice = int(input("\nEnter the number of the file: ")) - 1
     return os.path.join(RECORDING_FOLDER, files[choice])
 
-def LoadData(filePath, saveBadRows=True):
-    """
-    Parses new lines like:
-    Builds a flat dataframe with columns:
-      Timestamp (sec), Time (s), Manual, ax..head, heart
-    """
-    # Read two columns: the quoted inner CSV and Manual
-    df_in = pd.read_csv(
-        filePath,
-        header=None,
-        names=["ESP32_Data", "Manual"],
-        skiprows=1,        # skip the ':ESP32_Data,Manual' header
-        quotechar='"',
-        engine="python"
-    )
-
-    # Split the quoted inner CSV into 11 tokens (ts_us, KIND, 9 payload slots)
-    parts = df_in["ESP32_Data"].astype(str).str.split(",", n=10, expand=True)
-    parts.columns = ["ts_us","kind","ax","ay","az","gx","gy","gz","roll","pitch","last"]
-
-    # Numeric conversions (coerce empties to NaN)
-    for c in ["ts_us","ax","ay","az","gx","gy","gz","roll","pitch","last"]:
-        parts[c] = pd.to_numeric(parts[c], errors="coerce")
-
-    # Map 'last' into head (IMU) or heart (ECG)
-    kind = parts["kind"].astype(str).str.upper()
-    head  = np.where(kind=="IMU", parts["last"], np.nan)
-    heart = np.where(kind=="ECG", parts["last"], np.nan)
-
-    # Build the flat table your downstream code expects
-    df = pd.DataFrame({
-        "Timestamp": parts["ts_us"] / 1e6,   # seconds (device micros)
-        "Manual": pd.to_numeric(df_in["Manual"], errors="coerce").fillna(0).astype(int),
-        "ax": parts["ax"], "ay": parts["ay"], "az": parts["az"],
-        "gx": parts["gx"], "gy": parts["gy"], "gz": parts["gz"],
-        "roll": parts["roll"], "pitch": parts["pitch"], "head": head,
-        "heart": heart,
-    })
-
-    # Relative time axis
-    df["Time (s)"] = df["Timestamp"] - df["Timestamp"].iloc[0]
-
-    # Log a quick summary (optional)
-    n_imu = (kind=="IMU").sum()
-    n_ecg = (kind=="ECG").sum()
-    print(f"[INFO] Parsed rows: {len(df)} (IMU={n_imu}, ECG={n_ecg})")
-
-    return df
-
-def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
-    """Plot raw and filtered ECG from dataframe."""
-    # Extractp
-    ecgRaw, timeSeconds = ECG.GetRawECG(df)
+def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True, ecgStream=None):
+    """Plot raw and filtered ECG from dataframe (or from its uniform resampling, ecgStream)."""
+    # Extract
+    if ecgStream is not None:
+        ecgRaw, timeSeconds = ecgStream.values, ecgStream.time
+    else:
+        ecgRaw, timeSeconds = ECG.GetRawECG(df)
 
     # Filter ECG
     nyq = 0.5 * samplingFreq
     highHz = min(bandHigh, nyq * 0.9)  # avoid >Nyquist
-    ecgFiltered = UF.BandpassFilter(ecgRaw, samplingFreq, low=bandLow, high=highHz, order=order)
+    ecgFiltered = CACHE.Call(UF.BandpassFilter, ecgRaw, samplingFreq, low=bandLow, high=highHz, order=order)
     # QRSbased band for peak detection
-    ecgQRS = ECG.QrsBandpass(ecgRaw, samplingFreq)
+    ecgQRS = CACHE.Call(ECG.QrsBandpass, ecgRaw, samplingFreq)
     # R peak detection
-    rPeaks = ECG.DetectRPeaks(ecgQRS, samplingFreq)
+    rPeaks = CACHE.Call(ECG.DetectRPeaks, ecgQRS, samplingFreq)
 
     plt.plot(timeSeconds, ecgFiltered, linewidth=1.0, label="ECG (0.5–40 Hz)")
     plt.plot(timeSeconds, ecgQRS,     linewidth=1.0, label="ECG (QRS 5–25 Hz)")
@@ -116,7 +76,8 @@ def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
     # )
 
     # --------------------------------- AM --------------------------------
-    amSignal, amTime, rIndices = ECG.CalcAM(
+    amSignal, amTime, rIndices = CACHE.Call(
+        ECG.CalcAM,
         ecg=ecgRaw,
         timeS=timeSeconds,
         fs=samplingFreq,
@@ -125,7 +86,7 @@ def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
         uniformFs=5.0,
         useHighpass=False
     )
-    rrAM = ECG.CountOrigWindows(signal=amSignal, outputTime=amTime, windowS=30, hopS=8, threshFactor=0.2, zeroCentre=True)
+    rrAM = CACHE.Call(ECG.CountOrigWindows, signal=amSignal, outputTime=amTime, windowS=30, hopS=8, threshFactor=0.2, zeroCentre=True)
     if np.any(np.isfinite(rrAM["RRBrpm"])):
         mean_am_rr = np.nanmean(rrAM["RRBrpm"])
         print(f"[AM·CtO] Mean RR = {mean_am_rr:.2f} brpm over {len(rrAM['RRBrpm'])} windows")
@@ -133,12 +94,13 @@ def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
         print("[AM·CtO] No valid CtO estimates in the current windows.")
 
     # ------------------------- BW CtO RR Estimation -------------------------
-    bwSignal, bwTime, bwRIndices = ECG.CalcBW(
+    bwSignal, bwTime, bwRIndices = CACHE.Call(
+        ECG.CalcBW,
         ecg=ecgRaw,
         timeS=timeSeconds,
         fs=samplingFreq,
     )
-    rrBW = ECG.CountOrigWindows(signal=bwSignal, outputTime=bwTime, windowS=30, hopS=8, threshFactor=0.2, zeroCentre=True)
+    rrBW = CACHE.Call(ECG.CountOrigWindows, signal=bwSignal, outputTime=bwTime, windowS=30, hopS=8, threshFactor=0.2, zeroCentre=True)
 
     if np.any(np.isfinite(rrBW["RRBrpm"])):
         mean_bw_rr = np.nanmean(rrBW["RRBrpm"])
@@ -183,12 +145,12 @@ def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
     edrResp = UF.BandpassFilter(edrUniform, edrFs, low=0.1, high=0.5, order=4)
 
     # Windowed Brpm using estimator
-    amRRWindows = ECG.EstimateRRWindows(uniformTimeS=edrTime, edrUniform=edrResp, winSeconds=32, hopSeconds=8, estimator=ECG.AdaptiveUpcrossCount)
-    mean_brpm = np.mean([w["RR_brpm"] for w in amRRWindows]) if amRRWindows else np.nan
+    amRRWindows = CACHE.Call(ECG.EstimateRRWindows, uniformTimeS=edrTime, edrUniform=edrResp, winSeconds=32, hopSeconds=8, estimator=ECG.AdaptiveUpcrossCount)
+    mean_brpm = np.mean(amRRWindows["RR_brpm"]) if amRRWindows.size else np.nan
 
     # ------------------------- Baseline Wander RR -------------------------
-    edrBw, rIndices = ECG.EdrBaselineWander(ecgRaw, timeSeconds, samplingFreq)
-    bwRR = ECG.EstimateRRWindows(timeSeconds, edrBw, winSeconds=32, hopSeconds=8, estimator=ECG.AdaptiveUpcrossCount)
+    edrBw, edrBwTime, rIndices = CACHE.Call(ECG.EdrBaselineWander, ecgRaw, timeSeconds, samplingFreq, decimatedFs=10.0)
+    bwRR = CACHE.Call(ECG.EstimateRRWindows, edrBwTime, edrBw, winSeconds=32, hopSeconds=8, estimator=ECG.AdaptiveUpcrossCount)
 
 
     # -------------------------- Beats Per Minute ---------------------------
@@ -202,12 +164,12 @@ def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
     print(f"[AM] R-peaks: {len(rPeaks)} | EDR fs={edrFs} Hz | mean BRPM={mean_brpm:.2f}")
     print(f"[BPM] Mean BPM={bpmMean:.2f}" if bpmMean else "[BPM] Not enough beats to compute BPM.")
 
-    if amRRWindows:
+    if amRRWindows.size:
         print("\n[AM] Windowed BRPM estimates:")
         for r in amRRWindows:
             print(f"{r['t0']:.1f}-{r['t1']:.1f}s: {r['RR_brpm']:.1f} brpm (crossings={r['crossings']})")
 
-    if bwRR:
+    if bwRR.size:
         print("\n[BW] Windowed BRPM estimates:")
         for r in bwRR:
             print(f"{r['t0']:.1f}-{r['t1']:.1f}s: {r['RR_brpm']:.1f} brpm (crossings={r['crossings']})")
@@ -232,10 +194,12 @@ def PlotECG(df, samplingFreq, bandLow, bandHigh, order, displayRaw=True):
 
 
 
-def PlotIMUSignals(df, respSignal, roll, pitch, yaw, accelPitch, peaks):
+def PlotIMUSignals(df, respSignal, roll, pitch, yaw, accelPitch, peaks, timeS=None):
+    # Signals are on timeS (the resampled grid) when given, otherwise on the dataframe rows
+    timeS = np.asarray(timeS) if timeS is not None else df["Time (s)"].to_numpy()
     fig, ax1 = plt.subplots(figsize=(14, 7))
-    ax1.plot(df["Time (s)"], respSignal, label="Filtered Respiration (mag)", color="blue")
-    ax1.plot(df["Time (s)"].iloc[peaks], respSignal[peaks], "rx", label="Detected Breaths")
+    ax1.plot(timeS, respSignal, label="Filtered Respiration (mag)", color="blue")
+    ax1.plot(timeS[peaks], respSignal[peaks], "rx", label="Detected Breaths")
     ax1.set_xlabel("Time (s)")
     ax1.set_ylabel("Respiration Signal (a.u.)", color="blue")
     ax1.legend(loc="upper right")
@@ -249,14 +213,14 @@ def PlotIMUSignals(df, respSignal, roll, pitch, yaw, accelPitch, peaks):
     ax3 = ax1.twinx()
     ax3.spines["right"].set_position(("axes", 1.1))  # offset right spine
     ax3.spines["right"].set_visible(True)
-    ax3.plot(df["Time (s)"], pitch, color="green")
+    ax3.plot(timeS, pitch, color="green")
     ax3.set_ylabel("pitch Signal (a.u.)", color="green")
 
     # Accel Pitch overlay
     ax4 = ax1.twinx()
     ax4.spines["right"].set_position(("axes", 1.2))  # offset right spine
     ax4.spines["right"].set_visible(True)
-    ax4.plot(df["Time (s)"], accelPitch, color="red")
+    ax4.plot(timeS, accelPitch, color="red")
     ax4.set_ylabel("Accel Pitch Signal (a.u.)", color="red")
 
     # Yaw overlay
@@ -371,7 +335,7 @@ def plot_file(filePath):
 if __name__ == "__main__":
     filePath = ChooseFile()
     print(f"\nSelected file: {filePath}")
-    df = LoadData(filePath)
+    df = CACHE.Call(DL.LoadData, RC.FileKey(filePath))
 
     # --- Split the mixed dataframe ---
     # IMU rows have accel values; ECG rows have 'heart'
@@ -398,25 +362,34 @@ if __name__ == "__main__":
     imuSamplingFreq = 50.0
     ecgSamplingFreq = 500.0
 
+    # --- Put each stream on an exact uniform grid from its device timestamps ---
+    # Short dropouts are interpolated; longer gaps are flagged invalid in the stream's mask
+    ecgStream = CACHE.Call(UF.ResampleStream, df_ecg["Time (s)"].to_numpy(), df_ecg["heart"].to_numpy(dtype=float), ecgSamplingFreq)
+    print(f"[ECG] measured fs={ecgStream.fsMeasured:.2f} Hz (nominal {ecgSamplingFreq:.0f}), gaps={ecgStream.nGaps} "
+          f"({ecgStream.nRepaired} repaired), invalid={np.mean(~ecgStream.valid):.1%} of grid")
+
     # --- ECG plotting/processing uses the ECG-only frame ---
-    PlotECG(df_ecg, ecgSamplingFreq, bandLow=0.5, bandHigh=40.0, order=4, displayRaw=True)
+    PlotECG(df_ecg, ecgSamplingFreq, bandLow=0.5, bandHigh=40.0, order=4, displayRaw=True, ecgStream=ecgStream)
 
     # --- Resp/IMU path uses the IMU-only frame ---
     respRaw, respLabel = IMU.GetIMUSignal(df_imu, mode=RESP_MODE_DEFAULT)
-    IMUfiltered = UF.BandpassFilter(respRaw, imuSamplingFreq, low=0.05, high=0.8, order=4)
-
-    rollFiltered = UF.BandpassFilter(rollRaw, imuSamplingFreq, low=0.05, high=0.8, order=4)
-    pitchFiltered = UF.BandpassFilter(pitchRaw, imuSamplingFreq, low=0.05, high=0.8, order=4)
-    yawFiltered = UF.BandpassFilter(yawRaw, imuSamplingFreq, low=0.05, high=0.8, order=4)
 
-    accelPitchFiltered = UF.BandpassFilter(accelPitch, imuSamplingFreq, low=0.05, high=0.8, order=4)
+    # Stack every IMU channel (channels x samples), resample onto the 50 Hz grid and filter in single calls
+    imuStack = UF.StackChannels(respRaw, rollRaw, pitchRaw, yawRaw, accelPitch)
+    imuStream = CACHE.Call(UF.ResampleStream, df_imu["Time (s)"].to_numpy(), imuStack, imuSamplingFreq)
+    print(f"[IMU] measured fs={imuStream.fsMeasured:.2f} Hz (nominal {imuSamplingFreq:.0f}), gaps={imuStream.nGaps} "
+          f"({imuStream.nRepaired} repaired), invalid={np.mean(~imuStream.valid):.1%} of grid")
+    imuFiltered = CACHE.Call(UF.BandpassFilter, imuStream.values, imuSamplingFreq, low=0.05, high=0.8, order=4, axis=-1)
+    IMUfiltered, rollFiltered, pitchFiltered, yawFiltered, accelPitchFiltered = imuFiltered
 
-    respRawRR = IMU.CombineRREstimates(IMUfiltered, imuSamplingFreq)
-    print(f"\n[IMU] Z Axis RR estimate: {respRawRR[0]:.2f} breaths/min" if respRawRR else "[IMU] Z Axis Resp RR estimate: N/A")
-    pitchRR = IMU.CombineRREstimates(pitchFiltered, imuSamplingFreq)
-    print(f"[IMU] Pitch RR estimate: {pitchRR[0]:.2f} breaths/min" if pitchRR else "[IMU] Pitch RR estimate: N/A")
-    accelPitchRR = IMU.CombineRREstimates(accelPitchFiltered, imuSamplingFreq)
-    print(f"[IMU] Accel Pitch RR estimate: {accelPitchRR[0]:.2f} breaths/min" if accelPitchRR else "[IMU] Accel Pitch RR estimate: N/A")
+    # All candidate channels in one batched estimate (rows follow imuStack: z, roll, pitch, yaw, accelPitch)
+    imuRR = CACHE.Call(IMU.CombineRREstimatesBatch, imuFiltered, imuSamplingFreq)
+    respRawRR, pitchRR, accelPitchRR = imuRR[0], imuRR[2], imuRR[4]
+    print(f"\n[IMU] Z Axis RR estimate: {respRawRR['RR']:.2f} breaths/min")
+    print(f"[IMU] Pitch RR estimate: {pitchRR['RR']:.2f} breaths/min")
+    print(f"[IMU] Accel Pitch RR estimate: {accelPitchRR['RR']:.2f} breaths/min")
+    zWelch, pitchWelch, accelPitchWelch = IMU.RRFromWelch(imuFiltered[[0, 2, 4]], imuSamplingFreq)
+    print(f"[IMU] Welch RR estimates: Z={zWelch:.2f}, Pitch={pitchWelch:.2f}, Accel Pitch={accelPitchWelch:.2f} breaths/min")
 
 
     # Peak detection on IMUfiltered; index aligns with df_imu after reset_index above
@@ -424,11 +397,9 @@ if __name__ == "__main__":
 
     # Use the IMU timeline for RR (time-domain) calc
     # rrTime = IMU.EstimateRRTime(peaks, df_imu["Time (s)"].to_numpy())
-    # rrFreq = IMU.EstimateRRFreq(IMUfiltered, imuSamplingFreq, window=30, low=0.05, high=0.8)
 
     # print(f"Estimated RR (Time Domain): {rrTime:.2f} breaths/min" if rrTime else "RR (Time Domain): N/A")
-    # print(f"Estimated RR (Freq Domain): {rrFreq:.2f} breaths/min" if rrFreq else "RR (Freq Domain): N/A")
 
     # Plot respiration vs IMU time, overlay Manual from df_imu
-    PlotIMUSignals(df_imu, IMUfiltered, rollFiltered, pitchFiltered, yawFiltered, accelPitchFiltered, peaks)
+    PlotIMUSignals(df_imu, IMUfiltered, rollFiltered, pitchFiltered, yawFiltered, accelPitchFiltered, peaks, timeS=imuStream.time)
 
@@ -1,6 +1,7 @@
 import UtilityFunctions as UF
 import numpy as np
-from scipy.signal import find_peaks, welch
+from collections import deque
+# scipy.signal is imported where used to keep module import cheap
 
 def AccelTilt(ax, ay, az, epsilon=1e-8):
     """Compute tilt angle (radians) from vertical for each sample."""
@@ -12,27 +13,28 @@ def AccelTilt(ax, ay, az, epsilon=1e-8):
     pitch = np.arctan2(-axNorm, np.sqrt(ayNorm**2 + azNorm**2) + epsilon)
     return roll, pitch
 
-def GetIMUSignal(df, mode="z"):
+def GetIMUSignal(df, mode="z", dtype=np.float64):
     mode = mode.lower()
-    ax = df["ax"].to_numpy(dtype=float)
-    ay = df["ay"].to_numpy(dtype=float)
-    az = df["az"].to_numpy(dtype=float)
+    ax = df["ax"].to_numpy(dtype=dtype)
+    ay = df["ay"].to_numpy(dtype=dtype)
+    az = df["az"].to_numpy(dtype=dtype)
 
     if mode == "pitch":
-        return df["pitch"].to_numpy(), "Pitch (rad)"
+        return df["pitch"].to_numpy(dtype=dtype), "Pitch (rad)"
     elif mode == "accelpitch":
         roll, pitch = AccelTilt(ax, ay, az) # Not finished
         return pitch, "Accel Pitch (rad)"
     elif mode == "z":
-        return df["az"].to_numpy(), "Z-axis (g)"
+        return az, "Z-axis (g)"
     elif mode == "mag":
-        mag = UF.ComputeMagnitude(df["ax"].to_numpy(), df["ay"].to_numpy(), df["az"].to_numpy())
+        mag = UF.ComputeMagnitude(ax, ay, az)
         return mag, "Accel Magnitude (g)"
     else:
         raise ValueError('mode must be "z" or "mag"')
     
 def RRFromAutoCorrelation(signal, samplingFreq, minRR=6, maxRR=30):
     """Estimate respiratory rate (breaths per minute) using autocorrelation method."""
+    from scipy.signal import find_peaks
     # Auto correlation
     corr = np.correlate(signal, signal, mode='full')
     corr = corr[len(corr)//2:]
@@ -88,6 +90,178 @@ def CombineRREstimates(signal, samplingFreq):
     return finalRate, acRate, fftRate
 
 
+# Per-channel result of CombineRREstimatesBatch
+RR_ESTIMATE_DTYPE = np.dtype([("RR", float), ("AC", float), ("FFT", float)])
+
+def RRFromAutoCorrelationBatch(signals, samplingFreq):
+    """Autocorrelation RR for every row of a (channels x samples) array, one FFT pass."""
+    x = np.atleast_2d(UF.FloatArray(signals))
+    n = x.shape[-1]
+
+    # Linear (non-circular) autocorrelation via zero-padded FFT, positive lags only
+    nfft = 1 << int(np.ceil(np.log2(2 * n - 1))) if n > 1 else 1
+    spec = np.fft.rfft(x, n=nfft, axis=-1)
+    corr = np.fft.irfft(spec.real**2 + spec.imag**2, n=nfft, axis=-1)[:, :n]
+
+    # Search between 6 and 30 breaths per minute (same lag range as RRFromAutoCorrelation)
+    minLag = int(2 * samplingFreq)
+    maxLag = min(int(10 * samplingFreq), n)
+    acRate = np.zeros(x.shape[0])
+    if maxLag - minLag < 3:
+        return acRate
+
+    # First local maximum inside the lag range for each channel
+    c = corr[:, minLag:maxLag]
+    isPeak = (c[:, 1:-1] > c[:, :-2]) & (c[:, 1:-1] > c[:, 2:])
+    hasPeak = isPeak.any(axis=-1)
+    firstPeak = np.argmax(isPeak, axis=-1) + 1 + minLag
+    acRate[hasPeak] = 60.0 * samplingFreq / firstPeak[hasPeak]
+    return acRate
+
+def RRFromFFTBatch(signals, samplingFreq):
+    """FFT RR for every row of a (channels x samples) array with a single rfft."""
+    x = np.atleast_2d(UF.FloatArray(signals))
+    n = x.shape[-1]
+    fftRate = np.zeros(x.shape[0])
+    if n < 10:
+        return fftRate
+
+    freqs = np.fft.rfftfreq(n, 1/samplingFreq)
+    mask = (freqs >= 0.15) & (freqs <= 0.4)  # 9 to 24 bpm
+    if not np.any(mask):
+        return fftRate
+
+    spectra = np.abs(np.fft.rfft(x, axis=-1)[:, mask])
+    fftRate[:] = freqs[mask][np.argmax(spectra, axis=-1)] * 60.0
+    return fftRate
+
+def CombineRREstimatesBatch(signals, samplingFreq):
+    """
+    Vectorized CombineRREstimates for a (channels x samples) array.
+    Returns a structured array (RR_ESTIMATE_DTYPE) with one record per channel.
+    """
+    acRate = RRFromAutoCorrelationBatch(signals, samplingFreq)
+    fftRate = RRFromFFTBatch(signals, samplingFreq)
+
+    acValid = (acRate >= 8) & (acRate <= 26)
+    fftValid = (fftRate >= 8) & (fftRate <= 26)
+    nValid = acValid.astype(int) + fftValid.astype(int)
+
+    out = np.zeros(acRate.size, dtype=RR_ESTIMATE_DTYPE)
+    anyValid = nValid > 0
+    out["RR"][anyValid] = (np.where(acValid, acRate, 0) + np.where(fftValid, fftRate, 0))[anyValid] / nValid[anyValid]
+    # Match CombineRREstimates: channels with no valid rate report all zeros
+    out["AC"][anyValid] = acRate[anyValid]
+    out["FFT"][anyValid] = fftRate[anyValid]
+    return out
+
+
+def RRFromWelch(signal, samplingFreq, segmentS=12, overlap=0.5, nfftS=60, low=0.15, high=0.4):
+    """
+    Estimate respiratory rate (breaths per minute) from a Welch averaged periodogram.
+    Averaging overlapping segments is far less noisy than a single FFT argmax, so shorter
+    windows give a usable estimate. nfftS zero-pads each segment (60 s -> 1 brpm bins).
+    Accepts (channels x samples) input and returns one rate per channel.
+    """
+    from scipy.signal import welch
+    x = UF.FloatArray(signal)
+    n = x.shape[-1]
+    nperseg = min(int(round(segmentS * samplingFreq)), n)
+    if nperseg < 10:
+        return np.zeros(x.shape[:-1]) if x.ndim > 1 else 0
+    nfft = max(nperseg, int(round(nfftS * samplingFreq)))
+
+    f, Pxx = welch(x, samplingFreq, window="hann", nperseg=nperseg,
+                   noverlap=int(overlap * nperseg), nfft=nfft, detrend="linear", axis=-1)
+    mask = (f >= low) & (f <= high)
+    if not np.any(mask):
+        return np.zeros(x.shape[:-1]) if x.ndim > 1 else 0
+    return f[mask][np.argmax(Pxx[..., mask], axis=-1)] * 60.0
+
+
+class WelchRREstimator:
+    """
+    Sliding Welch RR for the live path.
+    Samples are pushed one at a time (Push), or the newest part of a prepared window at
+    each hop (PushWindow); every stepS seconds only the newest segment is detrended,
+    tapered and transformed. The band power of each segment is cached so the averaged
+    spectrum over the window is updated by adding the new segment and dropping the
+    oldest, instead of re-transforming the whole window every hop.
+    """
+
+    def __init__(self, samplingFreq, nChannels=1, windowS=30, segmentS=12, stepS=1, nfftS=60, low=0.15, high=0.4, dtype=np.float64):
+        self.samplingFreq = samplingFreq
+        self.segN = int(round(segmentS * samplingFreq))
+        self.stepN = max(1, int(round(stepS * samplingFreq)))
+        self.nfft = max(self.segN, int(round(nfftS * samplingFreq)))
+        nSegments = max(1, int((windowS - segmentS) / stepS) + 1)
+
+        freqs = np.fft.rfftfreq(self.nfft, 1/samplingFreq)
+        self.band = (freqs >= low) & (freqs <= high)
+        self.bandFreqs = freqs[self.band]
+        # Periodic Hann taper (same as scipy get_window("hann")) and centred ramp for the
+        # least-squares linear detrend, both built with NumPy so no scipy import on the live path
+        k = np.arange(self.segN)
+        self.taper = (0.5 - 0.5 * np.cos(2.0 * np.pi * k / self.segN)).astype(dtype)
+        self.ramp = (k - 0.5 * (self.segN - 1)).astype(dtype)
+        self.rampNorm = float(np.sum(self.ramp.astype(float)**2))
+
+        # Latest segment of raw samples (ring), plus cached per-segment band power
+        self.ring = np.zeros((nChannels, self.segN), dtype=dtype)
+        self.pos = 0
+        self.nPushed = 0
+        self.nSinceSegment = 0
+        self.segmentPower = deque(maxlen=nSegments)
+        self.powerSum = np.zeros((nChannels, self.bandFreqs.size))  # float64 accumulator, avoids drift
+
+    def Push(self, samples):
+        """Push one sample per channel."""
+        self.ring[:, self.pos] = samples
+        self.pos = (self.pos + 1) % self.segN
+        self.nPushed += 1
+        self.nSinceSegment += 1
+
+        if self.nPushed >= self.segN and self.nSinceSegment >= self.stepN:
+            self.nSinceSegment = 0
+            self.AddSegment()
+
+    def PushWindow(self, window, nNew):
+        """
+        Slide in the segments that end within the newest nNew samples of a (channels x samples)
+        window on the sampling grid, one every stepS, oldest first.
+        """
+        n = window.shape[-1]
+        nSegments = min((min(nNew, n) - 1) // self.stepN + 1, self.segmentPower.maxlen)
+        for k in range(nSegments - 1, -1, -1):
+            end = n - k * self.stepN
+            if end >= self.segN:
+                self.AddSegment(window[:, end - self.segN:end])
+
+    def AddSegment(self, seg=None):
+        """Transform a segment (default: the newest pushed one) and slide it into the cached average."""
+        if seg is None:
+            seg = np.concatenate((self.ring[:, self.pos:], self.ring[:, :self.pos]), axis=1)
+        seg = seg - seg.mean(axis=-1, keepdims=True)
+        slope = (seg @ self.ramp) / self.rampNorm
+        seg = (seg - slope[:, None] * self.ramp) * self.taper
+        spec = np.fft.rfft(seg, n=self.nfft, axis=-1)[:, self.band]
+        power = spec.real**2 + spec.imag**2
+
+        if len(self.segmentPower) == self.segmentPower.maxlen:
+            self.powerSum -= self.segmentPower[0]
+        self.segmentPower.append(power)
+        self.powerSum += power
+
+    def NumSegments(self):
+        return len(self.segmentPower)
+
+    def Estimate(self):
+        """RR (brpm) per channel from the averaged spectrum, 0 before the first segment."""
+        if len(self.segmentPower) == 0 or self.bandFreqs.size == 0:
+            return np.zeros(self.ring.shape[0])
+        return self.bandFreqs[np.argmax(self.powerSum, axis=-1)] * 60.0
+
+
 # Deprecatred code
 # def EstimateRRTime(peaks, time):
 #     # Breaths per minute from peak intervals
@@ -96,9 +270,3 @@ def CombineRREstimates(signal, samplingFreq):
 #     intervals = np.diff(time[peaks])  # in seconds
 #     avgBreathInterval = np.mean(intervals)
 #     return 60.0 / avgBreathInterval if avgBreathInterval > 0 else None
-
-# def EstimateRRFreq(signal, samplingFreq, window=30, low=0.05, high=0.8):
-#     f, Pxx = welch(signal, samplingFreq, nperseg=int(window*samplingFreq))
-#     mask = (f >= low) & (f <= high)
-#     domFreq = f[mask][np.argmax(Pxx[mask])]
-#     return domFreq * 60.0  # convert to breaths per minute
\ No newline at end of file
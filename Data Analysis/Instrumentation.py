@@ -0,0 +1,168 @@
+"""
+Low-overhead instrumentation for the live path.
+
+StageTimer keeps a log-binned duration histogram per stage (monotonic perf_counter_ns),
+event counters (dropped samples, parse errors) and gauges (queue depths). Recording is
+O(1) and allocation-free once a stage has been seen; with enabled=False every call
+returns immediately, so the hooks can stay in the hot loop.
+
+    timer = StageTimer(enabled=True)
+    t = timer.Start()
+    ...
+    timer.Stop("filter", t)
+    timer.MaybeReport()   # prints a summary line every reportIntervalS
+"""
+import math
+import time
+
+BINS_PER_DECADE = 10
+MAX_DECADES = 8  # 1 us .. 100 s
+
+
+class StageHistogram:
+    """Log-binned histogram of durations in microseconds."""
+    __slots__ = ("bins", "count", "totalUs", "maxUs")
+
+    def __init__(self):
+        self.bins = [0] * (BINS_PER_DECADE * MAX_DECADES + 1)
+        self.count = 0
+        self.totalUs = 0.0
+        self.maxUs = 0.0
+
+    def Add(self, us):
+        idx = 0 if us < 1.0 else min(len(self.bins) - 1, int(math.log10(us) * BINS_PER_DECADE) + 1)
+        self.bins[idx] += 1
+        self.count += 1
+        self.totalUs += us
+        if us > self.maxUs:
+            self.maxUs = us
+
+    def Percentile(self, q):
+        """Upper edge (us) of the bin holding the q-th percentile."""
+        if self.count == 0:
+            return math.nan
+        target = q / 100.0 * self.count
+        cumulative = 0
+        for idx, n in enumerate(self.bins):
+            cumulative += n
+            if cumulative >= target:
+                return min(10.0 ** (idx / BINS_PER_DECADE), self.maxUs)
+        return self.maxUs
+
+    def Stats(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {"count": self.count, "meanUs": self.totalUs / self.count,
+                "p50Us": self.Percentile(50), "p95Us": self.Percentile(95),
+                "p99Us": self.Percentile(99), "maxUs": self.maxUs}
+
+
+class StageTimer:
+    """Per-stage timing histograms, counters and gauges; a no-op when disabled."""
+
+    def __init__(self, enabled=True, reportIntervalS=10.0, out=print):
+        self.enabled = enabled
+        self.reportIntervalNs = int(reportIntervalS * 1e9)
+        self.out = out
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}  # name -> [last, max]
+        self.lastReportNs = time.perf_counter_ns()
+
+    def Start(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def Stop(self, stage, tStartNs):
+        """Record the time since tStartNs (from Start) under stage."""
+        if not self.enabled:
+            return
+        self.Record(stage, (time.perf_counter_ns() - tStartNs) / 1e3)
+
+    def Record(self, stage, us):
+        if not self.enabled:
+            return
+        hist = self.stages.get(stage)
+        if hist is None:
+            hist = self.stages[stage] = StageHistogram()
+        hist.Add(us)
+
+    def Count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def Gauge(self, name, value):
+        if not self.enabled:
+            return
+        g = self.gauges.get(name)
+        if g is None:
+            self.gauges[name] = [value, value]
+        else:
+            g[0] = value
+            if value > g[1]:
+                g[1] = value
+
+    def Stats(self):
+        """Snapshot of every stage histogram, counter and gauge."""
+        return {
+            "stages": {name: hist.Stats() for name, hist in list(self.stages.items())},
+            "counters": dict(self.counters),
+            "gauges": {name: {"last": g[0], "max": g[1]} for name, g in list(self.gauges.items())},
+        }
+
+    def Summary(self):
+        """One line: p50/p95 per stage, then counters and gauges."""
+        def Fmt(us):
+            return f"{us:.0f}us" if us < 1e3 else f"{us / 1e3:.2f}ms"
+
+        # Copies: the plot thread may add a stage while the serial loop reports
+        parts = []
+        for name, hist in list(self.stages.items()):
+            if hist.count:
+                parts.append(f"{name} {Fmt(hist.Percentile(50))}/{Fmt(hist.Percentile(95))}")
+        parts += [f"{name}={n}" for name, n in list(self.counters.items())]
+        parts += [f"{name}={g[0]:g} (max {g[1]:g})" for name, g in list(self.gauges.items())]
+        return "[Stats p50/p95] " + " | ".join(parts)
+
+    def MaybeReport(self):
+        """Emit the summary line when reportIntervalS has passed since the last one."""
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        if now - self.lastReportNs >= self.reportIntervalNs:
+            self.lastReportNs = now
+            self.out(self.Summary())
+
+    def Reset(self):
+        self.stages.clear()
+        self.counters.clear()
+        self.gauges.clear()
+
+
+class DropCounter:
+    """
+    Samples missing from a stream, judged from its device timestamps (micros, wraps at 2**32).
+    Drops are counted against the expected schedule, (elapsed / period + 1) samples since
+    the first one, rather than per interval: the firmware's ECG arrives in bursts (one
+    ~8 ms interval, then several sub-ms ones), and a long interval followed by a burst
+    loses nothing.
+    """
+    __slots__ = ("periodUs", "lastTs", "elapsedUs", "received", "dropped")
+
+    def __init__(self, samplingFreq):
+        self.periodUs = 1e6 / samplingFreq
+        self.lastTs = None
+        self.elapsedUs = 0
+        self.received = 0
+        self.dropped = 0
+
+    def Push(self, timestampUs):
+        """Change in the number of missing samples since the previous call (negative when a burst catches up)."""
+        timestampUs = int(timestampUs)
+        if self.lastTs is not None:
+            # Signed step modulo the wrap, so lines arriving slightly out of order step back
+            self.elapsedUs += (timestampUs - self.lastTs + 2**31) % 2**32 - 2**31
+        self.lastTs = timestampUs
+        self.received += 1
+        dropped = max(0, int(round(self.elapsedUs / self.periodUs)) + 1 - self.received)
+        change, self.dropped = dropped - self.dropped, dropped
+        return change
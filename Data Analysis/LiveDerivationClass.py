@@ -1,67 +1,290 @@
+import math
+import time
 from collections import deque
+from itertools import islice
+from dataclasses import dataclass
 import numpy as np
 import UtilityFunctions as UF
 import IMUDerivedRR as IMU
 import ECGDerivedRR as ECG
+import Instrumentation as INS
+import SignalQuality as SQ
+import RRFusion as RF
+
+
+@dataclass(slots=True)
+class ChannelRR:
+    """RR estimates (brpm) for one IMU channel at one hop"""
+    RR: float
+    AC: float
+    FFT: float
+    Welch: float
+
+
+@dataclass(slots=True)
+class IMUHopResult:
+    """Everything LiveDerivation.Update produces at one hop"""
+    z: ChannelRR
+    pitch: ChannelRR
+    accelPitch: ChannelRR
+    manualBrpm: float
+    quality: SQ.SignalQuality = None  # rates are NaN when quality.ok is False
+    fused: float = np.nan             # RRKalman over every source so far
+    fusedStd: float = np.nan
+    windowS: float = np.nan           # seconds of data behind the rates
+    provisional: bool = False         # True for warm-up estimates on a shorter window
+
+
+@dataclass(slots=True)
+class EDRResult:
+    """ECG-derived RR (brpm) from LiveDerivation.ComputeEDR"""
+    RR: float
+    quality: SQ.SignalQuality = None  # RR is NaN when quality.ok is False
+    fused: float = np.nan
+    fusedStd: float = np.nan
+    windowS: float = np.nan
+    provisional: bool = False
+
+
+class HopScheduler:
+    """
+    Adaptive hop for one stream. After every hop Next() lengthens the hop by growth while
+    consecutive raw estimates move less than stableBrpm, and drops back to minHopS when
+    they move more than changeBrpm, the estimate is missing or the quality score shifts
+    by more than qualityStep. cpuBudget (fraction of one core for this stream) floors
+    the hop at cost / cpuBudget, the cost being a running average of the hop's compute
+    time; maxHopS always wins. With maxHopS=None and no budget the hop is fixed.
+    """
+    __slots__ = ("samplingFreq", "minHopS", "maxHopS", "cpuBudget", "growth", "stableBrpm", "changeBrpm",
+                 "qualityStep", "costAlpha", "hopS", "costS", "lastRR", "lastScore")
+
+    def __init__(self, samplingFreq, minHopS=1.0, maxHopS=None, cpuBudget=None, growth=1.5,
+                 stableBrpm=0.5, changeBrpm=1.5, qualityStep=0.1, costAlpha=0.2):
+        self.samplingFreq = samplingFreq
+        self.minHopS = minHopS
+        self.maxHopS = minHopS if maxHopS is None else max(minHopS, maxHopS)
+        self.cpuBudget = cpuBudget
+        self.growth = growth
+        self.stableBrpm = stableBrpm
+        self.changeBrpm = changeBrpm
+        self.qualityStep = qualityStep
+        self.costAlpha = costAlpha
+        self.hopS = minHopS
+        self.costS = None
+        self.lastRR = math.nan
+        self.lastScore = math.nan
+
+    def HopN(self):
+        """Current hop in samples."""
+        return max(1, int(round(self.hopS * self.samplingFreq)))
+
+    def Next(self, rr, qualityScore, computeS):
+        """Hop (samples) until the next estimate, given this hop's raw estimate, quality and compute time."""
+        self.costS = computeS if self.costS is None else self.costS + self.costAlpha * (computeS - self.costS)
+
+        moved = abs(rr - self.lastRR)  # NaN on the first estimate, which keeps the hop
+        if not math.isfinite(rr) or moved > self.changeBrpm or abs(qualityScore - self.lastScore) > self.qualityStep:
+            hopS = self.minHopS
+        elif moved < self.stableBrpm:
+            hopS = self.hopS * self.growth
+        else:
+            hopS = self.hopS
+
+        if self.cpuBudget:
+            hopS = max(hopS, self.costS / self.cpuBudget)
+        self.hopS = min(hopS, self.maxHopS)
+        self.lastRR = rr
+        self.lastScore = qualityScore
+        return self.HopN()
 
 
 class LiveDerivation:
     """
-    Class for live derivation of respiratory rate from IMU and ECG data Stream
+    Class for live derivation of respiratory rate from IMU and ECG data Stream.
+    dtype=np.float32 runs filtering, resampling, FFT and peak detection in single precision.
+    timer is an Instrumentation.StageTimer shared with the caller; the default one is
+    disabled, so the timing hooks cost next to nothing unless asked for.
+    When samples come with their device timestamps (micros), every window is put on the
+    exact fsIMU / fsECG grid before filtering: gaps up to maxRepairS are interpolated and
+    windows spanning a longer gap are skipped instead of estimated.
+    quality is a SignalQuality.SignalQualityMonitor fed with every sample; hops whose
+    window is mostly lead-off or motion skip the estimators and come back with NaN rates.
+    Each hop's estimate is also folded into one RRFusion.RRKalman as it arrives: one IMU
+    measurement (median of z, pitch and accelPitch, which see the same motion) and the EDR,
+    each down-weighted by the overlap with the previous hop's window. The filter runs on
+    device time (unwrapped micros, shared by both streams; sample count without
+    timestamps); fused / fusedStd on each result is that track.
+    hopInterval is the shortest hop; with maxHopInterval and / or cpuBudget each stream
+    gets a HopScheduler that stretches its hop while the per-hop estimate is steady. It
+    watches the raw estimate, not the fused track, which is smoothed by design and would
+    hide the changes the scheduler has to react to.
+    warmupS, e.g. (10, 15, 20), turns on provisional estimates while the buffers fill:
+    each hop uses the longest warm-up window reached so far and is flagged provisional.
+    The incremental state (Welch segments, quality, manual edges, fusion) carries on into
+    the full window, and provisional rates enter the fusion with weight windowS / slidingWindow.
+    status receives a buffering message every statusIntervalS of data until the first estimate.
     """
 
-    def __init__(self, fsIMU, fsECG, slidingWindow=30, hopInterval=1):
+    def __init__(self, fsIMU, fsECG, slidingWindow=30, hopInterval=1, dtype=np.float64, timer=None, maxRepairS=0.1,
+                 quality=None, maxHopInterval=None, cpuBudget=None, warmupS=None, status=print, statusIntervalS=5.0):
+        self.dtype = np.dtype(dtype)
+        self.timer = timer if timer is not None else INS.StageTimer(enabled=False)
         self.slidingWindow = slidingWindow
         self.fsIMU = fsIMU
         self.fsECG = fsECG
         self.sampleWindowIMU = int(round(slidingWindow * fsIMU))
-        self.hopNIMU = int(round(hopInterval * fsIMU))
-        self.hopNECG = int(round(hopInterval * fsECG))
+        self.imuHop = HopScheduler(fsIMU, hopInterval, maxHopInterval, cpuBudget)
+        self.ecgHop = HopScheduler(fsECG, hopInterval, maxHopInterval, cpuBudget)
+        self.hopNIMU = self.imuHop.HopN()
+        self.hopNECG = self.ecgHop.HopN()
         self.sampleWindowECG = int(round(slidingWindow * fsECG))
+        self.warmupS = sorted(w for w in (warmupS or ()) if w < slidingWindow)
+        self.status = status
+        self.statusN = max(1, int(round(statusIntervalS * fsIMU)))
 
         # ring buffers
         self.buffZ = deque(maxlen=self.sampleWindowIMU)
         self.buffPitch = deque(maxlen=self.sampleWindowIMU)
         self.buffAccelPitch = deque(maxlen=self.sampleWindowIMU)
         self.buffECG = deque(maxlen=self.sampleWindowECG)
-        self.manualBuff = deque(maxlen=self.sampleWindowIMU)
+        # device timestamps (unwrapped micros), filled only when the caller passes them
+        self.maxRepairS = maxRepairS
+        self.buffIMUTs = deque(maxlen=self.sampleWindowIMU)
+        self.buffECGTs = deque(maxlen=self.sampleWindowECG)
+        self.deviceClock = UF.MicrosUnwrapper()  # one clock for both streams (same micros() counter)
+        self.manualTracker = UF.ManualBreathTracker(fsIMU, windowS=slidingWindow, maxBrpm=30)
+        self.quality = quality if quality is not None else SQ.SignalQualityMonitor(fsIMU, fsECG, windowS=slidingWindow)
+        self.fusion = RF.RRKalman()
+
+        # Sliding Welch estimate over z, pitch and accelPitch, fed the gridded window at every usable hop
+        self.welch = IMU.WelchRREstimator(fsIMU, nChannels=3, windowS=slidingWindow, stepS=hopInterval, dtype=self.dtype)
 
         # counter to decide when to compute
         self.nSinceLastIMU = 0
         self.nSinceLastECG = 0
+        # samples seen per stream, the fusion clock when no timestamps are given
+        self.nIMU = 0
+        self.nECG = 0
 
 
-    def PrepareIMU(self, buff):
-        data = np.asarray(buff, dtype=float)
-        data = UF.BandpassFilter(data, self.fsIMU, UF.RESP_LOW_BAND, UF.RESP_HIGH_BAND, order=4)
-        return data
+    def Stats(self):
+        """Per-stage timing histograms, counters and gauges recorded so far."""
+        return self.timer.Stats()
+
+    def ActiveWindowS(self, nBuffered, fs):
+        """Window (s) to estimate on with nBuffered samples: the full window, the longest warm-up window reached, or None."""
+        if nBuffered >= int(round(self.slidingWindow * fs)):
+            return self.slidingWindow
+        reached = [w for w in self.warmupS if nBuffered >= int(round(w * fs))]
+        return reached[-1] if reached else None
+
+    @staticmethod
+    def Tail(buff, n):
+        """Newest n samples of a ring buffer (the buffer itself when it holds no more)."""
+        return buff if len(buff) <= n else list(islice(buff, len(buff) - n, None))
+
+    def ReportWarmup(self, nBuffered):
+        """Throttled buffering status: once per statusIntervalS of data."""
+        if self.status is None or nBuffered % self.statusN != 1:
+            return
+        firstS = self.warmupS[0] if self.warmupS else self.slidingWindow
+        waitS = firstS - nBuffered / self.fsIMU
+        kind = "provisional estimate" if self.warmupS else "estimate"
+        self.status(f"Initialising buffers... first {kind} in {waitS:.0f}s")
+
+    def FusionTime(self):
+        """Clock of the fusion filter (s): device time when timestamps are given, else sample count."""
+        if self.deviceClock.lastRaw is not None:
+            return self.deviceClock.unwrapped / 1e6
+        return max(self.nIMU / self.fsIMU, self.nECG / self.fsECG)
+
+    def Reschedule(self, scheduler, rr, quality, tHopNs, gauge):
+        """Next hop (samples) of one stream from this hop's raw rate, quality and compute time."""
+        hopN = scheduler.Next(rr, quality.score, (time.perf_counter_ns() - tHopNs) / 1e9)
+        self.timer.Gauge(gauge, scheduler.hopS)
+        return hopN
+
+    def UniformWindow(self, data, buffTs, fs):
+        """
+        Put a window on the exact fs grid using its device timestamps. Returns None if the
+        window spans a gap too long to repair; windows without timestamps pass through.
+        """
+        if buffTs is None or len(buffTs) != data.shape[-1]:
+            return data
+        t = self.timer.Start()
+        stream = UF.ResampleStream(np.asarray(buffTs) / 1e6, data, fs, maxRepairS=self.maxRepairS)
+        self.timer.Stop("resample", t)
+        if not stream.valid.all():
+            self.timer.Count("gapSkips")
+            return None
+        return stream.values
+
+    def PrepareIMU(self, *buffs, timestamps=None):
+        """
+        Put all IMU channels on the grid and bandpass them in one call.
+        Returns (uniform, filtered), both (channels x samples), or None across a gap.
+        """
+        data = UF.StackChannels(*buffs, dtype=self.dtype)
+        data = self.UniformWindow(data, timestamps, self.fsIMU)
+        if data is None:
+            return None
+        t = self.timer.Start()
+        filtered = UF.BandpassFilter(data, self.fsIMU, UF.RESP_LOW_BAND, UF.RESP_HIGH_BAND, order=4, axis=-1)
+        self.timer.Stop("imuFilter", t)
+        return data, filtered
     
 
-    def PrepareECG(self, buff):
-        data = np.asarray(buff, dtype=float)
+    def PrepareECG(self, buff, timestamps=None):
+        data = np.asarray(buff, dtype=self.dtype)
+        data = self.UniformWindow(data, timestamps, self.fsECG)
+        if data is None:
+            return None
+        t = self.timer.Start()
         data = UF.BandpassFilter(data, self.fsECG, 5, 40, order=4)
+        self.timer.Stop("ecgFilter", t)
         return data
     
-    def UpdateECG(self, ecgSample):
-        """ Push one new ECG Sample"""
-        self.buffECG.append(float(ecgSample))
+    def UpdateECG(self, ecgSample, timestampUs=None):
+        """ Push one new ECG Sample (with its device micros timestamp when known)"""
+        t = self.timer.Start()
+        ecgSample = float(ecgSample)
+        self.buffECG.append(ecgSample)
+        self.quality.PushECG(ecgSample)
+        if timestampUs is not None:
+            self.buffECGTs.append(self.deviceClock.Push(timestampUs))
         self.nSinceLastECG += 1
+        self.nECG += 1
+        self.timer.Stop("ecgBuffer", t)
 
     def ComputeEDR(self, fsUniform=5.0):
         """ Once per hop, compute EDR if enough data """
         
-        if len(self.buffECG) < self.sampleWindowECG:
+        windowS = self.ActiveWindowS(len(self.buffECG), self.fsECG)
+        if windowS is None:
             return None
         if self.nSinceLastECG < self.hopNECG:
             return None
+        hopS = self.nSinceLastECG / self.fsECG
         self.nSinceLastECG = 0
+        tHopNs = time.perf_counter_ns()
+        provisional = windowS < self.slidingWindow
 
-        # Build time axis for current ECG window
-        ecg = np.asarray(self.buffECG, dtype=float)
-        timeS = np.arange(len(ecg)) / self.fsECG
+        tNow = self.FusionTime()
+        quality = self.quality.ECG()
+        if not quality.ok:
+            self.timer.Count("ecgGated")
+            self.hopNECG = self.Reschedule(self.ecgHop, np.nan, quality, tHopNs, "ecgHopS")
+            return EDRResult(np.nan, quality, *self.fusion.Estimate(tNow), windowS, provisional)
 
-        ecgFiltered = self.PrepareECG(ecg)
+        n = int(round(windowS * self.fsECG))
+        ecgFiltered = self.PrepareECG(self.Tail(self.buffECG, n), self.Tail(self.buffECGTs, n))
+        if ecgFiltered is None:
+            return None
+
+        # Time axis for the current ECG window (uniform: by index, or resampled from timestamps)
+        timeS = UF.UniformTimebase(0.0, self.fsECG, len(ecgFiltered))
 
+        t = self.timer.Start()
         amSignal, amTime, _ = ECG.CalcAM(
             ecgFiltered,
             timeS,
@@ -72,64 +295,104 @@ class LiveDerivation:
             useHighpass=False
         )
         if amSignal is None or amTime is None:
+            self.timer.Stop("edr", t)
             print("Am Signal is None")
             return None
         
         rrAM = ECG.CountOrigWindows(
             amSignal,
             amTime,
-            windowS=self.slidingWindow,
-            hopS=self.slidingWindow, # single window estimate
+            windowS=windowS,
+            hopS=windowS, # single window estimate
             threshFactor=0.2,
             zeroCentre=True)
+        self.timer.Stop("edr", t)
         
         if rrAM["RRBrpm"].size == 0 or not np.any(np.isfinite(rrAM["RRBrpm"])):
             print("Could not get an estimated RR")
             return None
         
         rrEstimate = float(rrAM["RRBrpm"][-1])
+        weight = quality.score * windowS / self.slidingWindow
+        self.fusion.Update(tNow, rrEstimate, RF.MeasurementVar("EDR", quality=weight, overlap=windowS / hopS))
+        result = EDRResult(rrEstimate, quality, *self.fusion.Estimate(tNow), windowS, provisional)
+        self.hopNECG = self.Reschedule(self.ecgHop, rrEstimate, quality, tHopNs, "ecgHopS")
 
-        return {"RR": rrEstimate}
+        return result
 
-    def Update(self, az, devicePitch, accelPitch, manualSignal):
+    def Update(self, az, devicePitch, accelPitch, manualSignal, timestampUs=None, accel=None):
         """
-        Push one new sample for each stream, compute RR every hop interval if enough data
+        Push one new sample for each stream, compute RR every hop interval if enough data.
+        accel=(ax, ay, az) feeds the motion check; without it az alone is used.
         """
 
+        t = self.timer.Start()
         self.buffZ.append(float(az))
         self.buffPitch.append(float(devicePitch))
         self.buffAccelPitch.append(float(accelPitch))
-        self.manualBuff.append(int(manualSignal))
+        self.manualTracker.Push(manualSignal)
+        self.quality.PushIMU(*(accel if accel is not None else (0.0, 0.0, az)))
+        if timestampUs is not None:
+            self.buffIMUTs.append(self.deviceClock.Push(timestampUs))
         self.nSinceLastIMU += 1
+        self.nIMU += 1
+        self.timer.Stop("imuBuffer", t)
 
 
-
-        # Need a full window first
-        if len(self.buffZ) < self.sampleWindowIMU:
-            timeLeft = self.slidingWindow - len(self.buffZ) / self.sampleWindowIMU * self.slidingWindow
-            print(f"Initalising buffers... Please wait {timeLeft:.2f}s")
+        # Need a full window (or a warm-up window) first
+        windowS = self.ActiveWindowS(len(self.buffZ), self.fsIMU)
+        if windowS is None:
+            self.ReportWarmup(len(self.buffZ))
             return None
         
         # Only Compute every hop
         if self.nSinceLastIMU < self.hopNIMU:
             # print(f"waiting for next hop interval")
             return None
+        nNew = self.nSinceLastIMU
+        hopS = nNew / self.fsIMU
         self.nSinceLastIMU = 0
+        tHopNs = time.perf_counter_ns()
+        manualBrpm = self.manualTracker.Brpm()
+        tNow = self.FusionTime()
+        provisional = windowS < self.slidingWindow
+
+        # Skip filtering and estimation when too much of the window is motion artefact
+        quality = self.quality.IMU()
+        if not quality.ok:
+            self.timer.Count("imuGated")
+            self.hopNIMU = self.Reschedule(self.imuHop, np.nan, quality, tHopNs, "imuHopS")
+            gated = ChannelRR(np.nan, np.nan, np.nan, np.nan)
+            return IMUHopResult(gated, gated, gated, manualBrpm, quality, *self.fusion.Estimate(tNow), windowS, provisional)
 
         # Prepare windowed signals
-        windowZ = self.PrepareIMU(self.buffZ)
-        windowPitch = self.PrepareIMU(self.buffPitch)
-        windowAccelPitch = self.PrepareIMU(self.buffAccelPitch)
-        manualBrpm = UF.MOBrpm(self.manualBuff, np.arange(len(self.manualBuff)) / self.fsIMU, minBrpm=30)
-
-        zFinal, zAC, zFFT = IMU.CombineRREstimates(windowZ, self.fsIMU)
-        pitchFinal, pitchAC, pitchFFT = IMU.CombineRREstimates(windowPitch, self.fsIMU)
-        accelPitchFinal, accelPitchAC, accelPitchFFT = IMU.CombineRREstimates(windowAccelPitch, self.fsIMU)
-
-        return {
-            "z" : {"RR": zFinal, "AC": zAC, "FFT": zFFT},
-            "pitch" : {"RR": pitchFinal, "AC": pitchAC, "FFT": pitchFFT},
-            "accelPitch" : {"RR": accelPitchFinal, "AC": accelPitchAC, "FFT": accelPitchFFT}
-            ,"manualBrpm": manualBrpm
-        }
-        
\ No newline at end of file
+        n = int(round(windowS * self.fsIMU))
+        buffs = (self.Tail(b, n) for b in (self.buffZ, self.buffPitch, self.buffAccelPitch))
+        prepared = self.PrepareIMU(*buffs, timestamps=self.Tail(self.buffIMUTs, n))
+        if prepared is None:
+            return None
+        uniform, windows = prepared
+
+        # Welch sees the same gridded, gap-checked and quality-gated samples as AC / FFT
+        self.welch.PushWindow(uniform, nNew)
+
+        # One batched AC + FFT pass over every channel
+        t = self.timer.Start()
+        z, pitch, accelPitch = IMU.CombineRREstimatesBatch(windows, self.fsIMU)
+        zWelch, pitchWelch, accelPitchWelch = self.welch.Estimate()
+        self.timer.Stop("estimator", t)
+
+        channels = {}
+        for name, rr, welch in (("z", z, zWelch), ("pitch", pitch, pitchWelch), ("accelPitch", accelPitch, accelPitchWelch)):
+            channels[name] = ChannelRR(float(rr["RR"]), float(rr["AC"]), float(rr["FFT"]), float(welch))
+
+        # The three channels see the same chest motion, so they enter the fusion as one measurement
+        imuRR = RF.CombinedRR([ch.RR for ch in channels.values()])
+        estimates = [v for ch in channels.values() for v in (ch.AC, ch.FFT, ch.Welch)]
+        weight = quality.score * windowS / self.slidingWindow  # warm-up windows count for less
+        self.fusion.Update(tNow, imuRR, RF.MeasurementVar("IMU", estimates, weight, overlap=windowS / hopS))
+        fused, fusedStd = self.fusion.Estimate(tNow)
+        self.hopNIMU = self.Reschedule(self.imuHop, imuRR, quality, tHopNs, "imuHopS")
+
+        return IMUHopResult(**channels, manualBrpm=manualBrpm, quality=quality, fused=fused, fusedStd=fusedStd,
+                            windowS=windowS, provisional=provisional)
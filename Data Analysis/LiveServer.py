@@ -0,0 +1,286 @@
+"""
+Streams live RR hop results to remote subscribers (e.g. the nurses' station) over HTTP.
+
+RRServer runs an asyncio server on its own thread; the serial / DSP loop only calls
+Publish, which hands the hop result to the event loop and returns at once (a few us).
+Conversion to JSON happens on the loop, once per hop however many clients listen.
+Endpoints:
+
+    GET /events  - Server-Sent Events, one "event: imu" / "event: edr" per hop
+    GET /ws      - WebSocket, one JSON text frame per hop
+    GET /latest  - JSON object with the latest message of each stream
+
+Every client has one pending slot per stream. A new hop overwrites the slot, so a client
+that reads slowly gets the newest result rather than a growing backlog, and its socket
+buffer is bounded by the transport's high-water mark. A client that stays stalled for
+stallS seconds is disconnected. Nothing a client does reaches the DSP thread.
+
+Standard library only: the WebSocket side implements just the RFC 6455 subset needed to
+push text frames and answer ping / close.
+"""
+import asyncio
+import base64
+import dataclasses
+import hashlib
+import json
+import math
+import struct
+import threading
+import numpy as np
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+KEEPALIVE_S = 15.0   # SSE comment / WebSocket ping while no hops arrive
+STALL_S = 10.0       # a client that can't take a write for this long is dropped
+HIGH_WATER = 64 * 1024
+WS_MAX_CONTROL = 125  # RFC 6455 limit for ping / pong / close payloads
+WS_MAX_DATA = 4096    # clients only send pings and closes; anything bigger is refused
+WS_CLOSE_TOO_BIG = 1009
+
+
+def JSONSafe(value):
+    """Dataclasses / numpy scalars -> plain JSON types, NaN and inf -> None."""
+    if dataclasses.is_dataclass(value):
+        value = dataclasses.asdict(value)
+    if isinstance(value, dict):
+        return {k: JSONSafe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [JSONSafe(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def HopMessage(stream, tS, result, **extra):
+    """Message for one IMUHopResult ("imu") or EDRResult ("edr") at session time tS."""
+    return {"stream": stream, "t": tS, **JSONSafe(result), **extra}
+
+
+def WSFrame(payload, opcode=0x1):
+    """One unmasked, unfragmented server-to-client WebSocket frame."""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return header + payload
+
+async def ReadWSFrame(reader, maxData=WS_MAX_DATA):
+    """
+    (opcode, payload) of the next client frame; client frames are always masked. Raises
+    ValueError, before reading the payload, for a control frame over 125 bytes or a data
+    frame over maxData.
+    """
+    b0, b1 = await reader.readexactly(2)
+    opcode, n = b0 & 0x0F, b1 & 0x7F
+    if n == 126:
+        n, = struct.unpack("!H", await reader.readexactly(2))
+    elif n == 127:
+        n, = struct.unpack("!Q", await reader.readexactly(8))
+    if n > (WS_MAX_CONTROL if opcode & 0x8 else maxData):
+        raise ValueError(f"{n}-byte frame with opcode {opcode:#x}")
+    mask = await reader.readexactly(4) if b1 & 0x80 else b"\0\0\0\0"
+    data = await reader.readexactly(n)
+    key = (mask * (n // 4 + 1))[:n]
+    return opcode, (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+class Client:
+    """One subscriber: the latest unsent message (JSON text) per stream and a wake-up event."""
+    __slots__ = ("kind", "writer", "pending", "wake", "sent", "coalesced")
+
+    def __init__(self, kind, writer, latest):
+        self.kind = kind  # "sse" or "ws"
+        self.writer = writer
+        self.pending = dict(latest)  # new subscribers start from the latest state
+        self.wake = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0  # hops overwritten before this client took them
+        if self.pending:
+            self.wake.set()
+
+    def Offer(self, stream, text):
+        if stream in self.pending:
+            self.coalesced += 1
+        self.pending[stream] = text
+        self.wake.set()
+
+    def Encode(self, stream, text):
+        if self.kind == "sse":
+            return f"event: {stream}\ndata: {text}\n\n".encode()
+        return WSFrame(text.encode())
+
+
+class RRServer:
+    """
+    Publishes hop results to SSE / WebSocket subscribers from a background event loop.
+    port=0 picks a free port (see .port once started). Use as a context manager or call
+    Start / Stop.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, stallS=STALL_S, keepaliveS=KEEPALIVE_S,
+                 highWater=HIGH_WATER):
+        self.host = host
+        self.port = port
+        self.stallS = stallS
+        self.keepaliveS = keepaliveS
+        self.highWater = highWater
+
+        self.latest = {}
+        self.clients = set()
+        self.published = 0
+        self.disconnectedSlow = 0
+
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def Start(self):
+        self.thread = threading.Thread(target=self.Run, name="RRServer", daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise RuntimeError(f"RR server could not listen on {self.host}:{self.port}") from self.error
+        return self
+
+    def Publish(self, stream, tS, result, **extra):
+        """Send one hop result (see HopMessage) to every subscriber; never blocks."""
+        self.published += 1
+        try:
+            self.loop.call_soon_threadsafe(self.Fanout, stream, tS, result, extra)
+        except (AttributeError, RuntimeError):  # not started / already stopped
+            pass
+
+    def Stop(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(timeout=5.0)
+
+    def __enter__(self):
+        return self.Start()
+
+    def __exit__(self, *exc):
+        self.Stop()
+
+    def Run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.Handle, self.host, self.port))
+            self.port = self.server.sockets[0].getsockname()[1]
+        except OSError as e:
+            self.error = e
+            self.ready.set()
+            self.loop.close()
+            return
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            # Dropping the connections ends every handler on its own (no task cancellation)
+            self.server.close()
+            for client in list(self.clients):
+                client.writer.transport.abort()
+            tasks = asyncio.all_tasks(self.loop)
+            if tasks:
+                self.loop.run_until_complete(asyncio.wait(tasks, timeout=1.0))
+            self.loop.close()
+
+    def Fanout(self, stream, tS, result, extra):
+        text = json.dumps(HopMessage(stream, tS, result, **extra), separators=(",", ":"))
+        self.latest[stream] = text
+        for client in self.clients:
+            client.Offer(stream, text)
+
+    async def Handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10.0)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        method, path = (lines[0].split(" ") + ["", ""])[:2]
+        headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+        path = path.split("?", 1)[0]
+
+        if method != "GET":
+            await self.Respond(writer, "405 Method Not Allowed", b"")
+        elif path == "/latest":
+            body = "{" + ",".join(f'"{stream}":{text}' for stream, text in self.latest.items()) + "}"
+            await self.Respond(writer, "200 OK", body.encode(), "application/json")
+        elif path == "/events":
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache\r\nAccess-Control-Allow-Origin: *\r\n\r\nretry: 2000\n\n")
+            await self.Serve(Client("sse", writer, self.latest), reader)
+        elif path == "/ws" and headers.get("upgrade", "").lower() == "websocket" and "sec-websocket-key" in headers:
+            accept = base64.b64encode(hashlib.sha1(headers["sec-websocket-key"].encode() + WS_GUID).digest())
+            writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+            await self.Serve(Client("ws", writer, self.latest), reader)
+        else:
+            await self.Respond(writer, "404 Not Found", b"")
+
+    async def Respond(self, writer, status, body, contentType="text/plain"):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {contentType}\r\nContent-Length: {len(body)}\r\n"
+                     f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode() + body)
+        try:
+            await asyncio.wait_for(writer.drain(), timeout=self.stallS)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        writer.close()
+
+    async def Serve(self, client, reader):
+        """Push coalesced updates to one subscriber until it leaves or stalls."""
+        client.writer.transport.set_write_buffer_limits(high=self.highWater)
+        self.clients.add(client)
+        listener = asyncio.ensure_future(self.Listen(client, reader))
+        try:
+            while not listener.done():
+                try:
+                    await asyncio.wait_for(client.wake.wait(), timeout=self.keepaliveS)
+                except asyncio.TimeoutError:
+                    client.writer.write(b": keepalive\n\n" if client.kind == "sse" else WSFrame(b"", 0x9))
+                else:
+                    client.wake.clear()
+                    messages, client.pending = client.pending, {}
+                    client.writer.write(b"".join(client.Encode(*m) for m in messages.items()))
+                    client.sent += len(messages)
+                # Waits only while the socket buffer is over highWater; hops arriving
+                # meanwhile overwrite the pending slots instead of piling up
+                await asyncio.wait_for(client.writer.drain(), timeout=self.stallS)
+        except asyncio.TimeoutError:
+            self.disconnectedSlow += 1
+            client.writer.transport.abort()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            listener.cancel()
+            client.writer.close()
+
+    async def Listen(self, client, reader):
+        """Watch the client side: EOF / close ends the session, pings get a pong, oversize frames a close 1009."""
+        try:
+            if client.kind == "sse":
+                while await reader.read(1024):
+                    pass
+                return
+            while True:
+                opcode, payload = await ReadWSFrame(reader)
+                if opcode == 0x8:
+                    client.writer.write(WSFrame(payload[:2], 0x8))
+                    return
+                if opcode == 0x9:
+                    client.writer.write(WSFrame(payload, 0xA))
+        except ValueError:  # frame over the size limit
+            client.writer.write(WSFrame(struct.pack("!H", WS_CLOSE_TOO_BIG), 0x8))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            client.wake.set()  # let Serve notice the listener finished
@@ -0,0 +1,267 @@
+"""
+Parallel parameter sweep for window / hop / threshold / band / onset tuning.
+
+Every combination of a parameter grid is evaluated on every session of the corpus and
+scored against the manual (spacebar) breathing rate from MOBrpm. Sessions run on a
+process pool; inside a session each stage is computed once per distinct value of the
+parameters it actually depends on (STAGE_PARAMS), so e.g. CalcAM runs once per
+onsetSearch no matter how many window / threshold settings are swept on top of it.
+Parsed sessions go through the on-disk ResultCache, so re-running a sweep skips parsing.
+
+Each configuration is charged the stage times it would have paid if run on its own,
+which gives the compute cost per session used as the ranking tie-break.
+
+    python ParameterSweep.py --workers 4 --grid '{"windowS": [20, 30], "hopS": [4, 8]}'
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import UtilityFunctions as UF
+import ECGDerivedRR as ECG
+import IMUDerivedRR as IMU
+import DataLoading as DL
+import FastKernels as FK
+import ResultCache as RC
+import LiveServer as LS
+
+SESSION_FOLDER = Path(__file__).resolve().parent / "Recording Scripts" / "Recording Sessions"
+SESSION_PATTERN = "*Good*.csv"
+
+IMU_FS = 50.0
+ECG_FS = 500.0
+
+# Values used by IMU-ECG-Derivation; any parameter missing from a grid keeps these
+DEFAULT_PARAMS = {
+    "windowS": 30,
+    "hopS": 8,
+    "threshFactor": 0.2,
+    "onsetSearch": 0.1,
+    "imuBand": (0.05, 0.8),
+}
+
+DEFAULT_GRID = {
+    "windowS": [20, 30, 40],
+    "hopS": [4, 8],
+    "threshFactor": [0.1, 0.2, 0.3],
+    "onsetSearch": [0.06, 0.1, 0.15],
+    "imuBand": [(0.05, 0.8), (0.1, 0.5), (0.15, 0.4)],
+}
+
+# Parameters each stage depends on; a stage is shared by all configs that agree on these
+STAGE_PARAMS = {
+    "am": ("onsetSearch",),
+    "amRR": ("onsetSearch", "windowS", "hopS", "threshFactor"),
+    "imuFilter": ("imuBand",),
+    "imuRR": ("imuBand", "windowS", "hopS"),
+}
+
+# Estimators scored against the manual rate (IMU rows follow LoadSession's imuStack)
+ESTIMATORS = ("AM", "z", "pitch", "accelPitch")
+
+CACHE = RC.ResultCache(enabled=os.environ.get("RR_NO_CACHE") is None)
+
+
+def ExpandGrid(grid=None):
+    """Every combination of grid values as a list of full parameter dicts."""
+    grid = DEFAULT_GRID if grid is None else grid
+    unknown = set(grid) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameter(s): {sorted(unknown)}")
+
+    names = list(grid)
+    # Bands arrive as lists from JSON; tuples keep every value hashable for stage keys
+    values = [[tuple(v) if isinstance(v, list) else v for v in grid[name]] for name in names]
+    return [{**DEFAULT_PARAMS, **dict(zip(names, combo))} for combo in itertools.product(*values)]
+
+
+class StageMemo:
+    """Per-session memo of stage outputs and their wall time, keyed on each stage's own parameters."""
+
+    def __init__(self):
+        self.values = {}
+        self.times = {}
+
+    def Get(self, stage, params, func, *args, **kwargs):
+        key = (stage,) + tuple(params[p] for p in STAGE_PARAMS[stage])
+        if key not in self.values:
+            t0 = time.perf_counter()
+            self.values[key] = func(*args, **kwargs)
+            self.times[key] = time.perf_counter() - t0
+        return self.values[key], self.times[key]
+
+
+def LoadSession(filePath):
+    """ECG, IMU channel stack and manual ground truth for one recording."""
+    df = CACHE.Call(DL.LoadData, RC.FileKey(filePath), saveBadRows=False)
+    dfIMU = df[df["az"].notna()].sort_values("Time (s)").reset_index(drop=True)
+    dfECG = df[df["heart"].notna()].sort_values("Time (s)").reset_index(drop=True)
+
+    ecg, ecgTime = ECG.GetRawECG(dfECG)
+    manualBrpm = UF.MOBrpm(dfECG["Manual"].to_numpy(dtype=int), dfECG["Time (s)"].to_numpy(dtype=float))
+
+    _, accelPitch = IMU.AccelTilt(
+        dfIMU["ax"].to_numpy(dtype=float),
+        dfIMU["ay"].to_numpy(dtype=float),
+        dfIMU["az"].to_numpy(dtype=float))
+    imuStack = UF.StackChannels(dfIMU["az"], dfIMU["pitch"], accelPitch)
+    return ecg, ecgTime, imuStack, manualBrpm
+
+
+def SessionMeanRR(rr):
+    """Mean of the finite window estimates, NaN when there are none."""
+    rr = np.asarray(rr, dtype=float)
+    rr = rr[np.isfinite(rr)]
+    return float(rr.mean()) if rr.size else np.nan
+
+def AMSessionRR(amStage, windowS, hopS, threshFactor):
+    amSignal, amTime, _ = amStage
+    if amSignal is None:
+        return np.nan
+    windows = ECG.CountOrigWindows(amSignal, amTime, windowS=windowS, hopS=hopS, threshFactor=threshFactor)
+    return SessionMeanRR(windows["RRBrpm"])
+
+def IMUSessionRR(filtered, samplingFreq, windowS, hopS):
+    """Windowed CombineRREstimates for every channel, all windows in one batched call."""
+    winN = int(round(windowS * samplingFreq))
+    hopN = max(1, int(round(hopS * samplingFreq)))
+    if filtered.shape[-1] < winN:
+        windows = filtered[:, None, :]  # shorter than one window: use what there is
+    else:
+        windows = sliding_window_view(filtered, winN, axis=-1)[:, ::hopN]
+    nChannels, nWindows = windows.shape[:2]
+    rr = IMU.CombineRREstimatesBatch(windows.reshape(nChannels * nWindows, -1), samplingFreq)["RR"]
+    rr = rr.reshape(nChannels, nWindows)
+    rr[rr == 0] = np.nan  # CombineRREstimates reports 0 when no estimate was valid
+    return [SessionMeanRR(row) for row in rr]
+
+
+def WarmUp():
+    """Pay the one-off lazy imports and kernel compilation before any stage is timed."""
+    import scipy.signal, scipy.interpolate  # noqa: F401
+    x = np.zeros(8)
+    idx = np.array([4])
+    FK.DebounceEdges(x, 1.0)
+    FK.CycleDurations(idx, idx, x[:1], 2.0, 10.0)
+    FK.OnsetsBeforeR(x, idx, 2)
+    FK.QrsMask(x.size, idx, 2)
+    FK.UpcrossCounts(x, 0.0, 0.0)
+
+def EvaluateSession(filePath, configs):
+    """Estimates, absolute errors and compute cost of every config on one session."""
+    WarmUp()
+    t0 = time.perf_counter()
+    ecg, ecgTime, imuStack, manualBrpm = LoadSession(filePath)
+    loadS = time.perf_counter() - t0
+
+    memo = StageMemo()
+    rows = []
+    for params in configs:
+        am, tAM = memo.Get("am", params, ECG.CalcAM, ecg, ecgTime, ECG_FS, onsetSearch=params["onsetSearch"])
+        amRR, tAMRR = memo.Get("amRR", params, AMSessionRR, am,
+                               params["windowS"], params["hopS"], params["threshFactor"])
+
+        low, high = params["imuBand"]
+        filtered, tFilt = memo.Get("imuFilter", params, UF.BandpassFilter, imuStack, IMU_FS, low=low, high=high, order=4)
+        imuRR, tIMURR = memo.Get("imuRR", params, IMUSessionRR, filtered, IMU_FS, params["windowS"], params["hopS"])
+
+        estimates = dict(zip(ESTIMATORS, [amRR, *imuRR]))
+        rows.append({
+            "estimates": estimates,
+            "errors": {k: abs(v - manualBrpm) if manualBrpm > 0 else np.nan for k, v in estimates.items()},
+            "costS": tAM + tAMRR + tFilt + tIMURR,
+        })
+
+    return {"session": Path(filePath).name, "manualBrpm": manualBrpm, "loadS": loadS,
+            "sweepS": time.perf_counter() - t0 - loadS, "rows": rows}
+
+
+def RunSweep(sessionPaths, grid=None, workers=None):
+    """Evaluate every grid configuration on every session, one session per worker task."""
+    configs = ExpandGrid(grid)
+    sessionPaths = [os.fspath(p) for p in sessionPaths]
+    if workers == 1:
+        sessions = [EvaluateSession(p, configs) for p in sessionPaths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            sessions = list(pool.map(EvaluateSession, sessionPaths, itertools.repeat(configs)))
+    return configs, sessions
+
+
+def RankConfigs(configs, sessions, rankBy=ESTIMATORS):
+    """
+    Per config: mean absolute error of each estimator over the sessions that have a
+    finite estimate and ground truth, and mean compute cost per session.
+    Sorted by the mean of the rankBy MAEs, then by cost.
+    """
+    ranking = []
+    for i, params in enumerate(configs):
+        mae, coverage = {}, {}
+        for name in ESTIMATORS:
+            errs = np.array([s["rows"][i]["errors"][name] for s in sessions], dtype=float)
+            errs = errs[np.isfinite(errs)]
+            mae[name] = float(errs.mean()) if errs.size else np.nan
+            coverage[name] = int(errs.size)
+
+        scored = [mae[name] for name in rankBy if np.isfinite(mae[name])]
+        ranking.append({
+            "params": params,
+            "score": float(np.mean(scored)) if scored else np.inf,
+            "mae": mae,
+            "coverage": coverage,
+            "costMs": 1e3 * float(np.mean([s["rows"][i]["costS"] for s in sessions])) if sessions else np.nan,
+        })
+
+    ranking.sort(key=lambda r: (r["score"], r["costMs"]))
+    return ranking
+
+
+def PrintRanking(ranking, nSessions, top=10):
+    print(f"\n--- Top {min(top, len(ranking))} of {len(ranking)} configurations over {nSessions} sessions ---")
+    header = f"{'#':>3} {'score':>6} " + " ".join(f"{name:>10}" for name in ESTIMATORS) + f" {'ms/sess':>8}  params"
+    print(header)
+    for k, r in enumerate(ranking[:top], start=1):
+        maes = " ".join(f"{r['mae'][name]:>10.2f}" for name in ESTIMATORS)
+        params = ", ".join(f"{name}={value}" for name, value in r["params"].items())
+        print(f"{k:>3} {r['score']:>6.2f} {maes} {r['costMs']:>8.1f}  {params}")
+
+
+def FindSessions(folder=SESSION_FOLDER, pattern=SESSION_PATTERN):
+    return sorted(Path(folder).glob(pattern))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep RR pipeline parameters over the session corpus.")
+    parser.add_argument("--folder", default=SESSION_FOLDER, help="folder with the session CSVs")
+    parser.add_argument("--pattern", default=SESSION_PATTERN, help="glob for sessions to include")
+    parser.add_argument("--grid", help="JSON dict of parameter -> list of values (default: DEFAULT_GRID)")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (1 runs in-process)")
+    parser.add_argument("--rank-by", nargs="+", default=list(ESTIMATORS), choices=ESTIMATORS,
+                        help="estimators whose MAE makes up the ranking score")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--out", help="write the full ranking and per-session results to this JSON file")
+    args = parser.parse_args()
+
+    paths = FindSessions(args.folder, args.pattern)
+    if not paths:
+        print(f"No sessions matching {args.pattern} in {args.folder}")
+        raise SystemExit(1)
+
+    grid = json.loads(args.grid) if args.grid else None
+    t0 = time.perf_counter()
+    configs, sessions = RunSweep(paths, grid, workers=args.workers)
+    print(f"Evaluated {len(configs)} configurations on {len(sessions)} sessions in {time.perf_counter() - t0:.1f} s")
+
+    ranking = RankConfigs(configs, sessions, rankBy=args.rank_by)
+    PrintRanking(ranking, len(sessions), top=args.top)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            # NaN (no manual count) and inf (nothing scored) are written as null
+            json.dump(LS.JSONSafe({"ranking": ranking, "sessions": sessions}), f, indent=2, allow_nan=False)
+        print(f"\nResults written to {args.out}")
@@ -1,24 +1,73 @@
-import serial
 import numpy as np
 from math import isfinite
 import LiveDerivationClass as LDC
-import UtilityFunctions as UF
 import IMUDerivedRR as IMU
-import keyboard
-import matplotlib.pyplot as plt
-from collections import deque
+import Instrumentation as INS
+from dataclasses import dataclass
 import threading
 import time
 
-# Shared buffers for plotting
-times = deque(maxlen=100) # store latest 100 windows (100 seconds)
-timesEDR = deque(maxlen=100)
-zVals = deque(maxlen=100)
-pitchVals = deque(maxlen=100)
-accelPitchVals = deque(maxlen=100)
-edrVals = deque(maxlen=100)
-manualVals = deque(maxlen=100)
-plot_lock = threading.Lock()
+# serial, keyboard, matplotlib and LiveServer are imported inside the functions that use them,
+# so importing this module (or running headless) never pays for them.
+
+class PlotBuffer:
+    """
+    Last maxlen points of a few series, handed from the serial loop to the plot thread
+    without a lock. Two preallocated arrays alternate: Append writes the new window into
+    the one the reader isn't pointed at, then publishes it by swapping a single (seq, n)
+    tuple. Snapshot copies the front array and retries in the rare case a publish landed
+    mid-copy, so neither side ever waits on the other.
+    """
+
+    def __init__(self, nSeries, maxlen=100):
+        self.maxlen = maxlen
+        self.buffers = (np.full((nSeries, maxlen), np.nan), np.full((nSeries, maxlen), np.nan))
+        self.state = (0, 0)  # (publish count, points in the front buffer)
+
+    def Append(self, *values):
+        """Add one point (one value per series); writer side only."""
+        seq, n = self.state
+        front, back = self.buffers[seq % 2], self.buffers[(seq + 1) % 2]
+        if n < self.maxlen:
+            back[:, :n] = front[:, :n]
+            back[:, n] = values
+            n += 1
+        else:
+            back[:, :-1] = front[:, 1:]
+            back[:, -1] = values
+        self.state = (seq + 1, n)
+
+    def Snapshot(self):
+        """Copy of the published window as an (nSeries, n) array, plus its publish count."""
+        while True:
+            seq, n = self.state
+            data = self.buffers[seq % 2][:, :n].copy()
+            # The Append after next rewrites this buffer, and it may already be doing so
+            # once seq + 1 is out; only a copy with no publish in between is whole
+            if self.state[0] == seq:
+                return data, seq
+
+
+# Shared buffers for plotting: latest 100 hops of each stream
+imuPlot = PlotBuffer(6)  # time, Z, Pitch, AccelPitch, Manual, Fused
+edrPlot = PlotBuffer(2)  # time, EDR
+
+@dataclass(slots=True)
+class ESP32Sample:
+    """One parsed ESP32 line; IMU fields are NaN on ECG lines and ecg is None on IMU lines"""
+    timestamp: float
+    type: str
+    ax: float
+    ay: float
+    az: float
+    gx: float
+    gy: float
+    gz: float
+    roll: float
+    pitch: float
+    yaw: float
+    ecg: object
+
 
 def ParseESP32Line(line):
 
@@ -62,23 +111,73 @@ def ParseESP32Line(line):
         print(f"Unknown data type in line {kind}")
         return None # Malformed line
 
-    return {
-        "timestamp": timestamp,
-        "type": kind, 
-        "ax": ax,
-        "ay": ay,
-        "az": az,
-        "gx": gx,
-        "gy": gy,
-        "gz": gz,
-        "roll": roll,
-        "pitch": pitch,
-        "yaw": yaw,
-        "ecg": ecg
-    }
-
-def PlotThread():
+    return ESP32Sample(timestamp, kind, ax, ay, az, gx, gy, gz, roll, pitch, yaw, ecg)
+
+class BlitPlot:
+    """
+    Live RR figure redrawn by blitting: axes, ticks and legend are rendered once into a
+    cached background, and each frame only restores it and draws the lines on top, so a
+    frame costs the same however long the session runs. A full redraw happens only when
+    a point leaves the current limits (they then grow with headroom, so this stays rare)
+    or the window is resized.
+    """
+
+    def __init__(self, fig, ax, imuLines, edrLine, headroom=0.25, minSpanS=20.0):
+        self.fig, self.ax = fig, ax
+        self.imuLines, self.edrLine = imuLines, edrLine
+        self.lines = [*imuLines, edrLine]
+        self.headroom = headroom
+        self.minSpanS = minSpanS
+        self.background = None
+        for line in self.lines:
+            line.set_animated(True)  # left out of full draws, so the background stays clean
+        fig.canvas.mpl_connect("draw_event", self.OnDraw)
+
+    def OnDraw(self, event):
+        """Recache the background after any full draw (first show, rescale, resize)."""
+        canvas = self.fig.canvas
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
+        for line in self.lines:
+            self.ax.draw_artist(line)
+
+    def Rescale(self, t, y):
+        """Grow the limits if any point falls outside them; True if they changed."""
+        t, y = t[np.isfinite(t)], y[np.isfinite(y)]
+        if t.size == 0 or y.size == 0:
+            return False
+        (x0, x1), (y0, y1) = self.ax.get_xlim(), self.ax.get_ylim()
+        tMin, tMax, yMin, yMax = t.min(), t.max(), y.min(), y.max()
+        if x0 <= tMin and tMax <= x1 and y0 <= yMin and yMax <= y1:
+            return False
+        self.ax.set_xlim(tMin, tMax + self.headroom * max(tMax - tMin, self.minSpanS))
+        pad = self.headroom * max(yMax - yMin, 1.0)
+        self.ax.set_ylim(yMin - pad, yMax + pad)
+        return True
+
+    def Render(self, imu, edr):
+        """Draw one frame from PlotBuffer snapshots; returns True if it needed a full redraw."""
+        tIMU, tEDR = imu[0], edr[0]
+        for line, values in zip(self.imuLines, imu[1:]):
+            line.set_data(tIMU, values)
+        self.edrLine.set_data(tEDR, edr[1])
+
+        canvas = self.fig.canvas
+        rescaled = self.Rescale(np.concatenate((tIMU, tEDR)), np.concatenate((*imu[1:], edr[1])))
+        if rescaled or self.background is None or not getattr(canvas, "supports_blit", False):
+            canvas.draw()  # OnDraw recaches the background and draws the lines
+            canvas.blit(self.fig.bbox)
+            return True
+        canvas.restore_region(self.background)
+        for line in self.lines:
+            self.ax.draw_artist(line)
+        canvas.blit(self.fig.bbox)
+        return False
+
+
+def PlotThread(timer=None, frameS=0.5):
     """ Thread function to handle live plotting """
+    timer = timer if timer is not None else INS.StageTimer(enabled=False)
+    import matplotlib.pyplot as plt
     plt.ion()
     fig, ax = plt.subplots(figsize=(19, 11))
     ax.set_title("Live Respiratory Rate Estimates")
@@ -90,103 +189,186 @@ def PlotThread():
     lineAccelPitch, = ax.plot([], [], label="Accel Pitch RR", color='green')
     lineEDR, = ax.plot([], [], label="EDR RR", color='purple')
     lineManual, = ax.plot([], [], label="Manual BRPM", color='red')
+    lineFused, = ax.plot([], [], label="Fused RR", color='black', linewidth=2)
     ax.legend()
+    plot = BlitPlot(fig, ax, (lineZ, linePitch, lineAccelPitch, lineManual, lineFused), lineEDR)
 
-    fig.canvas.draw()
     plt.show(block=False)
+    fig.canvas.draw()
 
+    lastSeq = None
     while True:
-        time.sleep(0.5)
-        with plot_lock:
-            if len(times) == 0:
-                continue
-
-            # Update plots
-            lineZ.set_data(times, zVals)
-            linePitch.set_data(times, pitchVals)
-            lineAccelPitch.set_data(times, accelPitchVals)
-            lineEDR.set_data(timesEDR, edrVals)
-            lineManual.set_data(times, manualVals)
+        time.sleep(frameS)
+        fig.canvas.flush_events()  # keep the window responsive between frames
+        (imu, seqIMU), (edr, seqEDR) = imuPlot.Snapshot(), edrPlot.Snapshot()
+        if (seqIMU, seqEDR) == lastSeq:
+            continue  # nothing new; the blitted frame is still on screen
+        lastSeq = seqIMU, seqEDR
 
-            ax.relim()
-            ax.autoscale_view()
-        
-        fig.canvas.draw_idle()
-        plt.pause(0.001) # Allow GUI events to process
+        t = timer.Start()
+        if plot.Render(imu, edr):
+            timer.Count("plotRedraws")
+        fig.canvas.flush_events()
+        timer.Stop("plot", t)
 
-# Start plotrting thread before entering serial loop
-plotter = threading.Thread(target=PlotThread, daemon=True)
-plotter.start()
-
-def RunLiveRR(port, baudrate=115200, fsIMU=50, fsECG=500, window=30, hop=1):
+def RunLiveRR(port, baudrate=115200, fsIMU=50, fsECG=500, window=30, hop=1, plot=True, manualKey="space",
+              stats=False, statsInterval=10.0, maxHop=None, cpuBudget=None, warmup=None, serve=None):
     """
-    Connect to ESP32 serial port and derive live respiratory rate
+    Connect to ESP32 serial port and derive live respiratory rate.
+    port may also be an already-open serial-like object (readline/in_waiting/close),
+    e.g. SyntheticSignals.SyntheticSerial for load tests without the device.
+    plot=False runs headless (matplotlib is never imported), manualKey=None disables
+    the keyboard ground truth (keyboard is never imported).
+    stats=True records per-stage timings, dropped samples, serial backlog and
+    sample-to-estimate latency, and prints a summary line every statsInterval seconds.
+    maxHop / cpuBudget let LiveDerivation stretch the hop from hop up to maxHop seconds
+    while the rate is steady, or to stay within cpuBudget of a core per stream.
+    warmup, e.g. (10, 15, 20), prints provisional estimates on those shorter windows
+    while the first full window fills.
+    serve, e.g. "0.0.0.0:8765" or 8765, also publishes every hop result to remote
+    subscribers over SSE (/events) and WebSocket (/ws); see LiveServer.
     """
-    ser = serial.Serial(port, baudrate, timeout=0.5)
-    liveDeriv = LDC.LiveDerivation(fsIMU, fsECG, slidingWindow=window, hopInterval=hop)
+    isPressed = lambda key: False
+    if manualKey is not None:
+        import keyboard
+        isPressed = keyboard.is_pressed
+
+    timer = INS.StageTimer(enabled=stats, reportIntervalS=statsInterval)
+    imuDrops, ecgDrops = INS.DropCounter(fsIMU), INS.DropCounter(fsECG)
+
+    # Start plotting thread before entering serial loop
+    if plot:
+        plotter = threading.Thread(target=PlotThread, args=(timer,), daemon=True)
+        plotter.start()
+
+    server = None
+    if serve is not None:
+        import LiveServer as LS
+        host, _, servePort = str(serve).rpartition(":")
+        server = LS.RRServer(host or "127.0.0.1", int(servePort)).Start()
+        print(f"Publishing hop results on http://{server.host}:{server.port}/events and ws://{server.host}:{server.port}/ws")
 
-    # Running time origin
-    t0 = None
+    # SciPy is first needed when the first window fills; load it in the background meanwhile
+    threading.Thread(target=__import__, args=("scipy.signal",), daemon=True).start()
+
+    if hasattr(port, "readline"):
+        ser = port
+    else:
+        import serial
+        ser = serial.Serial(port, baudrate, timeout=0.5)
+    liveDeriv = LDC.LiveDerivation(fsIMU, fsECG, slidingWindow=window, hopInterval=hop, timer=timer,
+                                   maxHopInterval=maxHop, cpuBudget=cpuBudget, warmupS=warmup)
+
+    # Session time (s) on LiveDerivation's unwrapped device clock, so micros() rollovers
+    # don't send it backwards; the origin is the first sample it took
+    originS = None
+    def SessionTime():
+        nonlocal originS
+        if originS is None:
+            originS = liveDeriv.FusionTime()
+        return liveDeriv.FusionTime() - originS
 
     print("Live RR: streaming... (Ctrl+C to stop)")
     try:
         while True:
             line = ser.readline().decode('utf-8', errors="ignore").strip()
+            tLine = timer.Start()  # arrival of this sample, for sample-to-estimate latency
+            timer.MaybeReport()
             if not line:
                 print("No data received...")
                 continue
             
             data = ParseESP32Line(line)
+            timer.Stop("parse", tLine)
             if data is None:
+                timer.Count("parseErrors")
                 continue
 
-            if t0 is None:
-                t0 = data["timestamp"]
-            
-            tNow = (data["timestamp"] - t0) / 1e6 - window if t0 else 0 # minus the window to start the graph at 0
-            if data["type"] == "IMU":
-                ax, ay, az = data["ax"], data["ay"], data["az"]
-                devicePitch = data["pitch"]
+            if data.type == "IMU":
+                if timer.enabled:
+                    timer.Count("droppedIMU", imuDrops.Push(data.timestamp))
+                ax, ay, az = data.ax, data.ay, data.az
+                devicePitch = data.pitch
                 _, accelPitch = IMU.AccelTilt(np.array([ax]), np.array([ay]), np.array([az]))
                 accelPitch = accelPitch[0]
-                rrEstimate = liveDeriv.Update(data["az"], devicePitch, accelPitch, keyboard.is_pressed("space"))
+                rrEstimate = liveDeriv.Update(data.az, devicePitch, accelPitch, isPressed(manualKey),
+                                              timestampUs=data.timestamp, accel=(ax, ay, az))
+                tS = SessionTime()
+                tNow = tS - window  # minus the window to start the graph at 0
 
-                if rrEstimate is not None and isfinite(rrEstimate["z"]["RR"]):
-                    z = rrEstimate["z"]["RR"]
-                    pitch = rrEstimate["pitch"]["RR"]
-                    accelPitch = rrEstimate["accelPitch"]["RR"]
-                    manualBrpm = rrEstimate["manualBrpm"]
+                if rrEstimate is not None and server is not None:
+                    server.Publish("imu", tS, rrEstimate)
+                if rrEstimate is not None and timer.enabled:
+                    timer.Stop("sampleToIMU", tLine)
+                    timer.Gauge("serialBacklogB", ser.in_waiting)
+                if rrEstimate is not None and not rrEstimate.quality.ok:
+                    q = rrEstimate.quality
+                    print(f"IMU window unusable ({q.reason}, quality {q.score:.2f}) - estimate skipped")
+                if rrEstimate is not None and isfinite(rrEstimate.z.RR):
+                    z = rrEstimate.z.RR
+                    pitch = rrEstimate.pitch.RR
+                    accelPitch = rrEstimate.accelPitch.RR
+                    manualBrpm = rrEstimate.manualBrpm
                     def fmt(x):
                         return f"{x:.2f}" if isfinite(x) and x != 0 else "N/A"
-                    print(f"RR Estimates (brpm) - Z: {fmt(z)}, Pitch: {fmt(pitch)}, AccelPitch: {fmt(accelPitch)}, Manual: {fmt(manualBrpm)}")
+                    tag = f" [provisional, {rrEstimate.windowS:g}s window]" if rrEstimate.provisional else ""
+                    print(f"RR Estimates (brpm) - Z: {fmt(z)}, Pitch: {fmt(pitch)}, AccelPitch: {fmt(accelPitch)}, "
+                          f"Manual: {fmt(manualBrpm)}, Fused: {fmt(rrEstimate.fused)} +/- {rrEstimate.fusedStd:.2f}{tag}")
 
                     # Update data buffers
-                    with plot_lock:
-                        times.append(tNow)
-                        zVals.append(z)
-                        pitchVals.append(pitch)
-                        accelPitchVals.append(accelPitch)
-                        manualVals.append(manualBrpm if manualBrpm is not None else 0)
-            if data["type"] == "ECG":
-                ecg = data["ecg"]
+                    imuPlot.Append(tNow, z, pitch, accelPitch, manualBrpm if manualBrpm is not None else 0,
+                                   rrEstimate.fused)
+            if data.type == "ECG":
+                ecg = data.ecg
                 if ecg is not None:
-                    liveDeriv.UpdateECG(ecg)
+                    if timer.enabled:
+                        timer.Count("droppedECG", ecgDrops.Push(data.timestamp))
+                    liveDeriv.UpdateECG(ecg, timestampUs=data.timestamp)
+                    tS = SessionTime()
+                    tNow = tS - window
                     edr = liveDeriv.ComputeEDR(fsUniform=5.0)
-                    if edr is not None and isfinite(edr["RR"]):
-                        print(f"EDR Estimate (brpm): {edr['RR']:.2f}")
+                    if edr is not None:
+                        timer.Stop("sampleToEDR", tLine)
+                    if edr is not None and server is not None:
+                        server.Publish("edr", tS, edr)
+                    if edr is not None and not edr.quality.ok:
+                        print(f"ECG window unusable ({edr.quality.reason}, quality {edr.quality.score:.2f}) - EDR skipped")
+                    if edr is not None and isfinite(edr.RR):
+                        tag = f" [provisional, {edr.windowS:g}s window]" if edr.provisional else ""
+                        print(f"EDR Estimate (brpm): {edr.RR:.2f}{tag}")
                         # Update edr buffer
-                        with plot_lock:
-                            timesEDR.append(tNow)
-                            edrVals.append(edr['RR'])
+                        edrPlot.Append(tNow, edr.RR)
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, EOFError):  # EOFError: a replayed stream ran out
         print("\nStopping")
+        if stats:
+            print(timer.Summary())
 
     finally:
         ser.close()
-        plt.ioff()
-        plt.show()  
+        if server is not None:
+            server.Stop()
+        if plot:
+            import matplotlib.pyplot as plt
+            plt.ioff()
+            plt.show()
 
 
 if __name__ == "__main__":
-    RunLiveRR("COM4") # Don't forget to set port correctly
+    import argparse
+    parser = argparse.ArgumentParser(description="Live respiratory rate from the ESP32 stream")
+    parser.add_argument("--port", default="COM4") # Don't forget to set port correctly
+    parser.add_argument("--headless", action="store_true", help="no live plot window")
+    parser.add_argument("--no-manual", action="store_true", help="don't read the spacebar ground truth")
+    parser.add_argument("--window", type=float, default=30, help="analysis window (s); the fused track stays stable down to ~20 s")
+    parser.add_argument("--hop", type=float, default=1, help="seconds between estimates (shortest hop when adaptive)")
+    parser.add_argument("--max-hop", type=float, help="let the hop stretch up to this many seconds while the rate is steady")
+    parser.add_argument("--warmup", type=float, nargs="+", help="provisional estimate windows (s) while the first window fills, e.g. 10 15 20")
+    parser.add_argument("--cpu-budget", type=float, help="fraction of one core each stream may spend on estimates")
+    parser.add_argument("--serve", metavar="[HOST:]PORT", help="publish hop results over SSE / WebSocket, e.g. 0.0.0.0:8765")
+    parser.add_argument("--stats", action="store_true", help="record stage timings and print a periodic summary")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between summary lines")
+    args = parser.parse_args()
+    RunLiveRR(args.port, window=args.window, hop=args.hop, plot=not args.headless,
+              manualKey=None if args.no_manual else "space", stats=args.stats, statsInterval=args.stats_interval,
+              maxHop=args.max_hop, cpuBudget=args.cpu_budget, warmup=args.warmup, serve=args.serve)
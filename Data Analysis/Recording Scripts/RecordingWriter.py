@@ -0,0 +1,195 @@
+"""
+Background writer for recording sessions.
+
+The acquisition loop hands rows to SegmentedWriter.Write, which only appends to a
+local batch; full batches go onto a bounded queue that a writer thread drains, writing
+everything it finds in one go. The serial loop therefore never waits on the disk. If the
+disk stalls for longer than the queue can absorb, batches are dropped and counted rather
+than blocking acquisition.
+
+Files rotate every segmentS seconds into numbered segments (recording_..._000.csv,
+recording_..._001.csv, ...), each with its own header so every segment loads on its own.
+A segment is opened by the first rows that go into it and only rotated once it has rows,
+so a late-starting or silent device never leaves header-only files behind.
+fmt="rrb" writes the compressed block-indexed format of RecordingFormat instead of CSV
+(about 12x smaller; only whole blocks reach the file, so durability applies per block).
+durability sets how hard each batch is pushed to disk:
+    "none"  - left to the OS buffers until the segment closes
+    "flush" - flushed to the OS after every batch (survives the script crashing)
+    "fsync" - flushed and fsync'd at most every syncIntervalS (survives power loss)
+"""
+import csv
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+DURABILITY = ("none", "flush", "fsync")
+FORMATS = ("csv", "rrb")
+HEADER = ["ESP32_Data", "Manual"]
+
+
+def ImportRecordingFormat():
+    """RecordingFormat lives in Data Analysis, one level up from the recording scripts."""
+    try:
+        import RecordingFormat
+    except ModuleNotFoundError:
+        sys.path.append(str(Path(__file__).resolve().parent.parent))
+        import RecordingFormat
+    return RecordingFormat
+
+
+class SegmentedWriter:
+    """Rows -> rotating CSV / .rrb segments on a background thread; Write never blocks."""
+
+    def __init__(self, path, segmentS=600.0, durability="flush", syncIntervalS=1.0, batchRows=256,
+                 maxBatchS=0.5, maxQueuedBatches=512, header=HEADER, fmt="csv", blockS=10.0):
+        if durability not in DURABILITY:
+            raise ValueError(f"durability must be one of {DURABILITY}, got {durability!r}")
+        if fmt not in FORMATS:
+            raise ValueError(f"fmt must be one of {FORMATS}, got {fmt!r}")
+        self.RF = ImportRecordingFormat() if fmt == "rrb" else None
+        self.fmt = fmt
+        self.blockS = blockS
+        self.path = Path(path)
+        self.segmentS = segmentS
+        self.durability = durability
+        self.syncIntervalS = syncIntervalS
+        self.batchRows = batchRows
+        self.maxBatchS = maxBatchS
+        self.header = header
+
+        self.pending = []
+        self.batchStart = time.monotonic()
+        self.queue = queue.Queue(maxsize=maxQueuedBatches)
+        self.error = None
+        self.segments = []
+        self.rowsWritten = 0
+        self.rowsDropped = 0
+        self.maxQueued = 0
+
+        self.file = None
+        self.writer = None
+        self.segmentStart = None
+        self.segmentRows = 0
+        self.lastSync = time.monotonic()
+
+        self.thread = threading.Thread(target=self.Run, name="RecordingWriter", daemon=True)
+        self.thread.start()
+
+    def Write(self, row):
+        """Queue one row; hands a batch to the writer thread every batchRows rows or maxBatchS seconds."""
+        self.pending.append(row)
+        if len(self.pending) >= self.batchRows or time.monotonic() - self.batchStart >= self.maxBatchS:
+            self.Submit()
+
+    def Submit(self):
+        """Hand the pending rows to the writer thread without waiting."""
+        if self.error is not None:
+            raise RuntimeError("Recording writer failed") from self.error
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.batchStart = time.monotonic()
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.rowsDropped += len(batch)
+            print(f"[WARN] Disk writer {self.queue.maxsize} batches behind, dropped {len(batch)} rows")
+        self.maxQueued = max(self.maxQueued, self.queue.qsize())
+
+    def Close(self):
+        """Write everything still queued, close the last segment and stop the thread."""
+        self.Submit()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("Recording writer failed") from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def SegmentPath(self, index):
+        if not self.segmentS:
+            return self.path
+        return self.path.with_name(f"{self.path.stem}_{index:03d}{self.path.suffix}")
+
+    def OpenSegment(self):
+        self.CloseSegment()
+        path = self.SegmentPath(len(self.segments))
+        if self.fmt == "rrb":
+            self.file = open(path, "wb")
+            self.writer = self.RF.RRBWriter(self.file, blockS=self.blockS)
+        else:
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.header)
+        self.segments.append(path)
+        self.segmentStart = time.monotonic()
+        self.segmentRows = 0
+
+    def CloseSegment(self):
+        if self.file is None:
+            return
+        if self.fmt == "rrb":
+            self.writer.Close()
+        self.file.flush()
+        if self.durability == "fsync":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def Sync(self):
+        if self.durability == "none":
+            return
+        self.file.flush()
+        now = time.monotonic()
+        if self.durability == "fsync" and now - self.lastSync >= self.syncIntervalS:
+            os.fsync(self.file.fileno())
+            self.lastSync = now
+
+    def Run(self):
+        done = False
+        try:
+            while not done:
+                rows = self.queue.get()
+                # Drain whatever else is waiting so a backlog goes out as one large write
+                batches = [rows]
+                while True:
+                    try:
+                        batches.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batches:
+                    done = True
+                    batches = batches[:batches.index(None)]
+
+                if not batches:
+                    continue
+                if self.file is None or (self.segmentS and self.segmentRows
+                                         and time.monotonic() - self.segmentStart >= self.segmentS):
+                    self.OpenSegment()
+                for rows in batches:
+                    if self.fmt == "rrb":
+                        for line, manual in rows:
+                            self.writer.WriteLine(line, manual)
+                    else:
+                        self.writer.writerows(rows)
+                    self.rowsWritten += len(rows)
+                    self.segmentRows += len(rows)
+                self.Sync()
+        except Exception as e:  # surfaced to the acquisition thread on its next Submit / Close
+            self.error = e
+            # keep draining so Close() never waits on a full queue
+            while not done:
+                done = self.queue.get() is None
+        finally:
+            try:
+                self.CloseSegment()
+            except Exception as e:
+                self.error = self.error or e
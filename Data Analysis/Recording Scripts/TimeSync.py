@@ -5,6 +5,7 @@ import csv
 import keyboard
 from datetime import datetime
 from pathlib import Path
+import RecordingWriter as RW
 
 # Configuration
 PORT_ESP32 = 'COM4' 
@@ -13,6 +14,10 @@ BAUDRATE = 115200
 OUTPUT_FILE = 'timesync_data.csv'
 LAPTOP_MODE = True # When this is true, ESP32 + Laptop spacebar for manual readings.
 FOLDER_PATH = Path("Recording Sessions")
+SEGMENT_S = 600          # start a new segment file every 10 minutes (None: one file)
+DURABILITY = "flush"     # "none", "flush" or "fsync" (see RecordingWriter)
+FORMAT = "csv"           # "rrb": compressed, block-indexed binary (RecordingFormat), ~12x smaller
+MANUAL_POLL_S = 0.02     # spacebar is polled at 50 Hz, not on every row
  
 # Shared buffer
 dataBuffer = []
@@ -56,37 +61,41 @@ def readManual(manualSerial = None):
 
 
 
-def recordData(output_file):
-    """Stream ESP32 lines to CSV with timestamps; MCU dictates the rate."""
+def recordData(output_file, segmentS=SEGMENT_S, durability=DURABILITY, fmt=FORMAT):
+    """
+    Stream ESP32 lines to CSV with timestamps; MCU dictates the rate.
+    Rows are written by a background thread (RecordingWriter), so disk stalls never hold
+    up draining the UART; files rotate every segmentS seconds. fmt="rrb" writes the
+    compressed format, which DataLoading.LoadData reads (and range-loads) directly.
+    """
     ser = initSerial(PORT_ESP32, BAUDRATE)
-
-    # Open CSV once and write header
-    with open(output_file, 'w', newline='', encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['ESP32_Data', 'Manual'])
-
-        print("Recording... Press Ctrl+C to stop.")
-        lines_written = 0
-        try:
-            while True:
-                esp_data = readESP32(ser)
-                if not esp_data:
-                    continue
-
-                manual_data = 1 if (LAPTOP_MODE and keyboard.is_pressed("space")) else 0
-                writer.writerow([esp_data, manual_data])
-
-                # Flush periodically so a crash/power pull doesn't lose data
-                lines_written += 1
-                if (lines_written % 50) == 0:
-                    csvfile.flush()
-
-        except KeyboardInterrupt:
-            print("\nStopping recording...")
-        finally:
-            ser.close()
-            csvfile.flush()
-            print(f"Saved {lines_written} records to {output_file}")
+    writer = RW.SegmentedWriter(output_file, segmentS=segmentS, durability=durability, fmt=fmt)
+
+    print("Recording... Press Ctrl+C to stop.")
+    lines_read = 0
+    manual_data = 0
+    last_poll = 0.0
+    try:
+        while True:
+            esp_data = readESP32(ser)
+            if not esp_data:
+                continue
+
+            now = time.monotonic()
+            if LAPTOP_MODE and now - last_poll >= MANUAL_POLL_S:
+                manual_data = 1 if keyboard.is_pressed("space") else 0
+                last_poll = now
+            writer.Write([esp_data, manual_data])
+            lines_read += 1
+
+    except KeyboardInterrupt:
+        print("\nStopping recording...")
+    finally:
+        ser.close()
+        writer.Close()
+        dropped = f", {writer.rowsDropped} dropped" if writer.rowsDropped else ""
+        print(f"Saved {writer.rowsWritten} of {lines_read} records{dropped} to {len(writer.segments)} file(s): "
+              + ", ".join(p.name for p in writer.segments))
 
 
 def write_csv(filename, data):
@@ -104,6 +113,6 @@ if __name__ == "__main__":
     FOLDER_PATH.mkdir(parents=True, exist_ok=True)  # Ensure the folder exists
 
     # Format it into a string
-    fileName = now.strftime("recording_%Y%m%d_%H%M%S.csv")
+    fileName = now.strftime(f"recording_%Y%m%d_%H%M%S.{FORMAT}")
     filePath = FOLDER_PATH / fileName
     recordData(filePath)
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+Compressed, block-indexed binary recording format (.rrb).
+
+A session is a sequence of independently compressed blocks of about blockS seconds of
+device time, followed by an index, so a time range loads by decompressing only the
+blocks that overlap it.
+
+    file    = FILE_HEADER, block*, index, TRAILER
+    block   = BLOCK_HEADER (row counts, first / min / max unwrapped micros, sizes), zlib(payload)
+    payload = kind   uint8[n]         1 = IMU, 2 = ECG, in arrival order
+              manual uint8[n]
+              dts    int32[n]         micros since the previous row (first row: 0)
+              imu    int32[9, nIMU]   ax..head x IMU_SCALE, delta-encoded per channel
+              ecg    int16[nECG]      ADC counts, delta-encoded
+    index   = INDEX_HEADER, INDEX_ENTRY per block (offset, time span, row counts)
+
+Deltas wrap with the integer type, so they round-trip exactly; every multi-byte array
+is byte-shuffled before compression, which is where most of the saving comes from. The
+firmware prints IMU values with three decimals, so IMU_SCALE = 1000 is lossless. Missing
+values are stored as the type's minimum and read back as NaN.
+If a recording was cut off before the index was written, the block headers are scanned
+instead.
+"""
+import struct
+import zlib
+from dataclasses import dataclass
+import numpy as np
+import UtilityFunctions as UF
+
+MAGIC = b"RRB1"
+TRAILER_MAGIC = b"RRBE"
+BLOCK_TAG = b"BLK1"
+INDEX_TAG = b"IDX1"
+
+FILE_HEADER = struct.Struct("<4sH")                 # magic, imu scale
+BLOCK_HEADER = struct.Struct("<4sIIIqqqII")         # tag, nRows, nIMU, nECG, firstUs, minUs, maxUs, rawLen, compLen
+INDEX_HEADER = struct.Struct("<4sI")                # tag, nBlocks
+INDEX_ENTRY = struct.Struct("<QqqqII")              # offset, firstUs, minUs, maxUs, nIMU, nECG
+TRAILER = struct.Struct("<Q4s")                     # index offset, magic
+
+KIND_IMU = 1
+KIND_ECG = 2
+IMU_FIELDS = ("ax", "ay", "az", "gx", "gy", "gz", "roll", "pitch", "head")
+IMU_SCALE = 1000
+IMU_MISSING = np.iinfo(np.int32).min
+ECG_MISSING = np.iinfo(np.int16).min
+
+
+def Shuffle(a):
+    """Byte planes of an array, most compressible layout for zlib."""
+    return np.ascontiguousarray(a).view(np.uint8).reshape(-1, a.itemsize).T.tobytes()
+
+def Unshuffle(buf, dtype, n):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(buf, dtype=np.uint8, count=n * dtype.itemsize).reshape(dtype.itemsize, n)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(n)
+
+def DeltaEncode(a, axis=-1):
+    """First value then successive differences; wraps with the integer type."""
+    out = np.array(a, copy=True)
+    if out.shape[axis] > 1:
+        body = np.diff(a, axis=axis)
+        np.copyto(np.moveaxis(out, axis, -1)[..., 1:], np.moveaxis(body, axis, -1))
+    return out
+
+def DeltaDecode(a, axis=-1):
+    return np.cumsum(a, axis=axis, dtype=a.dtype)
+
+
+@dataclass(slots=True)
+class RecordingColumns:
+    """Rows of an .rrb recording as flat columns, from ReadColumns"""
+    tsUs: np.ndarray     # unwrapped device micros
+    kind: np.ndarray     # KIND_IMU / KIND_ECG
+    manual: np.ndarray
+    imu: np.ndarray      # (9 x rows) in IMU_FIELDS order, NaN on ECG rows
+    heart: np.ndarray    # NaN on IMU rows
+    originUs: int        # first sample of the recording, the zero of Time (s)
+
+
+class RRBWriter:
+    """Encode firmware lines (with their manual flag) into .rrb blocks as they arrive."""
+
+    def __init__(self, file, blockS=10.0, level=6):
+        self.file = file
+        self.blockUs = int(blockS * 1e6)
+        self.level = level
+        self.clock = UF.MicrosUnwrapper()
+        self.index = []
+        self.nSkipped = 0
+        self.file.write(FILE_HEADER.pack(MAGIC, IMU_SCALE))
+        self.ResetBlock()
+
+    def ResetBlock(self):
+        self.kinds, self.manual, self.tsUs = [], [], []
+        self.imu, self.ecg = [], []
+
+    def WriteLine(self, line, manual=0):
+        """Add one firmware line ("ts_us,IMU,..." / "ts_us,ECG,,,,,,,,,val")."""
+        parts = line.strip().split(",")
+        try:
+            ts = int(parts[0])
+            kind = parts[1].upper()
+            if kind == "IMU" and len(parts) >= 11:
+                value = [round(float(v) * IMU_SCALE) if v else IMU_MISSING for v in parts[2:11]]
+                code = KIND_IMU
+            elif kind == "ECG" and len(parts) >= 11:
+                value = int(parts[10]) if parts[10] else ECG_MISSING
+                code = KIND_ECG
+            else:
+                raise ValueError(kind)
+        except (ValueError, IndexError):
+            self.nSkipped += 1
+            return
+
+        tUs = int(self.clock.Push(ts))
+        if self.tsUs and tUs - self.tsUs[0] >= self.blockUs:
+            self.FlushBlock()
+        (self.imu if code == KIND_IMU else self.ecg).append(value)
+        self.kinds.append(code)
+        self.manual.append(1 if int(manual) else 0)
+        self.tsUs.append(tUs)
+
+    def FlushBlock(self):
+        """Compress and write the rows gathered so far as one block."""
+        if not self.tsUs:
+            return
+        ts = np.asarray(self.tsUs, dtype=np.int64)
+        imu = np.asarray(self.imu, dtype=np.int32).reshape(-1, len(IMU_FIELDS)).T
+        ecg = np.asarray(self.ecg, dtype=np.int16)
+        dts = np.diff(ts, prepend=ts[0]).astype(np.int32)
+
+        raw = b"".join((
+            np.asarray(self.kinds, dtype=np.uint8).tobytes(),
+            np.asarray(self.manual, dtype=np.uint8).tobytes(),
+            Shuffle(dts),
+            b"".join(Shuffle(ch) for ch in DeltaEncode(imu, axis=-1)),
+            Shuffle(DeltaEncode(ecg)),
+        ))
+        comp = zlib.compress(raw, self.level)
+
+        offset = self.file.tell()
+        first, lo, hi = int(ts[0]), int(ts.min()), int(ts.max())
+        self.file.write(BLOCK_HEADER.pack(BLOCK_TAG, ts.size, imu.shape[1], ecg.size, first, lo, hi, len(raw), len(comp)))
+        self.file.write(comp)
+        self.index.append((offset, first, lo, hi, imu.shape[1], ecg.size))
+        self.ResetBlock()
+
+    def Close(self):
+        """Write the last block, the index and the trailer (does not close the file)."""
+        self.FlushBlock()
+        indexOffset = self.file.tell()
+        self.file.write(INDEX_HEADER.pack(INDEX_TAG, len(self.index)))
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(TRAILER.pack(indexOffset, TRAILER_MAGIC))
+
+
+def ReadIndex(f):
+    """Block index as a list of (offset, firstUs, minUs, maxUs, nIMU, nECG)."""
+    f.seek(0)
+    magic, scale = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not an .rrb recording")
+
+    f.seek(0, 2)
+    size = f.tell()
+    if size >= FILE_HEADER.size + TRAILER.size:
+        f.seek(size - TRAILER.size)
+        indexOffset, tail = TRAILER.unpack(f.read(TRAILER.size))
+        if tail == TRAILER_MAGIC:
+            f.seek(indexOffset)
+            tag, nBlocks = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if tag == INDEX_TAG:
+                return [INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size)) for _ in range(nBlocks)]
+
+    # No index (recording cut off): walk the block headers
+    index = []
+    offset = FILE_HEADER.size
+    while offset + BLOCK_HEADER.size <= size:
+        f.seek(offset)
+        tag, nRows, nIMU, nECG, first, lo, hi, rawLen, compLen = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+        if tag != BLOCK_TAG or offset + BLOCK_HEADER.size + compLen > size:
+            break
+        index.append((offset, first, lo, hi, nIMU, nECG))
+        offset += BLOCK_HEADER.size + compLen
+    return index
+
+def ReadBlock(f, offset):
+    """Decode one block into (tsUs, kind, manual, imu (9 x nIMU float, NaN missing), ecg float)."""
+    f.seek(offset)
+    tag, n, nIMU, nECG, first, _, _, rawLen, compLen = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+    raw = zlib.decompress(f.read(compLen))
+
+    pos = 0
+    def Take(dtype, count):
+        nonlocal pos
+        size = np.dtype(dtype).itemsize * count
+        out = Unshuffle(raw[pos:pos + size], dtype, count)
+        pos += size
+        return out
+
+    kind = Take(np.uint8, n)
+    manual = Take(np.uint8, n)
+    tsUs = first + np.cumsum(Take(np.int32, n), dtype=np.int64)
+    imu = DeltaDecode(np.stack([Take(np.int32, nIMU) for _ in IMU_FIELDS]))
+    ecg = DeltaDecode(Take(np.int16, nECG))
+
+    imuF = imu.astype(np.float64) / IMU_SCALE
+    imuF[imu == IMU_MISSING] = np.nan
+    ecgF = ecg.astype(np.float64)
+    ecgF[ecg == ECG_MISSING] = np.nan
+    return tsUs, kind, manual, imuF, ecgF
+
+def ReadColumns(filePath, start=None, end=None):
+    """
+    RecordingColumns of an .rrb recording, optionally only start <= t < end seconds after
+    the first sample; only the blocks overlapping the range are decompressed.
+    """
+    with open(filePath, "rb") as f:
+        index = ReadIndex(f)
+        originUs = index[0][1] if index else 0
+        lo = -np.inf if start is None else originUs + start * 1e6
+        hi = np.inf if end is None else originUs + end * 1e6
+        blocks = [ReadBlock(f, entry[0]) for entry in index if entry[3] >= lo and entry[2] < hi]
+
+    if not blocks:
+        blocks = [(np.zeros(0, np.int64), np.zeros(0, np.uint8), np.zeros(0, np.uint8),
+                   np.zeros((len(IMU_FIELDS), 0)), np.zeros(0))]
+    tsUs, kind, manual = (np.concatenate([b[i] for b in blocks]) for i in range(3))
+    imu = np.full((len(IMU_FIELDS), tsUs.size), np.nan)
+    imu[:, kind == KIND_IMU] = np.concatenate([b[3] for b in blocks], axis=1)
+    heart = np.full(tsUs.size, np.nan)
+    heart[kind == KIND_ECG] = np.concatenate([b[4] for b in blocks])
+
+    keep = (tsUs >= lo) & (tsUs < hi)
+    return RecordingColumns(tsUs[keep], kind[keep], manual[keep], imu[:, keep], heart[keep], originUs)
+
+
+def ConvertCSV(csvPath, rrbPath, blockS=10.0):
+    """Re-encode a CSV recording (ESP32_Data,Manual) as .rrb; returns (csv bytes, rrb bytes)."""
+    import csv
+    import os
+    with open(csvPath, newline="", encoding="utf-8") as src, open(rrbPath, "wb") as dst:
+        reader = csv.reader(src)
+        next(reader, None)
+        writer = RRBWriter(dst, blockS=blockS)
+        for row in reader:
+            if len(row) >= 2:
+                writer.WriteLine(row[0], row[1] or 0)
+        writer.Close()
+    return os.path.getsize(csvPath), os.path.getsize(rrbPath)
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+    parser = argparse.ArgumentParser(description="Convert CSV recordings to the compressed .rrb format")
+    parser.add_argument("csv", nargs="+", help="recording CSV file(s)")
+    parser.add_argument("--block-s", type=float, default=10.0, help="seconds of device time per block")
+    args = parser.parse_args()
+    for path in map(Path, args.csv):
+        out = path.with_suffix(".rrb")
+        csvBytes, rrbBytes = ConvertCSV(path, out, blockS=args.block_s)
+        print(f"{path.name}: {csvBytes / 1e6:.2f} MB -> {rrbBytes / 1e6:.3f} MB ({csvBytes / rrbBytes:.1f}x)")
@@ -0,0 +1,216 @@
+"""
+Persistent on-disk cache for offline session analysis.
+
+Intermediate artifacts (parsed sessions, filtered traces, beat annotations, window RR
+tables) are stored as pickles keyed by:
+  - the content hash of the source recording (pass paths wrapped in FileKey),
+  - the function and the hashes of its array / scalar arguments,
+  - the code version (hash of the DSP module sources), so editing the code invalidates.
+Each stage is keyed on its own inputs, so a parameter sweep only recomputes the stages
+whose inputs actually changed. Entries are evicted least-recently-used once the cache
+grows past maxBytes.
+"""
+import dataclasses
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+from pathlib import Path
+import numpy as np
+import UtilityFunctions as UF
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / ".rr_cache"
+DEFAULT_MAX_BYTES = 1024**3  # 1 GB
+
+# Modules whose source takes part in the code version of every cached stage
+CODE_MODULES = ("UtilityFunctions", "ECGDerivedRR", "IMUDerivedRR", "FastKernels", "DataLoading", "RecordingFormat")
+
+# Argument types whose repr is a complete, stable description of the value
+SCALAR_TYPES = (type(None), bool, int, float, complex, str, bytes, np.generic, np.dtype)
+
+fileHashes = {}    # (path, size, mtime_ns) -> sha256, avoids re-hashing the same recording
+codeVersions = {}  # module name -> sha256 of its source
+
+
+class FileKey:
+    """Marks a path argument that should be keyed by file content rather than by name."""
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+
+    def __repr__(self):
+        return f"FileKey({self.path!r})"
+
+
+def FileHash(path, chunkSize=1 << 20):
+    """sha256 of a file's content (memoized on path, size and mtime)."""
+    st = os.stat(path)
+    memoKey = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memoKey not in fileHashes:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunkSize), b""):
+                h.update(chunk)
+        fileHashes[memoKey] = h.hexdigest()
+    return fileHashes[memoKey]
+
+
+def ModuleVersion(moduleName):
+    """sha256 of a module's source, empty if it isn't a loaded source module."""
+    if moduleName in codeVersions:
+        return codeVersions[moduleName]
+    module = sys.modules.get(moduleName)
+    if module is None:
+        return ""  # not imported (yet), so it can't affect this result; don't memoize
+    try:
+        source = inspect.getsource(module)
+    except (OSError, TypeError):
+        source = ""
+    codeVersions[moduleName] = hashlib.sha256(source.encode()).hexdigest()
+    return codeVersions[moduleName]
+
+
+def CodeVersion(func):
+    """Version of func: its own module plus the shared DSP modules."""
+    h = hashlib.sha256()
+    for name in sorted(set(CODE_MODULES) | {func.__module__}):
+        h.update(name.encode())
+        h.update(ModuleVersion(name).encode())
+    return h.hexdigest()
+
+
+def HashValue(value, h):
+    """
+    Feed a stable digest of value into hashlib object h. Types without a known stable
+    digest raise TypeError rather than falling back to repr, which can be truncated
+    (large arrays) or identity-based (default object repr) and so share keys.
+    """
+    if isinstance(value, FileKey):
+        h.update(b"file:" + FileHash(value.path).encode())
+    elif isinstance(value, np.ndarray):
+        arr = np.ascontiguousarray(value)
+        h.update(f"nd:{arr.dtype.str}:{arr.shape}".encode())
+        if arr.dtype.hasobject:
+            h.update(pickle.dumps(arr, protocol=4))
+        else:
+            h.update(arr.view(np.uint8).reshape(-1).data if arr.size else b"")
+    elif isinstance(value, (list, tuple)):
+        h.update(f"seq{len(value)}:".encode())
+        for v in value:
+            HashValue(v, h)
+    elif isinstance(value, dict):
+        h.update(f"dict{len(value)}:".encode())
+        for k in sorted(value, key=repr):
+            h.update(repr(k).encode())
+            HashValue(value[k], h)
+    elif callable(value) and hasattr(value, "__qualname__"):
+        h.update(f"fn:{value.__module__}.{value.__qualname__}".encode())
+    elif hasattr(value, "to_numpy") and hasattr(value, "columns"):  # pandas DataFrame
+        import pandas as pd
+        h.update(repr(list(value.columns)).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif hasattr(value, "to_numpy"):  # pandas Series
+        HashValue(value.to_numpy(), h)
+    elif isinstance(value, SCALAR_TYPES):
+        h.update(f"{type(value).__name__}:{value!r}".encode())
+    elif isinstance(value, os.PathLike):
+        h.update(b"path:" + os.fsencode(value))
+    elif isinstance(value, UF.UniformTimebase):
+        h.update(f"timebase:{value.t0!r}:{value.fs!r}:{value.n}".encode())
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        h.update(f"dc:{type(value).__module__}.{type(value).__qualname__}:".encode())
+        HashValue({f.name: getattr(value, f.name) for f in dataclasses.fields(value)}, h)
+    else:
+        raise TypeError(f"ResultCache can't key an argument of type {type(value).__qualname__}")
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache on disk. Use Call(func, *args, **kwargs) in place of
+    func(*args, **kwargs); wrap recording paths in FileKey.
+    """
+
+    def __init__(self, cacheDir=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cacheDir = Path(cacheDir)
+        self.maxBytes = maxBytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def Key(self, func, args, kwargs):
+        h = hashlib.sha256()
+        h.update(f"{func.__module__}.{func.__qualname__}".encode())
+        h.update(CodeVersion(func).encode())
+        HashValue(list(args), h)
+        HashValue(kwargs, h)
+        return h.hexdigest()
+
+    def PathFor(self, func, key):
+        return self.cacheDir / f"{func.__name__}-{key[:40]}.pkl"
+
+    def Call(self, func, *args, **kwargs):
+        """Return func(*args, **kwargs), from disk when an identical call was cached."""
+        realArgs = [a.path if isinstance(a, FileKey) else a for a in args]
+        realKwargs = {k: (v.path if isinstance(v, FileKey) else v) for k, v in kwargs.items()}
+        if not self.enabled:
+            return func(*realArgs, **realKwargs)
+
+        path = self.PathFor(func, self.Key(func, args, kwargs))
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)  # mark as recently used
+            self.hits += 1
+            return result
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            pass  # missing, partial or written by incompatible code: recompute
+
+        self.misses += 1
+        result = func(*realArgs, **realKwargs)
+        self.Store(path, result)
+        return result
+
+    def Store(self, path, result):
+        self.cacheDir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)  # atomic, readers never see a partial entry
+        self.Evict()
+
+    def Entries(self):
+        """(mtime, size, path) of every entry, oldest first."""
+        if not self.cacheDir.exists():
+            return []
+        entries = []
+        for p in self.cacheDir.glob("*.pkl"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        return sorted(entries)
+
+    def Evict(self):
+        """Drop least-recently-used entries until the cache fits in maxBytes."""
+        entries = self.Entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def Clear(self):
+        for _, _, p in self.Entries():
+            p.unlink(missing_ok=True)
+
+    def Stats(self):
+        entries = self.Entries()
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
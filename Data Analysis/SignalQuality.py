@@ -0,0 +1,149 @@
+"""
+Cheap signal-quality index for the live path.
+
+Each incoming sample updates a few running-window statistics in O(1): a short window
+(qualityWindowS) decides whether the sample itself looks usable, and the fraction of
+unusable samples across the analysis window is the quality score. LiveDerivation checks
+the score before each hop and skips the AC/FFT and AM/CountOrig estimators when too much
+of the window is bad.
+
+    ECG  - lead-off: the trace goes flat (tiny short-window std) or sits on the
+           ADC rails (0 / 4095).
+    IMU  - motion artefact: large sample-to-sample steps of the acceleration vector.
+           Breathing tilts the sensor by a degree or two over seconds, well under the
+           sensor noise per sample, so only movement (walking, knocks) lifts this. The
+           firmware's gx/gy/gz columns carry the magnetometer, so the accelerometer
+           stands in for gyro energy.
+"""
+import math
+from collections import deque
+from dataclasses import dataclass
+
+ECG_FULL_SCALE = 4095  # 12-bit ADC
+
+QUALITY_WINDOW_S = 2.0   # short window judging each sample
+ECG_FLAT_STD = 3.0       # ADC counts; a connected lead is ~100-300 counts std
+ECG_MAX_SATURATED = 0.2  # fraction of the short window on the rails
+IMU_MOTION_G = 0.05      # RMS step of the accel vector; still recordings stay under ~0.026 g
+MAX_BAD_FRACTION = 0.1   # share of the analysis window allowed to be bad
+
+
+@dataclass(slots=True)
+class SignalQuality:
+    """Quality of one analysis window; ok=False means the estimators were skipped"""
+    ok: bool
+    score: float  # 1 - fraction of bad samples in the window
+    reason: str   # cause of the latest bad sample ("flat", "saturated", "motion", "missing"), "" if none
+
+
+class RunningWindowStats:
+    """Mean and standard deviation over the last windowN samples, O(1) per sample."""
+    __slots__ = ("values", "sum", "sumSq", "nSinceResum")
+
+    def __init__(self, windowN):
+        self.values = deque(maxlen=max(1, int(windowN)))
+        self.sum = 0.0
+        self.sumSq = 0.0
+        self.nSinceResum = 0
+
+    def Push(self, x):
+        values = self.values
+        if len(values) == values.maxlen:
+            old = values[0]
+            self.sum -= old
+            self.sumSq -= old * old
+        values.append(x)
+        self.sum += x
+        self.sumSq += x * x
+
+        # Re-sum once per window so round-off from the running updates can't accumulate
+        self.nSinceResum += 1
+        if self.nSinceResum >= values.maxlen:
+            self.nSinceResum = 0
+            self.sum = math.fsum(values)
+            self.sumSq = math.fsum(v * v for v in values)
+
+    def Full(self):
+        return len(self.values) == self.values.maxlen
+
+    def Mean(self):
+        return self.sum / len(self.values) if self.values else math.nan
+
+    def Std(self):
+        n = len(self.values)
+        if n == 0:
+            return math.nan
+        mean = self.sum / n
+        return math.sqrt(max(0.0, self.sumSq / n - mean * mean))
+
+
+class SignalQualityMonitor:
+    """
+    Incremental quality index for the ECG and IMU streams of LiveDerivation.
+    windowS is the analysis window the estimators see; a window is usable when no more
+    than maxBadFraction of its samples were judged bad.
+    """
+
+    def __init__(self, fsIMU, fsECG, windowS=30, qualityWindowS=QUALITY_WINDOW_S,
+                 flatStd=ECG_FLAT_STD, maxSaturated=ECG_MAX_SATURATED, motionG=IMU_MOTION_G,
+                 maxBadFraction=MAX_BAD_FRACTION, fullScale=ECG_FULL_SCALE):
+        self.flatStd = flatStd
+        self.maxSaturated = maxSaturated
+        self.motionG = motionG
+        self.maxBadFraction = maxBadFraction
+        self.fullScale = fullScale
+
+        self.ecgShort = RunningWindowStats(qualityWindowS * fsECG)
+        self.ecgRails = RunningWindowStats(qualityWindowS * fsECG)
+        self.ecgBad = RunningWindowStats(windowS * fsECG)
+        self.ecgReason = ""
+
+        self.imuStep = RunningWindowStats(qualityWindowS * fsIMU)
+        self.imuBad = RunningWindowStats(windowS * fsIMU)
+        self.imuReason = ""
+        self.lastAccel = None
+
+    def PushECG(self, value):
+        """Judge one raw ECG sample (ADC counts)."""
+        reason = ""
+        if not math.isfinite(value):
+            reason = "missing"
+        else:
+            self.ecgShort.Push(value)
+            self.ecgRails.Push(1.0 if value <= 0 or value >= self.fullScale else 0.0)
+            if self.ecgRails.Mean() > self.maxSaturated:
+                reason = "saturated"
+            elif self.ecgShort.Full() and self.ecgShort.Std() < self.flatStd:
+                reason = "flat"
+        self.ecgBad.Push(1.0 if reason else 0.0)
+        if reason:
+            self.ecgReason = reason
+
+    def PushIMU(self, ax, ay, az):
+        """Judge one accelerometer sample (g). Pass ax=ay=0 to judge az alone."""
+        reason = ""
+        if not math.isfinite(ax + ay + az):
+            reason = "missing"
+        else:
+            if self.lastAccel is not None:
+                lx, ly, lz = self.lastAccel
+                self.imuStep.Push((ax - lx) ** 2 + (ay - ly) ** 2 + (az - lz) ** 2)
+                if self.imuStep.Mean() > self.motionG * self.motionG:
+                    reason = "motion"
+            self.lastAccel = (ax, ay, az)
+        self.imuBad.Push(1.0 if reason else 0.0)
+        if reason:
+            self.imuReason = reason
+
+    def Quality(self, bad, reason):
+        badFraction = bad.Mean() if bad.values else 0.0
+        ok = badFraction <= self.maxBadFraction
+        return SignalQuality(ok, 1.0 - badFraction, reason if badFraction > 0 else "")
+
+    def ECG(self):
+        """Quality of the current ECG analysis window."""
+        return self.Quality(self.ecgBad, self.ecgReason)
+
+    def IMU(self):
+        """Quality of the current IMU analysis window."""
+        return self.Quality(self.imuBad, self.imuReason)
@@ -0,0 +1,332 @@
+"""
+Synthetic ECG + respiration signals with a known breathing rate, for benchmarks and
+load testing. Amplitudes roughly match the device: ECG in 12-bit ADC counts around
+mid-scale, accelerometer in g with the chest-worn tilt seen in the recordings.
+
+SyntheticSession renders whole sessions in the firmware's "ts_us,KIND,..." line format,
+either as raw serial lines (what ParseESP32Line sees) or as TimeSync recording rows with
+the Manual column (what LoadData reads). Sessions are rendered chunk by chunk, so hours
+of data stream out at constant memory:
+
+    session = SyntheticSession(SessionSpec(durationS=3600, respRateBrpm=((0, 12), (3600, 20))))
+    session.WriteRecording("synthetic.csv")
+    for block in session.Lines():    # bytes, raw firmware lines
+        ...
+"""
+from dataclasses import dataclass
+import numpy as np
+
+# Gaussian PQRST components: (offset from R in s, width in s, amplitude in ADC counts)
+PQRST = (
+    (-0.20, 0.025, 40.0),   # P
+    (-0.03, 0.010, -60.0),  # Q
+    (0.00, 0.012, 550.0),   # R
+    (0.03, 0.010, -120.0),  # S
+    (0.25, 0.045, 90.0),    # T
+)
+ECG_BASELINE = 2280.0  # ADC counts
+ECG_FULL_SCALE = 4095  # 12-bit ADC
+MICROS_WRAP = 2**32    # micros() rolls over after ~71.6 min
+
+def BeatTemplate(fs):
+    """One PQRST beat sampled at fs, returned with the index of the R peak."""
+    t = np.arange(int(round(-0.3 * fs)), int(round(0.45 * fs)) + 1) / fs
+    beat = np.zeros(t.size)
+    for offset, width, amp in PQRST:
+        beat += amp * np.exp(-0.5 * ((t - offset) / width)**2)
+    return beat, int(np.argmin(np.abs(t)))
+
+def BreathPhase(t, respRateBrpm):
+    """
+    Breathing phase in cycles at times t. respRateBrpm is a constant, or a sequence of
+    (timeS, brpm) knots with the rate linear in between (and held outside).
+    """
+    t = np.asarray(t, dtype=float)
+    if np.isscalar(respRateBrpm):
+        return respRateBrpm / 60.0 * t
+
+    knots = np.asarray(respRateBrpm, dtype=float)
+    kt, kf = knots[:, 0], knots[:, 1] / 60.0
+    # Phase accumulated at each knot (trapezoid of the linear rate), then within the segment
+    cum = np.concatenate(([kf[0] * kt[0]], kf[0] * kt[0] + np.cumsum(0.5 * (kf[1:] + kf[:-1]) * np.diff(kt))))
+    k = np.clip(np.searchsorted(kt, t, side="right") - 1, 0, kt.size - 1)
+    dt = t - kt[k]
+    slope = np.zeros(kt.size)
+    slope[:-1] = np.diff(kf) / np.diff(kt)
+    before = t < kt[0]
+    phase = cum[k] + kf[k] * dt + 0.5 * slope[k] * dt**2 * (~before)
+    return np.where(before, kf[0] * t, phase)
+
+def RespRate(t, respRateBrpm):
+    """True breathing rate (brpm) at times t."""
+    if np.isscalar(respRateBrpm):
+        return np.full(np.shape(t), float(respRateBrpm))
+    knots = np.asarray(respRateBrpm, dtype=float)
+    return np.interp(t, knots[:, 0], knots[:, 1])
+
+def Respiration(t, respRateBrpm):
+    """Unit-amplitude breathing waveform (sin of the breathing phase)."""
+    return np.sin(2.0 * np.pi * BreathPhase(t, respRateBrpm))
+
+def BeatTimes(durationS, heartRateBpm=70.0, respRateBrpm=15.0, hrvStdS=0.0, rsaDepthS=0.0, rng=None, firstBeatS=0.5):
+    """
+    R-peak times: mean interval 60/heartRateBpm, plus random beat-to-beat jitter (hrvStdS)
+    and respiratory sinus arrhythmia (interval swings by rsaDepthS with the breathing phase).
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    meanRR = 60.0 / heartRateBpm
+    nBeats = int(np.ceil(durationS / meanRR)) + 2
+    rr = np.full(nBeats, meanRR)
+    if hrvStdS > 0:
+        rr += hrvStdS * rng.standard_normal(nBeats)
+    if rsaDepthS > 0:
+        nominal = firstBeatS + np.concatenate(([0.0], np.cumsum(rr[:-1])))
+        rr -= rsaDepthS * Respiration(nominal, respRateBrpm)  # shorter intervals on inhale
+    rr = np.maximum(rr, 0.3)
+    beats = firstBeatS + np.concatenate(([0.0], np.cumsum(rr[:-1])))
+    return beats[beats < durationS]
+
+def RenderECG(timeS, fs, beatTimes, respRateBrpm, amDepth=0.15, bwDepth=40.0, noiseStd=5.0, rng=None):
+    """
+    ECG samples at timeS (uniform at fs): beats scaled by 1 +- amDepth with the breathing
+    phase at their R peak, baseline wander of bwDepth ADC counts, white noise.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    timeS = np.asarray(timeS, dtype=float)
+    n = timeS.size
+    ecg = np.zeros(n)
+    beat, rOffset = BeatTemplate(fs)
+
+    if n:
+        # Beats whose template overlaps this stretch, scattered in one go (beats x template samples)
+        t0 = timeS[0]
+        lo, hi = np.searchsorted(beatTimes, [t0 - 0.5, timeS[-1] + 0.5])
+        tBeats = beatTimes[lo:hi]
+        rIdx = np.round((tBeats - t0) * fs).astype(np.int64)
+        amps = 1.0 + amDepth * Respiration(tBeats, respRateBrpm)
+        idx = rIdx[:, None] + (np.arange(beat.size) - rOffset)[None, :]
+        vals = amps[:, None] * beat[None, :]
+        valid = (idx >= 0) & (idx < n)
+        np.add.at(ecg, idx[valid], vals[valid])
+
+    ecg += ECG_BASELINE + bwDepth * Respiration(timeS, respRateBrpm)
+    ecg += noiseStd * rng.standard_normal(n)
+    return ecg
+
+
+def SyntheticECG(durationS, fs=500.0, heartRateBpm=70.0, respRateBrpm=15.0,
+                 amDepth=0.15, bwDepth=40.0, noiseStd=5.0, seed=0, hrvStdS=0.0, rsaDepthS=0.0):
+    """
+    ECG with respiratory amplitude modulation (R amplitude scaled by 1 +- amDepth) and
+    baseline wander (bwDepth ADC counts), both at respRateBrpm.
+    Returns (ecg, timeS).
+    """
+    rng = np.random.default_rng(seed)
+    timeS = np.arange(int(round(durationS * fs))) / fs
+    beats = BeatTimes(durationS, heartRateBpm, respRateBrpm, hrvStdS, rsaDepthS, rng)
+    return RenderECG(timeS, fs, beats, respRateBrpm, amDepth, bwDepth, noiseStd, rng), timeS
+
+def SyntheticIMU(durationS, fs=50.0, respRateBrpm=15.0, basePitchDeg=-74.0, tiltDepthDeg=1.5,
+                 noiseStd=0.003, seed=0):
+    """
+    Chest tilt modulated by breathing, as seen by the accelerometer.
+    Returns (timeS, ax, ay, az, pitchDeg) with accelerations in g.
+    """
+    rng = np.random.default_rng(seed)
+    timeS = np.arange(int(round(durationS * fs))) / fs
+    return (timeS,) + RenderIMU(timeS, respRateBrpm, basePitchDeg, tiltDepthDeg, noiseStd, rng)
+
+def RenderIMU(timeS, respRateBrpm, basePitchDeg=-74.0, tiltDepthDeg=1.5, noiseStd=0.003, rng=None):
+    """(ax, ay, az, pitchDeg) at timeS for a chest tilt that follows the breathing phase."""
+    rng = rng if rng is not None else np.random.default_rng(0)
+    pitchDeg = basePitchDeg + tiltDepthDeg * Respiration(timeS, respRateBrpm)
+    pitch = np.deg2rad(pitchDeg)
+
+    ax = -np.sin(pitch) + noiseStd * rng.standard_normal(pitch.size)
+    ay = noiseStd * rng.standard_normal(pitch.size)
+    az = np.cos(pitch) + noiseStd * rng.standard_normal(pitch.size)
+    return ax, ay, az, pitchDeg
+
+def SyntheticManual(timeS, respRateBrpm=15.0, inhaleFraction=0.4):
+    """Manual (spacebar) 0/1 trace: held down for the inhale part of every breath."""
+    return ((BreathPhase(timeS, respRateBrpm) % 1.0) < inhaleFraction).astype(int)
+
+
+@dataclass(slots=True)
+class SessionSpec:
+    """Parameters of one synthetic recording"""
+    durationS: float = 120.0
+    respRateBrpm: object = 15.0  # constant, or ((timeS, brpm), ...) knots
+    heartRateBpm: float = 70.0
+    hrvStdS: float = 0.02        # random beat-to-beat RR jitter
+    rsaDepthS: float = 0.04      # respiratory sinus arrhythmia
+    amDepth: float = 0.15
+    bwDepth: float = 40.0
+    ecgNoise: float = 5.0
+    fsECG: float = 500.0
+    fsIMU: float = 50.0
+    basePitchDeg: float = -74.0
+    tiltDepthDeg: float = 1.5
+    imuNoise: float = 0.003
+    headingDeg: float = 35.7
+    magnetometer: tuple = (2.4, 0.2, 3.1)  # the firmware sends magnetometer values in the gx/gy/gz slots
+    inhaleFraction: float = 0.4
+    jitterUs: float = 3.0        # timestamp jitter around the sampling schedule
+    dropRate: float = 0.0        # fraction of lines lost on the link
+    startUs: int = 21_300_000    # micros() at the first sample
+    seed: int = 0
+
+
+class SyntheticSession:
+    """Firmware-format rendering of a SessionSpec, chunk by chunk."""
+
+    def __init__(self, spec=None, **overrides):
+        self.spec = spec if spec is not None else SessionSpec(**overrides)
+        rng = np.random.default_rng(self.spec.seed)
+        self.beatTimes = BeatTimes(self.spec.durationS + 1.0, self.spec.heartRateBpm, self.spec.respRateBrpm,
+                                   self.spec.hrvStdS, self.spec.rsaDepthS, rng)
+
+    def TrueRR(self, timeS):
+        """Breathing rate (brpm) the session was generated with, at timeS."""
+        return RespRate(timeS, self.spec.respRateBrpm)
+
+    def MeanRR(self):
+        """Mean true breathing rate over the session (cycles / duration)."""
+        s = self.spec
+        return float(BreathPhase(s.durationS, s.respRateBrpm) - BreathPhase(0.0, s.respRateBrpm)) * 60.0 / s.durationS
+
+    def Chunks(self, chunkS=60.0):
+        """
+        Yield (ecgTime, ecgTs, ecg, ecgManual, imuTime, imuTs, imuFields, imuManual) per chunk:
+        sample times in s, device micros timestamps (wrapping like micros()), values, and
+        the manual trace. imuFields is (n x 9) ax..head.
+        """
+        s = self.spec
+        for k in range(int(np.ceil(s.durationS / chunkS))):
+            rng = np.random.default_rng((s.seed, k))  # per-chunk stream: any chunk renders the same on its own
+            t0, t1 = k * chunkS, min((k + 1) * chunkS, s.durationS)
+
+            ecgT = np.arange(int(np.ceil(t0 * s.fsECG)), int(np.ceil(t1 * s.fsECG))) / s.fsECG
+            ecg = RenderECG(ecgT, s.fsECG, self.beatTimes, s.respRateBrpm, s.amDepth, s.bwDepth, s.ecgNoise, rng)
+            ecg = np.clip(np.round(ecg), 0, ECG_FULL_SCALE).astype(np.int64)
+
+            imuT = np.arange(int(np.ceil(t0 * s.fsIMU)), int(np.ceil(t1 * s.fsIMU))) / s.fsIMU
+            ax, ay, az, pitch = RenderIMU(imuT, s.respRateBrpm, s.basePitchDeg, s.tiltDepthDeg, s.imuNoise, rng)
+            mag = np.asarray(s.magnetometer)[None, :] + 0.2 * rng.standard_normal((imuT.size, 3))
+            roll = np.zeros(imuT.size)
+            head = s.headingDeg + 0.2 * rng.standard_normal(imuT.size)
+            imuFields = np.column_stack((ax, ay, az, mag, roll, pitch, head))
+
+            yield (ecgT, self.Timestamps(ecgT, rng), ecg, SyntheticManual(ecgT, s.respRateBrpm, s.inhaleFraction),
+                   imuT, self.Timestamps(imuT, rng), imuFields, SyntheticManual(imuT, s.respRateBrpm, s.inhaleFraction))
+
+    def Timestamps(self, timeS, rng):
+        ts = self.spec.startUs + np.round(timeS * 1e6 + self.spec.jitterUs * rng.standard_normal(timeS.size))
+        return ts.astype(np.int64) % MICROS_WRAP
+
+    def Lines(self, chunkS=60.0, withManual=False):
+        """
+        Yield bytes blocks of lines in time order: raw firmware lines ("ts,KIND,...") or,
+        with withManual=True, TimeSync recording rows ('"ts,KIND,...",manual').
+        """
+        s = self.spec
+        ecgFmt, imuFmt = "%d,ECG,,,,,,,,,%d", "%d,IMU,%.3f,%.3f,%.3f,%.3f,%.3f,%.3f,%.3f,%.3f,%.3f"
+        if withManual:
+            ecgFmt, imuFmt = f'"{ecgFmt}",%d', f'"{imuFmt}",%d'
+
+        for k, (ecgT, ecgTs, ecg, ecgManual, imuT, imuTs, imuFields, imuManual) in enumerate(self.Chunks(chunkS)):
+            if withManual:
+                ecgRows = zip(ecgTs.tolist(), ecg.tolist(), ecgManual.tolist())
+                imuRows = ((ts, *fields, m) for ts, fields, m in zip(imuTs.tolist(), imuFields.tolist(), imuManual.tolist()))
+            else:
+                ecgRows = zip(ecgTs.tolist(), ecg.tolist())
+                imuRows = ((ts, *fields) for ts, fields in zip(imuTs.tolist(), imuFields.tolist()))
+            lines = [ecgFmt % r for r in ecgRows] + [imuFmt % r for r in imuRows]
+
+            # Interleave the streams by sample time (not the wrapped timestamp)
+            order = np.argsort(np.concatenate((ecgT, imuT)), kind="stable")
+            if s.dropRate > 0:
+                keep = np.random.default_rng((s.seed, k, 1)).random(order.size) >= s.dropRate
+                order = order[keep]
+            yield ("\n".join([lines[i] for i in order]) + "\n").encode()
+
+    def WriteRecording(self, path, chunkS=60.0):
+        """Write the session as a TimeSync recording CSV (header + quoted rows + Manual)."""
+        with open(path, "wb") as f:
+            f.write(b"ESP32_Data,Manual\n")
+            for block in self.Lines(chunkS, withManual=True):
+                f.write(block)
+        return path
+
+
+class SyntheticSerial:
+    """
+    Serial-port stand-in that replays a SyntheticSession as raw firmware lines, for
+    driving RunLiveRR without hardware. realtime=True paces lines at the device rate;
+    otherwise they come as fast as they are read. Reading past the end raises EOFError.
+    """
+
+    def __init__(self, session, realtime=False, chunkS=10.0):
+        import time
+        self.clock = time.monotonic
+        self.sleep = time.sleep
+        self.blocks = session.Lines(chunkS)
+        self.buffer = b""
+        self.pos = 0  # read offset into buffer; slicing per line would make replays quadratic
+        self.linesPerS = session.spec.fsECG + session.spec.fsIMU
+        self.realtime = realtime
+        self.nRead = 0
+        self.tStart = None
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer) - self.pos
+
+    def readline(self):
+        if self.realtime:
+            if self.tStart is None:
+                self.tStart = self.clock()
+            ahead = self.nRead / self.linesPerS - (self.clock() - self.tStart)
+            if ahead > 0:
+                self.sleep(ahead)
+        end = self.buffer.find(b"\n", self.pos)
+        while end < 0:
+            block = next(self.blocks, None)
+            if block is None:
+                raise EOFError("synthetic session finished")
+            self.buffer, self.pos = self.buffer[self.pos:] + block, 0
+            end = self.buffer.find(b"\n")
+        line = self.buffer[self.pos:end + 1]
+        self.pos = end + 1
+        self.nRead += 1
+        return line
+
+    def close(self):
+        self.blocks.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Write a synthetic recording in the TimeSync CSV format.")
+    parser.add_argument("out", help="output CSV (or - for raw firmware lines on stdout)")
+    parser.add_argument("--duration", type=float, default=120.0, help="seconds")
+    parser.add_argument("--rr", type=float, nargs="+", default=[15.0],
+                        help="breathing rate in brpm; several values ramp linearly across the session")
+    parser.add_argument("--hr", type=float, default=70.0, help="heart rate in bpm")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of lines to drop")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rr = args.rr[0] if len(args.rr) == 1 else tuple(zip(np.linspace(0, args.duration, len(args.rr)), args.rr))
+    session = SyntheticSession(SessionSpec(durationS=args.duration, respRateBrpm=rr, heartRateBpm=args.hr,
+                                           dropRate=args.drop_rate, seed=args.seed))
+    t0 = time.perf_counter()
+    if args.out == "-":
+        import sys
+        for block in session.Lines():
+            sys.stdout.buffer.write(block)
+    else:
+        session.WriteRecording(args.out)
+        print(f"Wrote {args.duration:.0f} s (mean RR {session.MeanRR():.2f} brpm) to {args.out} "
+              f"in {time.perf_counter() - t0:.1f} s")
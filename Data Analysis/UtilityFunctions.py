@@ -1,20 +1,263 @@
-from scipy.signal import butter, filtfilt, find_peaks, welch
+# SciPy is imported inside the functions that need it so importing this module stays cheap
+# (e.g. ComputeMagnitude or UniformTimebase alone never load scipy.signal).
 import numpy as np
+from collections import deque
+from dataclasses import dataclass
+from fractions import Fraction
+from functools import lru_cache
+import FastKernels as FK
 
 RESP_LOW_BAND = 0.05 # Breathing rate lower bound in Hz (3 brpm)
 RESP_HIGH_BAND = 0.5 # Breathing rate upper bound in Hz (30 brpm)
 
 
-def BandpassFilter(signal, samplingFreq, low=0.05, high=0.8, order=4):
+@lru_cache(maxsize=64)
+def ButterCoeffs(order, cutoffs, samplingFreq, btype):
+    """Cached Butterworth (b, a) so repeated hops and stacked channels share one design."""
+    from scipy.signal import butter
     nyq = 0.5 * samplingFreq
-    b, a = butter(order, [low / nyq, high / nyq], btype='band')
-    return filtfilt(b, a, signal)
+    wn = tuple(c / nyq for c in cutoffs) if len(cutoffs) > 1 else cutoffs[0] / nyq
+    return butter(order, wn, btype=btype)
 
-def HighpassFilter(signal, samplingFreq, cutoff_hz=4/60.0, order=2): # Cutoff at 4 breaths per minute
+@lru_cache(maxsize=64)
+def ButterSOSFloat32(order, cutoffs, samplingFreq, btype):
+    """Cached float32 second-order sections for the float32 processing mode."""
+    from scipy.signal import butter
     nyq = 0.5 * samplingFreq
-    b, a = butter(order, cutoff_hz/nyq, btype='highpass')
-    return filtfilt(b, a, signal)
+    wn = tuple(c / nyq for c in cutoffs) if len(cutoffs) > 1 else cutoffs[0] / nyq
+    return butter(order, wn, btype=btype, output='sos').astype(np.float32)
 
+def FloatArray(x, dtype=None):
+    """
+    Float array for DSP. float32 input stays float32 (opt-in float32 mode),
+    anything else becomes float64 unless dtype is given explicitly.
+    """
+    if dtype is None:
+        dtype = np.float32 if getattr(x, "dtype", None) == np.float32 else np.float64
+    return np.asarray(x, dtype=dtype)
+
+def StackChannels(*channels, dtype=np.float64):
+    """Stack equal-length 1-D channels into one contiguous (channels x samples) float array."""
+    return np.ascontiguousarray(np.vstack([np.asarray(c, dtype=dtype) for c in channels]))
+
+def ZeroPhaseFilter(signal, order, cutoffs, samplingFreq, btype, axis=-1):
+    """filtfilt in float64; float32 input is filtered as float32 SOS (tf form is too ill-conditioned)."""
+    from scipy.signal import filtfilt, sosfiltfilt
+    x = np.asarray(signal)
+    if x.dtype == np.float32:
+        return sosfiltfilt(ButterSOSFloat32(order, cutoffs, samplingFreq, btype), x, axis=axis)
+    b, a = ButterCoeffs(order, cutoffs, samplingFreq, btype)
+    return filtfilt(b, a, x, axis=axis)
+
+def FiltfiltPadlen(order, btype):
+    """Edge padding filtfilt uses for a Butterworth of this order; signals must be longer than this."""
+    nCoeffs = 2 * order + 1 if btype in ("band", "bandpass", "bandstop") else order + 1
+    return 3 * nCoeffs
+
+def BandpassFilter(signal, samplingFreq, low=0.05, high=0.8, order=4, axis=-1):
+    """Zero-phase bandpass. 2-D input is filtered along axis (time) for every channel at once."""
+    return ZeroPhaseFilter(signal, order, (low, high), samplingFreq, 'band', axis=axis)
+
+def HighpassFilter(signal, samplingFreq, cutoff_hz=4/60.0, order=2, axis=-1): # Cutoff at 4 breaths per minute
+    return ZeroPhaseFilter(signal, order, (cutoff_hz,), samplingFreq, 'highpass', axis=axis)
+
+
+class UniformTimebase:
+    """
+    Uniform time axis stored as (t0, fs, n) instead of a materialized array.
+    Index <-> time conversion is arithmetic. len(), integer/array/slice indexing and
+    np.asarray() behave like the equivalent np.arange(n) / fs + t0 vector, so it can be
+    passed anywhere a time vector is accepted (interp, plotting, windowing).
+    """
+    __slots__ = ("t0", "fs", "n")
+
+    def __init__(self, t0, fs, n):
+        self.t0 = float(t0)
+        self.fs = float(fs)
+        self.n = int(n)
+
+    @classmethod
+    def FromRange(cls, tStart, tEnd, fs):
+        """Same samples as np.arange(tStart, tEnd, 1/fs)."""
+        n = max(0, int(np.ceil((tEnd - tStart) * fs - 1e-9)))
+        return cls(tStart, fs, n)
+
+    @property
+    def dt(self):
+        return 1.0 / self.fs
+
+    def __len__(self):
+        return self.n
+
+    def Time(self, idx):
+        """Time (s) of sample index (scalar or array)."""
+        return self.t0 + np.asarray(idx) / self.fs
+
+    def Index(self, t):
+        """Nearest sample index for time t (s), clipped to the axis."""
+        return np.clip(np.rint((np.asarray(t) - self.t0) * self.fs).astype(int), 0, max(self.n - 1, 0))
+
+    def IndexSlice(self, tStart, tEnd, inclusiveEnd=False):
+        """Slice of samples with tStart <= t < tEnd (or <= tEnd)."""
+        i0 = int(np.ceil((tStart - self.t0) * self.fs - 1e-9))
+        if inclusiveEnd:
+            i1 = int(np.floor((tEnd - self.t0) * self.fs + 1e-9)) + 1
+        else:
+            i1 = int(np.ceil((tEnd - self.t0) * self.fs - 1e-9))
+        return slice(min(max(i0, 0), self.n), min(max(i1, 0), self.n))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.n)
+            if step == 1:
+                return UniformTimebase(self.t0 + start / self.fs, self.fs, max(0, stop - start))
+            return self.Time(np.arange(start, stop, step))
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.n
+            if not 0 <= key < self.n:
+                raise IndexError("UniformTimebase index out of range")
+            return self.t0 + key / self.fs
+        idx = np.asarray(key)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        return self.Time(idx)
+
+    def __array__(self, dtype=None, copy=None):
+        t = self.Time(np.arange(self.n))
+        return t if dtype is None else t.astype(dtype)
+
+    def __repr__(self):
+        return f"UniformTimebase(t0={self.t0}, fs={self.fs}, n={self.n})"
+
+def AsTimeAxis(timeAxis):
+    """UniformTimebase passes through untouched, anything else becomes a float array."""
+    if isinstance(timeAxis, UniformTimebase):
+        return timeAxis
+    return np.asarray(timeAxis, dtype=float)
+
+def SamplingRate(timeAxis):
+    """Sampling rate of a uniform time axis (exact for UniformTimebase, median dt otherwise)."""
+    if isinstance(timeAxis, UniformTimebase):
+        return timeAxis.fs
+    dt = np.median(np.diff(np.asarray(timeAxis, dtype=float)))
+    return 1.0 / dt if np.isfinite(dt) and dt > 0 else np.nan
+
+def WindowSelect(timeAxis, tStart, tEnd, inclusiveEnd=False):
+    """Selector for samples inside [tStart, tEnd): a slice for UniformTimebase, a mask otherwise."""
+    if isinstance(timeAxis, UniformTimebase):
+        return timeAxis.IndexSlice(tStart, tEnd, inclusiveEnd)
+    upper = (timeAxis <= tEnd) if inclusiveEnd else (timeAxis < tEnd)
+    return (timeAxis >= tStart) & upper
+
+
+MICROS_WRAP = 2**32  # the ESP32 micros() counter rolls over every ~71.6 min
+
+def UnwrapMicros(timestampsUs, wrap=MICROS_WRAP):
+    """
+    Unwrap a micros() sequence (in arrival order) into monotonic microseconds (float64).
+    Each step is taken modulo the wrap period as a signed value (as MicrosUnwrapper does),
+    so lines slightly out of order across a rollover don't count it twice; NaN timestamps
+    (malformed lines) stay NaN. Returns (unwrapped, nWraps).
+    """
+    ts = np.asarray(timestampsUs, dtype=float)
+    finite = np.isfinite(ts)
+    out = np.full(ts.shape, np.nan)
+    if not finite.any():
+        return out, 0
+    t = ts[finite].astype(np.int64)
+    half = wrap // 2
+    step = (np.diff(t) + half) % wrap - half
+    unwrapped = t[0] + np.concatenate(([0], np.cumsum(step)))
+    out[finite] = unwrapped
+    return out, int((unwrapped[-1] - t[-1]) // wrap)
+
+
+class MicrosUnwrapper:
+    """Incremental UnwrapMicros for the live path: one timestamp at a time, O(1)."""
+    __slots__ = ("wrap", "lastRaw", "unwrapped")
+
+    def __init__(self, wrap=MICROS_WRAP):
+        self.wrap = wrap
+        self.lastRaw = None
+        self.unwrapped = 0.0
+
+    def Push(self, timestampUs):
+        if self.lastRaw is None:
+            self.unwrapped = float(timestampUs)
+        else:
+            # Signed step modulo the wrap, so small out-of-order steps stay small
+            half = self.wrap // 2
+            self.unwrapped += (int(timestampUs) - self.lastRaw + half) % self.wrap - half
+        self.lastRaw = int(timestampUs)
+        return self.unwrapped
+
+
+@dataclass(slots=True)
+class ResampledStream:
+    """One sensor stream on an exact uniform grid, from ResampleStream"""
+    values: np.ndarray       # (samples,) or (channels x samples) on the grid
+    time: UniformTimebase
+    valid: np.ndarray        # False where the grid falls in an unrepaired gap
+    nGaps: int               # gaps longer than gapFactor sample periods
+    nRepaired: int           # of which short enough to interpolate across
+    fsMeasured: float        # median rate of the raw timestamps
+
+def ResampleStream(timeS, values, samplingFreq, maxRepairS=0.1, gapFactor=1.5, t0=None):
+    """
+    Resample a jittery, gappy stream onto the exact grid t0 + k / samplingFreq.
+    timeS are the sample times in s (e.g. unwrapped micros / 1e6), values is (samples,)
+    or (channels x samples). Gaps up to maxRepairS are bridged by linear interpolation;
+    grid points inside longer gaps are still interpolated but flagged invalid, so callers
+    can skip estimators on them. All channels are interpolated in one vectorized pass.
+    """
+    t = np.asarray(timeS, dtype=float)
+    x = np.asarray(values)
+    dtype = np.float32 if x.dtype == np.float32 else np.float64
+
+    # Drop non-finite times, put late lines back in order and drop repeats
+    keep = np.isfinite(t)
+    if not keep.all():
+        t, x = t[keep], x[..., keep]
+    if t.size and np.any(np.diff(t) <= 0):
+        t, first = np.unique(t, return_index=True)
+        x = x[..., first]
+
+    start = (t[0] if t.size else 0.0) if t0 is None else t0
+    nGrid = int(np.floor((t[-1] - start) * samplingFreq + 1e-9)) + 1 if t.size else 0  # grid ends at the last sample
+    grid = UniformTimebase(start, samplingFreq, max(nGrid, 0))
+    if t.size < 2 or grid.n == 0:
+        out = np.zeros(x.shape[:-1] + (grid.n,), dtype=dtype)
+        return ResampledStream(out, grid, np.zeros(grid.n, dtype=bool), 0, 0, np.nan)
+
+    # Bracketing raw samples and linear weights for every grid point (shared by all channels)
+    tg = np.asarray(grid)
+    i1 = np.clip(np.searchsorted(t, tg, side="right"), 1, t.size - 1)
+    i0 = i1 - 1
+    w = np.clip((tg - t[i0]) / (t[i1] - t[i0]), 0.0, 1.0).astype(dtype)
+    out = x[..., i0].astype(dtype) * (1 - w) + x[..., i1].astype(dtype) * w
+
+    # Gaps: intervals longer than gapFactor periods; long ones invalidate the grid points inside
+    dt = np.diff(t)
+    gap = dt > gapFactor / samplingFreq
+    longGap = gap & (dt > maxRepairS)
+    valid = ~longGap[i0] | (tg == t[i0])
+    eps = 1e-3 / samplingFreq  # grid arithmetic round-off at the ends
+    valid &= (tg >= t[0] - eps) & (tg <= t[-1] + eps)
+    return ResampledStream(out, grid, valid, int(gap.sum()), int((gap & ~longGap).sum()), 1.0 / float(np.median(dt)))
+
+
+def Decimate(signal, samplingFreq, targetFs, axis=-1):
+    """
+    Anti-alias and downsample with a polyphase FIR (resample_poly).
+    The rate ratio is rounded to a small fraction, the achieved rate is returned with the signal.
+    """
+    ratio = Fraction(targetFs / samplingFreq).limit_denominator(1000)
+    if ratio >= 1:
+        return np.asarray(signal), samplingFreq
+    from scipy.signal import resample_poly
+    decimated = resample_poly(signal, ratio.numerator, ratio.denominator, axis=axis, padtype="line")
+    return decimated, samplingFreq * ratio.numerator / ratio.denominator
 
 def ComputeMagnitude(ax, ay, az):
     return np.sqrt(ax**2 + ay**2 + az**2)
@@ -25,11 +268,12 @@ def FilterRisingEges(riseTimes, maxBrpm = 30):
     rt = np.asarray(riseTimes, dtype=float)
     if rt.size == 0:
         return rt
-    keep = [0]
-    for t in range(1, rt.size):
-        if (rt[t] - rt[keep[-1]]) >= mindt:
-            keep.append(t)
-    return rt[keep]
+    return FK.DebounceEdges(rt, mindt)
+
+def FilterRisingEgesVectorized(riseTimes, maxBrpm = 30):
+    """Vectorized FilterRisingEges for long offline recordings (same output, no per-edge loop)."""
+    mindt = 60.0 / maxBrpm
+    return FK.DebounceEdgesNumpy(riseTimes, mindt)
 
 def MOBrpm(manualSignal, timeSeconds, minBrpm=30):
     """ Calculate the breathing rate from manual observations."""
@@ -37,7 +281,7 @@ def MOBrpm(manualSignal, timeSeconds, minBrpm=30):
     # A rising edge is where the signal goes from 0 to 1
     # A breath cycle is from one rising edge to the next
     # Count the number of breaths and calculate the time duration
-    t = np.asarray(timeSeconds, dtype=float)
+    t = AsTimeAxis(timeSeconds)
     m = np.asarray(manualSignal, dtype=int)
 
     # Find rising edges
@@ -50,7 +294,7 @@ def MOBrpm(manualSignal, timeSeconds, minBrpm=30):
     
     # Filter out rising edges which occured within the maximum brpm rate
     riseT = t[riseIdx]
-    riseT = FilterRisingEges(riseT)
+    riseT = FilterRisingEgesVectorized(riseT)
 
     if riseT.size < 2:
         return 0
@@ -59,3 +303,43 @@ def MOBrpm(manualSignal, timeSeconds, minBrpm=30):
     duration_s = riseT[-1] - riseT[0]
 
     return float(60.0 * breath_count / duration_s)
+
+
+class ManualBreathTracker:
+    """
+    Incremental manual (spacebar) breathing rate for the live path.
+    Rising edges are debounced as they arrive, so each sample costs O(1)
+    instead of re-running MOBrpm over the whole window every hop.
+    """
+
+    def __init__(self, samplingFreq, windowS=30, maxBrpm=30):
+        self.samplingFreq = samplingFreq
+        self.windowN = int(round(windowS * samplingFreq))
+        self.minGapN = 60.0 / maxBrpm * samplingFreq  # debounce in samples
+
+        self.edges = deque()  # sample index of each kept rising edge
+        self.lastEdge = None  # last kept edge, may already be outside the window
+        self.prev = 0
+        self.n = 0
+
+    def Push(self, manualSignal):
+        """Push one manual sample (0/1)."""
+        m = 1 if manualSignal else 0
+        if m == 1 and self.prev == 0 and self.n > 0:
+            if self.lastEdge is None or (self.n - self.lastEdge) >= self.minGapN:
+                self.edges.append(self.n)
+                self.lastEdge = self.n
+        self.prev = m
+        self.n += 1
+
+        # Drop edges that slid out of the window
+        oldest = self.n - self.windowN
+        while self.edges and self.edges[0] <= oldest:
+            self.edges.popleft()
+
+    def Brpm(self):
+        """Manual breathing rate over the current window (0 if fewer than two edges)."""
+        if len(self.edges) < 2:
+            return 0
+        durationS = (self.edges[-1] - self.edges[0]) / self.samplingFreq
+        return float(60.0 * (len(self.edges) - 1) / durationS)
@@ -0,0 +1,10 @@
+"""
+The analysis modules import each other by name; make Data Analysis (and the live script
+in Recording Scripts/Recording Sessions) importable from the tests.
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "Recording Scripts" / "Recording Sessions"))
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,47 @@
+"""FastKernels against the per-element loops they replaced."""
+import numpy as np
+import pytest
+import ECGDerivedRR as ECG
+import FastKernels as FK
+import UtilityFunctions as UF
+
+
+def OnsetsBeforeRLoop(ecg, rIndices, win):
+    """The original FindOnsetsBeforeR loop."""
+    onsets, kept = [], []
+    for ri in rIndices:
+        i0 = max(0, ri - win)
+        if ri <= i0:
+            continue
+        best = i0 + int(np.argmin(ecg[i0:ri + 1]))
+        if best >= ri:
+            continue
+        onsets.append(best)
+        kept.append(ri)
+    return np.array(onsets, dtype=np.int64), np.array(kept, dtype=np.int64)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32, np.int64, np.int16])
+@pytest.mark.parametrize("kernel", [FK.OnsetsBeforeRNumpy, FK.OnsetsBeforeR])
+def test_onsets_before_r_matches_loop(kernel, dtype):
+    rng = np.random.default_rng(0)
+    fs, win = 500, 50
+    ecg = (2048 + 300 * rng.standard_normal(fs * 20)).astype(dtype)  # ADC-like counts
+    ecg[1000:1060] = ecg[1000]  # flat stretch: ties resolve to the first minimum
+    rIndices = np.concatenate(([0, 3, win], np.arange(fs, ecg.size, int(0.8 * fs)), [1030]))
+    rIndices.sort()
+
+    onsets, kept = kernel(ecg, rIndices, win)
+    refOnsets, refKept = OnsetsBeforeRLoop(ecg, rIndices, win)
+    np.testing.assert_array_equal(onsets, refOnsets)
+    np.testing.assert_array_equal(kept, refKept)
+
+
+def test_onsets_before_r_without_beats():
+    fs = 500
+    ecg = np.zeros(fs * 30)  # lead off: no R-peaks
+    onsets, kept = ECG.FindOnsetsBeforeR(ecg, fs)
+    assert onsets.size == 0 and kept.size == 0
+    timeS = UF.UniformTimebase(0.0, fs, ecg.size)
+    assert ECG.CalcAM(ecg, timeS, fs)[0] is None
+    assert ECG.CalcBW(ecg, timeS, fs)[0] is None
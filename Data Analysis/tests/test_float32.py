@@ -0,0 +1,54 @@
+"""float32 mode of LiveDerivation against the float64 path on synthetic sessions."""
+import numpy as np
+import pytest
+import IMUDerivedRR as IMU
+import SyntheticSignals as SS
+from LiveDerivationClass import LiveDerivation
+
+FS_IMU, FS_ECG = 50.0, 500.0
+DURATION_S = 75
+
+# Single precision may flip an argmax / peak gate on a hop now and then, so the bound
+# is on the bulk of the hops rather than every one
+TOLERANCE_BRPM = 0.5
+MIN_WITHIN = 0.9
+MAX_MEDIAN_BRPM = 0.1
+
+
+def Replay(dtype, respRateBrpm):
+    """(IMU hop rates (hops x 3), EDR hop rates) of one synthetic session."""
+    imuTime, ax, ay, az, pitch = SS.SyntheticIMU(DURATION_S, fs=FS_IMU, respRateBrpm=respRateBrpm)
+    _, accelPitch = IMU.AccelTilt(ax, ay, az)
+    manual = SS.SyntheticManual(imuTime, respRateBrpm)
+    ecg, _ = SS.SyntheticECG(DURATION_S, fs=FS_ECG, respRateBrpm=respRateBrpm)
+    ecgPerIMU = int(round(FS_ECG / FS_IMU))
+
+    live = LiveDerivation(FS_IMU, FS_ECG, dtype=dtype, status=None)
+    imuRR, edrRR = [], []
+    for i in range(imuTime.size):
+        for ecgSample in ecg[i * ecgPerIMU:(i + 1) * ecgPerIMU]:
+            live.UpdateECG(ecgSample)
+        edr = live.ComputeEDR()
+        if edr is not None:
+            edrRR.append(edr.RR)
+        hop = live.Update(az[i], pitch[i], accelPitch[i], manual[i], accel=(ax[i], ay[i], az[i]))
+        if hop is not None:
+            imuRR.append((hop.z.RR, hop.pitch.RR, hop.accelPitch.RR))
+    return np.array(imuRR), np.array(edrRR)
+
+
+def AssertClose(rr32, rr64):
+    assert rr32.shape == rr64.shape and rr64.size > 0
+    diff = np.abs(rr32 - rr64)
+    assert np.array_equal(np.isfinite(rr32), np.isfinite(rr64))
+    diff = diff[np.isfinite(diff)]
+    assert np.mean(diff <= TOLERANCE_BRPM) >= MIN_WITHIN
+    assert np.median(diff) <= MAX_MEDIAN_BRPM
+
+
+@pytest.mark.parametrize("respRateBrpm", [12.0, 18.0])
+def test_float32_matches_float64(respRateBrpm):
+    imu32, edr32 = Replay(np.float32, respRateBrpm)
+    imu64, edr64 = Replay(np.float64, respRateBrpm)
+    AssertClose(imu32, imu64)
+    AssertClose(edr32, edr64)
@@ -0,0 +1,31 @@
+"""Import-time budget: the live-path modules must load NumPy only, never SciPy / plotting."""
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+HERE = Path(__file__).resolve().parent.parent
+MODULES = ("UtilityFunctions", "ECGDerivedRR", "IMUDerivedRR", "LiveDerivationClass")
+DEFERRED = ("scipy", "matplotlib", "numba", "pandas")
+BUDGET_S = 0.5  # NumPy alone is ~0.1 s here
+
+
+def ImportTimes(module):
+    """{module: cumulative import time (s)} from python -X importtime in a fresh interpreter."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=HERE,
+                         capture_output=True, text=True, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import_is_light(module):
+    times = ImportTimes(module)
+    eager = sorted(name for name in times if name.split(".")[0] in DEFERRED)
+    assert not eager, f"{module} imports {eager} eagerly"
+    assert times[module] < BUDGET_S
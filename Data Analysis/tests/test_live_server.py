@@ -0,0 +1,183 @@
+"""RRServer end to end on localhost: SSE, WebSocket, /latest, dropping a stalled client, and the times RunLiveRR publishes."""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import time
+import urllib.request
+import numpy as np
+import pytest
+import LiveServer as LS
+import SyntheticSignals as SS
+from LiveDerivationClass import EDRResult
+
+TIMEOUT_S = 5.0
+
+
+@pytest.fixture
+def server():
+    srv = LS.RRServer(port=0, stallS=0.5, keepaliveS=0.5).Start()
+    yield srv
+    srv.Stop()
+
+
+def Connect(server, request):
+    sock = socket.create_connection((server.host, server.port), timeout=TIMEOUT_S)
+    sock.sendall(request)
+    return sock
+
+def RecvUntil(sock, buffer, marker):
+    """buffer extended from sock until it contains marker."""
+    deadline = time.monotonic() + TIMEOUT_S
+    while marker not in buffer:
+        assert time.monotonic() < deadline, f"no {marker!r} in {buffer[:200]!r}"
+        data = sock.recv(65536)
+        assert data, f"connection closed before {marker!r}"
+        buffer += data
+    return buffer
+
+def RecvExactly(sock, buffer, n):
+    while len(buffer) < n:
+        data = sock.recv(65536)
+        assert data, "connection closed mid-frame"
+        buffer += data
+    return buffer
+
+def OpenWS(server):
+    """(socket, bytes after the handshake) of a WebSocket client on /ws."""
+    key = base64.b64encode(os.urandom(16))
+    sock = Connect(server, b"GET /ws HTTP/1.1\r\nHost: test\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                           b"Sec-WebSocket-Key: " + key + b"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    buffer = RecvUntil(sock, b"", b"\r\n\r\n")
+    head, _, rest = buffer.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 101")
+    accept = base64.b64encode(hashlib.sha1(key + LS.WS_GUID).digest())
+    assert b"Sec-WebSocket-Accept: " + accept in head
+    return sock, rest
+
+def NextWSFrame(sock, buffer):
+    """(opcode, payload, rest of buffer) of the next unmasked server frame."""
+    buffer = RecvExactly(sock, buffer, 2)
+    n, start = buffer[1] & 0x7F, 2
+    if n == 126:
+        buffer = RecvExactly(sock, buffer, 4)
+        n, start = struct.unpack("!H", buffer[2:4])[0], 4
+    elif n == 127:
+        buffer = RecvExactly(sock, buffer, 10)
+        n, start = struct.unpack("!Q", buffer[2:10])[0], 10
+    buffer = RecvExactly(sock, buffer, start + n)
+    return buffer[0] & 0x0F, buffer[start:start + n], buffer[start + n:]
+
+def MaskedFrame(payload, opcode):
+    """A client frame as a browser sends it."""
+    mask = os.urandom(4)
+    n = len(payload)
+    header = bytes([0x80 | opcode]) + (bytes([0x80 | n]) if n < 126 else bytes([0x80 | 126]) + struct.pack("!H", n))
+    return header + mask + bytes(c ^ mask[i % 4] for i, c in enumerate(payload))
+
+
+def test_latest_and_events(server):
+    sse = Connect(server, b"GET /events HTTP/1.1\r\nHost: test\r\n\r\n")
+    server.Publish("edr", 12.5, EDRResult(14.8, fused=float("nan")))
+
+    buffer = RecvUntil(sse, b"", b"event: edr\ndata: ").split(b"event: edr\ndata: ", 1)[1]
+    message = json.loads(RecvUntil(sse, buffer, b"\n\n").split(b"\n\n")[0])
+    assert message["stream"] == "edr" and message["t"] == 12.5 and message["RR"] == 14.8
+    assert message["fused"] is None  # NaN goes out as null
+
+    with urllib.request.urlopen(f"http://{server.host}:{server.port}/latest", timeout=TIMEOUT_S) as response:
+        latest = json.loads(response.read())
+    assert latest["edr"] == message
+    sse.close()
+
+
+def test_ws_push_ping_and_close(server):
+    ws, buffer = OpenWS(server)
+    server.Publish("edr", 3.0, EDRResult(15.2))
+    opcode, payload, buffer = NextWSFrame(ws, buffer)
+    assert opcode == 0x1 and json.loads(payload)["RR"] == 15.2
+
+    ping = bytes(range(125))  # the largest control payload
+    ws.sendall(MaskedFrame(ping, 0x9))
+    opcode, payload, buffer = NextWSFrame(ws, buffer)
+    while opcode == 0x9:  # keepalive pings from the server
+        opcode, payload, buffer = NextWSFrame(ws, buffer)
+    assert (opcode, payload) == (0xA, ping)
+
+    ws.sendall(MaskedFrame(struct.pack("!H", 1000), 0x8))
+    opcode, payload, buffer = NextWSFrame(ws, buffer)
+    while opcode == 0x9:
+        opcode, payload, buffer = NextWSFrame(ws, buffer)
+    assert (opcode, payload) == (0x8, struct.pack("!H", 1000))
+    ws.close()
+
+
+@pytest.mark.parametrize("opcode, n", [(0x1, LS.WS_MAX_DATA + 1), (0x9, LS.WS_MAX_CONTROL + 1)])
+def test_ws_oversize_frame_closed_1009(server, opcode, n):
+    ws, buffer = OpenWS(server)
+    # Only the header is sent: the server must refuse on the length alone
+    ws.sendall(bytes([0x80 | opcode, 0x80 | 126]) + struct.pack("!H", n) + os.urandom(4))
+    opcode, payload, buffer = NextWSFrame(ws, buffer)
+    while opcode == 0x9:
+        opcode, payload, buffer = NextWSFrame(ws, buffer)
+    assert (opcode, payload) == (0x8, struct.pack("!H", LS.WS_CLOSE_TOO_BIG))
+    ws.close()
+
+
+def test_read_ws_frame_unmasks():
+    payload = os.urandom(LS.WS_MAX_DATA)
+
+    async def Read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(MaskedFrame(payload, 0x2))
+        reader.feed_eof()
+        return await LS.ReadWSFrame(reader)
+
+    assert asyncio.run(Read()) == (0x2, payload)
+
+
+def test_slow_client_dropped(server):
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect((server.host, server.port))
+    slow.sendall(b"GET /events HTTP/1.1\r\nHost: test\r\n\r\n")  # and never reads
+
+    pad = "x" * 50000
+    deadline = time.monotonic() + TIMEOUT_S
+    i = 0
+    while server.disconnectedSlow == 0:
+        assert time.monotonic() < deadline, "stalled client was never dropped"
+        server.Publish("imu", i * 0.01, EDRResult(15.0), pad=pad)
+        time.sleep(0.01)
+        i += 1
+    assert server.disconnectedSlow == 1
+
+    # The server keeps serving everyone else
+    with urllib.request.urlopen(f"http://{server.host}:{server.port}/latest", timeout=TIMEOUT_S) as response:
+        assert json.loads(response.read())["imu"]["pad"] == pad
+    slow.close()
+
+
+def test_script_publishes_session_time_across_rollover(monkeypatch):
+    import LiveDerivationScript as LDS
+    published = []
+    publish = LS.RRServer.Publish
+
+    def Record(self, stream, tS, result, **extra):
+        published.append(LS.HopMessage(stream, tS, result, **extra))
+        publish(self, stream, tS, result, **extra)
+
+    monkeypatch.setattr(LS.RRServer, "Publish", Record)
+    durationS, windowS = 60, 30
+    session = SS.SyntheticSession(SS.SessionSpec(durationS=durationS, startUs=2**32 - 10_000_000))
+    LDS.RunLiveRR(SS.SyntheticSerial(session), window=windowS, plot=False, manualKey=None, serve="127.0.0.1:0")
+
+    for stream in ("imu", "edr"):
+        t = np.array([m["t"] for m in published if m["stream"] == stream])
+        assert t.size > 10
+        # First hop once the window has filled, long after micros() rolled over at 10 s
+        assert windowS - 1 < t[0] and t[-1] < durationS
+        assert np.all(np.diff(t) > 0)
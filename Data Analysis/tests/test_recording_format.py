@@ -0,0 +1,67 @@
+"""CSV + sidecar index and .rrb recordings against a full CSV parse, across a micros() rollover."""
+import numpy as np
+import pandas as pd
+import pytest
+import DataLoading as DL
+import RecordingFormat as RF
+import SyntheticSignals as SS
+
+DURATION_S = 60
+WRAP_AT_S = 20  # micros() rolls over this far into the session
+
+
+@pytest.fixture(scope="module")
+def recording(tmp_path_factory):
+    """(csv path, rrb path, full CSV parse) of one synthetic session with dropped lines."""
+    folder = tmp_path_factory.mktemp("recording")
+    session = SS.SyntheticSession(SS.SessionSpec(durationS=DURATION_S, startUs=2**32 - WRAP_AT_S * 1_000_000,
+                                                 dropRate=0.02))
+    csvPath = session.WriteRecording(folder / "session.csv")
+    rrbPath = folder / "session.rrb"
+    RF.ConvertCSV(csvPath, rrbPath, blockS=5.0)
+    return csvPath, rrbPath, DL.LoadData(csvPath)
+
+
+def AssertSameRows(df, expected):
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_full_load_is_monotonic_across_rollover(recording):
+    _, _, full = recording
+    t = full["Time (s)"].to_numpy()
+    assert t.min() > -1e-3 and t.max() < DURATION_S  # timestamp jitter: a few us either side
+    assert np.all(np.diff(np.sort(t)) < 1.0)  # no jump of a wrap period anywhere
+
+
+def test_rrb_full_load_matches_csv(recording):
+    _, rrbPath, full = recording
+    AssertSameRows(DL.LoadData(rrbPath), full)
+
+
+@pytest.mark.parametrize("start, end", [
+    (0, 10), (None, 5), (WRAP_AT_S - 3, WRAP_AT_S + 3), (12.345, 13.0), (DURATION_S - 3, None),
+    (DURATION_S + 5, DURATION_S + 10), (-5, 0.001),
+])
+@pytest.mark.parametrize("kind", ["csv", "rrb"])
+def test_range_load_matches_full_parse(recording, kind, start, end):
+    csvPath, rrbPath, full = recording
+    df = DL.LoadData(csvPath if kind == "csv" else rrbPath, start=start, end=end)
+    AssertSameRows(df, DL.SelectTimeRange(full, start, end))
+
+
+def test_scan_lines_independent_of_block_size(recording):
+    csvPath, _, _ = recording
+    starts, ts = DL.ScanLines(csvPath)
+    for blockBytes in (97, 4096):  # shorter than some lines / many lines per block
+        s, t = DL.ScanLines(csvPath, blockBytes)
+        np.testing.assert_array_equal(s, starts)
+        np.testing.assert_array_equal(t, ts)
+
+
+def test_index_rebuilt_for_another_interval(recording):
+    csvPath, _, _ = recording
+    coarse, originUs = DL.LoadCSVIndex(csvPath, intervalS=1.0)
+    fine, fineOriginUs = DL.LoadCSVIndex(csvPath, intervalS=0.25)
+    assert fineOriginUs == originUs
+    assert len(fine) > 3 * len(coarse)
+    assert fine["offset"][0] == coarse["offset"][0] and fine["end"][-1] == coarse["end"][-1]